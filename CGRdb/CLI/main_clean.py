@@ -16,39 +16,18 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from importlib import import_module
-from LazyPony import LazyEntityMeta
-from pkg_resources import get_distribution, DistributionNotFound, VersionConflict
-from pony.orm import db_session, Database
+from pony.orm import db_session
+from ..bootstrap import bootstrap
 
 
 def clean_core(args):
-    major_version = '.'.join(get_distribution('CGRdb').version.split('.')[:-1])
     schema = args.name
-
-    db_config = Database()
-    LazyEntityMeta.attach(db_config, database='CGRdb_config')
-    db_config.bind('postgres', **args.connection)
-    db_config.generate_mapping()
-
-    with db_session:
-        config = db_config.Config.get(name=schema, version=major_version)
-    if not config:
-        raise KeyError('schema not exists or version incompatible')
-    config = config.config
-
-    for p in config['packages']:
-        try:
-            p = get_distribution(p)
-            import_module(p.project_name)
-        except (DistributionNotFound, VersionConflict):
-            raise ImportError(f'packages not installed or has invalid versions: {p}')
-
-    db = Database()
-    LazyEntityMeta.attach(db, schema, 'CGRdb')
-    db.bind('postgres', **args.connection)
-    db.generate_mapping()
+    db, config = bootstrap(schema, **args.connection)
 
     with db_session:
-        db.execute(f'TRUNCATE TABLE "{schema}"."MoleculeSearchCache", '
-                   f'"{schema}"."ReactionSearchCache" RESTART IDENTITY')
+        if args.evict:  # remove only expired and least recently used entries
+            db.execute(f'SELECT "{schema}".cgrdb_evict_search_cache('
+                       f'{config.get("cache_ttl") or 0}, {config.get("cache_limit") or 0})')
+        else:
+            db.execute(f'TRUNCATE TABLE "{schema}"."MoleculeSearchCache", '
+                       f'"{schema}"."ReactionSearchCache" RESTART IDENTITY CASCADE')
@@ -17,26 +17,21 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from importlib import import_module
 from json import load
 from LazyPony import LazyEntityMeta
-from pkg_resources import get_distribution, DistributionNotFound, VersionConflict
 from pony.orm import db_session, Database
+from .. import database  # entities registration
+from ..metadata import check_packages, get_major_version
 from ..sql import *
 
 
 def create_core(args):
-    major_version = '.'.join(get_distribution('CGRdb').version.split('.')[:-1])
+    major_version = get_major_version()
     schema = args.name
     config = args.config and load(args.config) or {}
     if 'packages' not in config:
         config['packages'] = []
-    for p in config['packages']:
-        try:
-            p = get_distribution(p)
-            import_module(p.project_name)
-        except (DistributionNotFound, VersionConflict):
-            raise ImportError(f'packages not installed or has invalid versions: {p}')
+    check_packages(config['packages'])
 
     db_config = Database()
     LazyEntityMeta.attach(db_config, database='CGRdb_config')
@@ -63,6 +58,7 @@ def create_core(args):
 
     with db_session:
         db.execute(init_session.replace('{schema}', schema))
+        db.execute(search_stats.replace('{schema}', schema))
 
         db.execute(insert_molecule.replace('{schema}', schema))
         db.execute(after_insert_molecule.replace('{schema}', schema))
@@ -70,10 +66,19 @@ def create_core(args):
         db.execute(insert_reaction.replace('{schema}', schema))
         db.execute(merge_molecules.replace('{schema}', schema))
 
+        db.execute(search_cache_sequences.replace('{schema}', schema))
+        db.execute(search_cache_blocks.replace('{schema}', schema))
+        db.execute(molecule_generation.replace('{schema}', schema))
+        db.execute(reaction_generation.replace('{schema}', schema))
+        db.execute(evict_search_cache.replace('{schema}', schema))
+        db.execute(watermark_lock.replace('{schema}', schema))
+
         db.execute(insert_molecule_trigger.replace('{schema}', schema))
         db.execute(after_insert_molecule_trigger.replace('{schema}', schema))
         db.execute(delete_molecule_trigger.replace('{schema}', schema))
         db.execute(insert_reaction_trigger.replace('{schema}', schema))
+        db.execute(generation_triggers.replace('{schema}', schema))
+        db.execute(watermark_triggers.replace('{schema}', schema))
 
         db.execute(search_structure_molecule.replace('{schema}', schema))
         db.execute(search_structure_reaction.replace('{schema}', schema))
@@ -84,5 +89,13 @@ def create_core(args):
         db.execute(search_reactions_by_molecule.replace('{schema}', schema))
         db.execute(search_mappingless_reaction.replace('{schema}', schema))
 
+    with db_session:
+        db.execute(molecule_bits_index.replace('{schema}', schema))
+        db.execute(reaction_bits_index.replace('{schema}', schema))
+        if args.fingerprint_index:
+            method = fingerprint_index_methods[args.fingerprint_index]
+            db.execute(molecule_fingerprint_index.replace('{schema}', schema).replace('{method}', method))
+            db.execute(reaction_fingerprint_index.replace('{schema}', schema).replace('{method}', method))
+
     with db_session:
         db_config.Config(name=schema, config=config, version=major_version)
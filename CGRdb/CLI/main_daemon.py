@@ -20,24 +20,39 @@ from pickle import load
 
 
 def daemon_core(args):
-    from aiohttp.web import json_response, post, run_app, Application
+    from aiohttp.web import HTTPNotFound, Response, get, json_response, post, run_app, Application
+    from time import perf_counter
+    from ..index.metrics import Metrics
 
-    substructure_molecule, substructure_reaction, similarity_molecule, similarity_reaction = load(args.data)
+    substructure_molecule, substructure_reaction, similarity_molecule, similarity_reaction, molecule_reaction = \
+        load(args.data)
+    indexes = {'substructure/molecule': substructure_molecule, 'substructure/reaction': substructure_reaction,
+               'similarity/molecule': similarity_molecule, 'similarity/reaction': similarity_reaction,
+               'reactions/molecule': molecule_reaction}
+    metrics = Metrics(indexes)
 
     async def search(request):
-        _type = request.match_info.get('type')
-        target = request.match_info.get('target')
-        nonlocal substructure_molecule
-        nonlocal substructure_reaction
-        nonlocal similarity_molecule
-        nonlocal similarity_reaction
-
-        index = locals()[f'{_type}_{target}']
+        route = f"{request.match_info.get('type')}/{request.match_info.get('target')}"
+        try:
+            index = indexes[route]
+        except KeyError:
+            raise HTTPNotFound
 
         fingerprint = await request.json()
-        found = index.search(fingerprint)
+        stats = {}
+        start = perf_counter()
+        try:
+            found = index.search(fingerprint, stats)
+        except Exception:
+            metrics.errors.inc(f'route="{route}"')
+            raise
+        metrics.observe(route, perf_counter() - start,
+                        len(found['reactions']) if isinstance(found, dict) else len(found), stats)
         return json_response(found)
 
+    async def report(request):
+        return Response(text=metrics.render(), content_type='text/plain')
+
     app = Application()
-    app.add_routes([post('/{type}/{target}', search)])
+    app.add_routes([get('/metrics', report), post('/{type}/{target}', search)])
     run_app(app, **args.params)
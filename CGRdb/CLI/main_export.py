@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from sys import stderr
+from ..bootstrap import bootstrap
+
+
+def export_core(args):
+    from ..export import export_molecules, export_reactions
+
+    schema = args.name
+    db, config = bootstrap(schema, **args.connection)
+    db.disconnect()  # export opens own connections
+
+    def report(count, seconds):
+        print(f'\r{count} structures exported. {count / (seconds or 1e-9):.0f} per second', end='', file=stderr)
+
+    export = export_molecules if args.molecules else export_reactions
+    fmt = args.format or ('sdf' if args.molecules else 'rdf')
+    with args.output as f:
+        export(f, schema, args.connection, cache=args.cache, fmt=fmt, batch=args.batch, chunk=args.chunk,
+               workers=args.workers, report=None if args.quiet else report)
+    if not args.quiet:
+        print(file=stderr)
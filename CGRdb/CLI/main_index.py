@@ -16,62 +16,45 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from importlib import import_module
-from LazyPony import LazyEntityMeta
 from pickle import dump
-from pkg_resources import get_distribution, DistributionNotFound, VersionConflict
-from pony.orm import db_session, Database
+from pony.orm import db_session
+from ..bootstrap import bootstrap
 
 
 def index_core(args):
-    from ..index import SimilarityIndex, SubstructureIndex
+    from ..index import MoleculeReactionIndex
 
-    major_version = '.'.join(get_distribution('CGRdb').version.split('.')[:-1])
     schema = args.name
-
-    db_config = Database()
-    LazyEntityMeta.attach(db_config, database='CGRdb_config')
-    db_config.bind('postgres', **args.connection)
-    db_config.generate_mapping()
-
-    with db_session:
-        config = db_config.Config.get(name=schema, version=major_version)
-    if not config:
-        raise KeyError('schema not exists or version incompatible')
-    config = config.config
-
-    for p in config['packages']:
-        try:
-            p = get_distribution(p)
-            import_module(p.project_name)
-        except (DistributionNotFound, VersionConflict):
-            raise ImportError(f'packages not installed or has invalid versions: {p}')
-
-    db = Database()
-    LazyEntityMeta.attach(db, schema, 'CGRdb')
-    db.bind('postgres', **args.connection)
-    db.generate_mapping()
+    db, config = bootstrap(schema, **args.connection)
 
     if 'check_threshold' in args.params:
         sort_by_tanimoto = args.params['check_threshold'] is not None
     else:
         sort_by_tanimoto = True
 
+    substructure_molecule, similarity_molecule = _indexes(db, schema, 'MoleculeStructure', config['molecule'],
+                                                          sort_by_tanimoto, args.params)
+    substructure_reaction, similarity_reaction = _indexes(db, schema, 'ReactionIndex', config['reaction'],
+                                                          sort_by_tanimoto, args.params)
+
     with db_session:
-        substructure_molecule = SubstructureIndex(
-                db.execute(f'SELECT id, fingerprint FROM "{schema}"."MoleculeStructure"'), False)
-    with db_session:
-        similarity_molecule = SimilarityIndex(
-                db.execute(f'SELECT id, fingerprint FROM "{schema}"."MoleculeStructure"'), **args.params)
-    if sort_by_tanimoto:  # pairing fingerprints for memory saving
-        substructure_molecule._fingerprints = similarity_molecule._fingerprints
-    with db_session:
-        substructure_reaction = SubstructureIndex(db.execute(f'SELECT id, fingerprint FROM "{schema}"."ReactionIndex"'),
-                                                  False)
-    with db_session:
-        similarity_reaction = SimilarityIndex(
-                db.execute(f'SELECT id, fingerprint FROM "{schema}"."ReactionIndex"'), **args.params)
-    if sort_by_tanimoto:  # pairing fingerprints for memory saving
-        substructure_reaction._fingerprints = similarity_reaction._fingerprints
+        molecule_reaction = MoleculeReactionIndex(db.execute(
+                f'SELECT molecule, reaction, is_product FROM "{schema}"."MoleculeReaction" ORDER BY molecule'))
+
+    dump((substructure_molecule, substructure_reaction, similarity_molecule, similarity_reaction, molecule_reaction),
+         args.data)
+
+
+def _indexes(db, schema, table, config, sort_by_tanimoto, params):
+    from ..index import SimilarityIndex, SubstructureIndex
 
-    dump((substructure_molecule, substructure_reaction, similarity_molecule, similarity_reaction), args.data)
+    query = f'SELECT id, fingerprint FROM "{schema}"."{table}" ORDER BY id'
+    with db_session(serializable=True):  # both indexes are built from the same snapshot
+        substructure = SubstructureIndex(db.execute(query), False, config.get('length'))
+        similarity = SimilarityIndex(db.execute(query), **params)
+    if sort_by_tanimoto:  # pairing fingerprints for memory saving. same order gives same dense ids
+        if substructure._ids != similarity._ids:
+            raise ValueError(f'{table} changed during indexation')
+        substructure._fingerprints = similarity._fingerprints
+        substructure._ids = similarity._ids
+    return substructure, similarity
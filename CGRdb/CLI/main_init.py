@@ -18,6 +18,7 @@
 #
 from LazyPony import LazyEntityMeta
 from pony.orm import Database, db_session
+from .. import database  # entities registration
 
 
 def init_core(args):
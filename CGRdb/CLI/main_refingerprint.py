@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from json import load
+from sys import stderr
+
+
+def refingerprint_core(args):
+    from ..refingerprint import refingerprint
+
+    with args.config as f:
+        params = load(f)
+
+    last = None
+
+    def report(stage, count, seconds):
+        nonlocal last
+        if last not in (None, stage):  # stage finished
+            print(file=stderr)
+        last = stage
+        print(f'\r{stage}: {count} structures fingerprinted. {count / (seconds or 1e-9):.0f} per second',
+              end='', file=stderr)
+
+    refingerprint(args.name, args.connection, params, batch=args.batch, chunk=args.chunk, workers=args.workers,
+                  report=None if args.quiet else report)
+    if not args.quiet:
+        print(file=stderr)
+
+    if args.data:  # index of daemon rebuilt by new fingerprints
+        from .main_index import index_core
+        index_core(args)
@@ -16,42 +16,18 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from importlib import import_module
-from LazyPony import LazyEntityMeta
-from pkg_resources import get_distribution, DistributionNotFound, VersionConflict
-from pony.orm import db_session, Database
+from pony.orm import db_session
+from ..bootstrap import bootstrap
 from ..sql import *
 
 
 def update_core(args):
-    major_version = '.'.join(get_distribution('CGRdb').version.split('.')[:-1])
     schema = args.name
-
-    db_config = Database()
-    LazyEntityMeta.attach(db_config, database='CGRdb_config')
-    db_config.bind('postgres', **args.connection)
-    db_config.generate_mapping()
-
-    with db_session:
-        config = db_config.Config.get(name=schema, version=major_version)
-    if not config:
-        raise KeyError('schema not exists or version incompatible')
-    config = config.config
-
-    for p in config['packages']:
-        try:
-            p = get_distribution(p)
-            import_module(p.project_name)
-        except (DistributionNotFound, VersionConflict):
-            raise ImportError(f'packages not installed or has invalid versions: {p}')
-
-    db = Database()
-    LazyEntityMeta.attach(db, schema, 'CGRdb')
-    db.bind('postgres', **args.connection)
-    db.generate_mapping()
+    db, config = bootstrap(schema, check_tables=False, **args.connection)  # schema can be outdated
 
     with db_session:
         db.execute(init_session.replace('{schema}', schema))
+        db.execute(search_stats.replace('{schema}', schema))
 
         db.execute(insert_molecule.replace('{schema}', schema))
         db.execute(after_insert_molecule.replace('{schema}', schema))
@@ -59,6 +35,18 @@ def update_core(args):
         db.execute(insert_reaction.replace('{schema}', schema))
         db.execute(merge_molecules.replace('{schema}', schema))
 
+        db.execute(search_cache_sequences.replace('{schema}', schema))
+        db.execute(search_cache_migration.replace('{schema}', schema))
+        db.execute(search_cache_blocks.replace('{schema}', schema))
+        db.execute(mapping_migration.replace('{schema}', schema))
+        db.execute(molecule_generation.replace('{schema}', schema))
+        db.execute(reaction_generation.replace('{schema}', schema))
+        db.execute(evict_search_cache.replace('{schema}', schema))
+        db.execute(watermark_lock.replace('{schema}', schema))
+        db.execute(generation_triggers.replace('{schema}', schema))
+        db.execute(watermark_triggers.replace('{schema}', schema))
+
+        db.execute(search_functions_migration.replace('{schema}', schema))
         db.execute(search_structure_molecule.replace('{schema}', schema))
         db.execute(search_structure_reaction.replace('{schema}', schema))
         db.execute(search_similar_molecules.replace('{schema}', schema))
@@ -67,3 +55,12 @@ def update_core(args):
         db.execute(search_substructure_reaction.replace('{schema}', schema))
         db.execute(search_reactions_by_molecule.replace('{schema}', schema))
         db.execute(search_mappingless_reaction.replace('{schema}', schema))
+
+    with db_session:
+        db.execute(molecule_bits_index.replace('{schema}', schema))
+        db.execute(reaction_bits_index.replace('{schema}', schema))
+        if args.fingerprint_index:
+            method = fingerprint_index_methods[args.fingerprint_index]
+            db.execute(drop_fingerprint_index.replace('{schema}', schema))
+            db.execute(molecule_fingerprint_index.replace('{schema}', schema).replace('{method}', method))
+            db.execute(reaction_fingerprint_index.replace('{schema}', schema).replace('{method}', method))
@@ -18,21 +18,23 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, FileType
+from importlib import import_module
 from importlib.util import find_spec
 from json import loads
-from .main_clean import clean_core
-from .main_create import create_core
-from .main_daemon import daemon_core
-from .main_index import index_core
-from .main_init import init_core
-from .main_update import update_core
+
+
+def lazy(module, function):
+    # subcommand module imported on call only
+    def core(args):
+        return getattr(import_module(module, __package__), function)(args)
+    return core
 
 
 def init_db(subparsers):
     parser = subparsers.add_parser('init', help='initialize postgres db for cartridge using',
                                    formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('--connection', '-c', default='{}', type=loads, help='db connection params. see pony db.bind')
-    parser.set_defaults(func=init_core)
+    parser.set_defaults(func=lazy('.main_init', 'init_core'))
 
 
 def create_db(subparsers):
@@ -41,7 +43,9 @@ def create_db(subparsers):
     parser.add_argument('--connection', '-c', default='{}', type=loads, help='db connection params. see pony db.bind')
     parser.add_argument('--name', '-n', help='schema name', required=True)
     parser.add_argument('--config', '-f', default=None, type=FileType(), help='database config in JSON format')
-    parser.set_defaults(func=create_core)
+    parser.add_argument('--fingerprint_index', '-i', default=None, choices=('gin', 'gist'),
+                        help='build intarray index on fingerprints for screening without index daemon')
+    parser.set_defaults(func=lazy('.main_create', 'create_core'))
 
 
 def create_index(subparsers):
@@ -51,7 +55,7 @@ def create_index(subparsers):
     parser.add_argument('--name', '-n', help='schema name', required=True)
     parser.add_argument('--params', '-p', default='{}', type=loads, help='indexation params')
     parser.add_argument('--data', '-d', type=FileType(mode='wb'), required=True, help='dump of index')
-    parser.set_defaults(func=index_core)
+    parser.set_defaults(func=lazy('.main_index', 'index_core'))
 
 
 def update_db(subparsers):
@@ -59,7 +63,9 @@ def update_db(subparsers):
                                    formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('--connection', '-c', default='{}', type=loads, help='db connection params. see pony db.bind')
     parser.add_argument('--name', '-n', help='schema name', required=True)
-    parser.set_defaults(func=update_core)
+    parser.add_argument('--fingerprint_index', '-i', default=None, choices=('gin', 'gist'),
+                        help='build intarray index on fingerprints for screening without index daemon')
+    parser.set_defaults(func=lazy('.main_update', 'update_core'))
 
 
 def clean_cache(subparsers):
@@ -67,7 +73,47 @@ def clean_cache(subparsers):
                                    formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('--connection', '-c', default='{}', type=loads, help='db connection params. see pony db.bind')
     parser.add_argument('--name', '-n', help='schema name', required=True)
-    parser.set_defaults(func=clean_core)
+    parser.add_argument('--evict', '-e', action='store_true',
+                        help='remove only expired by cache_ttl and exceeding cache_limit entries')
+    parser.set_defaults(func=lazy('.main_clean', 'clean_core'))
+
+
+def export_data(subparsers):
+    parser = subparsers.add_parser('export', help='export structures or search results into file',
+                                   formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--connection', '-c', default='{}', type=loads, help='db connection params. see pony db.bind')
+    parser.add_argument('--name', '-n', help='schema name', required=True)
+    parser.add_argument('--output', '-o', type=FileType(mode='w'), required=True, help='output file')
+    parser.add_argument('--format', '-f', default=None, choices=('rdf', 'sdf', 'smiles'),
+                        help='output format. rdf for reactions and sdf for molecules by default')
+    parser.add_argument('--molecules', '-m', action='store_true', help='export molecules instead of reactions')
+    parser.add_argument('--cache', '-s', default=None, type=int,
+                        help='search cache id for export. all structures exported by default')
+    parser.add_argument('--batch', '-b', default=10000, type=int, help='number of rows fetched from db at once')
+    parser.add_argument('--chunk', '-k', default=1000, type=int, help='number of structures decoded by worker at once')
+    parser.add_argument('--workers', '-w', default=None, type=int,
+                        help='number of decoding processes. 0 - decode in main process. number of CPUs by default')
+    parser.add_argument('--quiet', '-q', action='store_true', help='disable throughput reporting')
+    parser.set_defaults(func=lazy('.main_export', 'export_core'))
+
+
+def refingerprint_db(subparsers):
+    parser = subparsers.add_parser('refingerprint', help='recalculate fingerprints by new params without downtime',
+                                   formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--connection', '-c', default='{}', type=loads, help='db connection params. see pony db.bind')
+    parser.add_argument('--name', '-n', help='schema name', required=True)
+    parser.add_argument('--config', '-f', type=FileType(), required=True,
+                        help='molecule and/or reaction fingerprints params in JSON format')
+    parser.add_argument('--batch', '-b', default=10000, type=int, help='number of rows fetched and updated at once')
+    parser.add_argument('--chunk', '-k', default=1000, type=int,
+                        help='number of structures fingerprinted by worker at once')
+    parser.add_argument('--workers', '-w', default=None, type=int,
+                        help='number of fingerprinting processes. 0 - main process only. number of CPUs by default')
+    parser.add_argument('--params', '-p', default='{}', type=loads, help='indexation params')
+    parser.add_argument('--data', '-d', type=FileType(mode='wb'), default=None,
+                        help='dump of index rebuilt after fingerprints switch')
+    parser.add_argument('--quiet', '-q', action='store_true', help='disable throughput reporting')
+    parser.set_defaults(func=lazy('.main_refingerprint', 'refingerprint_core'))
 
 
 def run_daemon(subparsers):
@@ -75,7 +121,7 @@ def run_daemon(subparsers):
                                    formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('--params', '-p', default='{}', type=loads, help='aiohttp run_app params')
     parser.add_argument('--data', '-d', type=FileType(mode='rb'), required=True, help='dump of index')
-    parser.set_defaults(func=daemon_core)
+    parser.set_defaults(func=lazy('.main_daemon', 'daemon_core'))
 
 
 def argparser():
@@ -87,6 +133,8 @@ def argparser():
     create_index(subparsers)
     update_db(subparsers)
     clean_cache(subparsers)
+    export_data(subparsers)
+    refingerprint_db(subparsers)
     run_daemon(subparsers)
 
     if find_spec('argcomplete'):
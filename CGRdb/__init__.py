@@ -16,49 +16,57 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from importlib import import_module
+from collections import OrderedDict
 from json import dumps
-from LazyPony import LazyEntityMeta
-from pkg_resources import get_distribution, DistributionNotFound, VersionConflict
-from pony.orm import db_session, Database
-from .database import *
+from threading import Lock
+from .bootstrap import bootstrap
 
 
-def load_schema(schema, *args, **kwargs):
+_schemas = OrderedDict()  # pool of loaded schemas handles
+_lock = Lock()
+
+
+def load_schema(schema, *args, pool_size: int = 8, client_fingerprints: bool = False, **kwargs):
     """
-    Load schema from db with compatible version
+    Load schema from db with compatible version.
+    Loaded schemas are pooled. Repeated loading with same connection params returns the same handle.
 
     :param schema: schema name for loading
+    :param pool_size: number of pooled schemas handles. least recently loaded handles are dropped from pool only:
+        handles kept by callers stay connected and are closed on garbage collection
+    :param client_fingerprints: calculate queries signatures and fingerprints in client instead of backend.
+        backend checks them by structure before search results storing
     """
-    major_version = '.'.join(get_distribution('CGRdb').version.split('.')[:-1])
+    key = dumps([schema, args, kwargs, client_fingerprints], sort_keys=True, default=str)
+    with _lock:
+        try:
+            _schemas.move_to_end(key)
+        except KeyError:
+            pass
+        else:
+            return _schemas[key]
 
-    db_config = Database()
-    LazyEntityMeta.attach(db_config, database='CGRdb_config')
-    db_config.bind('postgres', *args, **kwargs)
-    db_config.generate_mapping()
+        from pony.orm import db_session
 
-    with db_session:
-        config = db_config.Config.get(name=schema, version=major_version)
-    if not config:
-        raise KeyError('schema not exists')
-    config = config.config
+        db, config = bootstrap(schema, *args, init_session=True, **kwargs)
+        session = f'SELECT "{schema}".cgrdb_init_session(\'{dumps(config)}\')'
+        db.cgrdb_init_session = db_session()(lambda: db.execute(session) and True or False)
+        if client_fingerprints:
+            from .database.fingerprint import Fingerprinter
+            db.cgrdb_fingerprinter = Fingerprinter(config)
 
-    for p in config['packages']:
-        try:
-            p = get_distribution(p)
-            import_module(p.project_name)
-        except (DistributionNotFound, VersionConflict):
-            raise ImportError(f'packages not installed or has invalid versions: {p}')
+        _schemas[key] = db
+        while len(_schemas) > pool_size:  # handle can be still used by previous callers
+            _schemas.popitem(last=False)
+        return db
 
-    db = Database()
-    LazyEntityMeta.attach(db, schema, 'CGRdb')
-    db.bind('postgres', *args, **kwargs)
-    db.generate_mapping()
 
-    init = f'SELECT "{schema}".cgrdb_init_session(\'{dumps(config)}\')'
-    db.cgrdb_init_session = db_session()(lambda: db.execute(init) and True or False)
-    db.cgrdb_init_session()
-    return db
+def __getattr__(name):
+    # entities and chemistry libraries are imported on first access only
+    if name in ('Molecule', 'Reaction', 'SearchStats'):
+        from . import database
+        return getattr(database, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-__all__ = ['load_schema', 'Molecule', 'Reaction']
+__all__ = ['load_schema', 'Molecule', 'Reaction', 'SearchStats']
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+asyncio client of CGRdb schema built on asyncpg pool. Searches are coroutines and can be run concurrently by
+asyncio.gather. Cancellation of coroutine cancels query in backend.
+
+    db = await Schema.connect('schema', user='postgres', host='localhost', max_size=20)
+    found = await asyncio.gather(*(db.molecules.find_substructures(x) for x in queries))
+    hits = await found[0].structures(page=1, pagesize=50)
+"""
+from asyncpg import connect, create_pool
+from itertools import groupby
+from json import dumps, loads as json_loads
+from pickle import dumps as pickle, loads
+from typing import List, NamedTuple, Optional, Union, TYPE_CHECKING
+from .database.fingerprint import Fingerprinter
+from .mapping import unpack_mapping
+from .database.stats import SearchStats
+from .metadata import check_packages, get_major_version
+
+
+if TYPE_CHECKING:
+    from CGRtools.containers import MoleculeContainer, QueryContainer, ReactionContainer
+
+
+class Hit(NamedTuple):
+    id: int  # Molecule or Reaction id
+    tanimoto: float
+    structure: Union['MoleculeContainer', 'ReactionContainer', None]
+
+
+class SearchResult:
+    """
+    cached search results. results are read by blocks overlapped with requested page
+    """
+    def __init__(self, entity: '_Entity', cache: int, size: int):
+        self._entity = entity
+        self.id = cache
+        self._size = size
+
+    async def ids(self, page: int = 1, pagesize: int = 100) -> List[int]:
+        return await self._slice(self._entity._column, page, pagesize)
+
+    async def tanimotos(self, page: int = 1, pagesize: int = 100) -> List[float]:
+        return await self._slice('tanimotos', page, pagesize)
+
+    async def structures(self, page: int = 1, pagesize: int = 100) -> List[Hit]:
+        """
+        page of found records with canonical structures prefetched in single query
+        """
+        ids = await self.ids(page, pagesize)
+        if not ids:
+            return []
+        tanimotos = await self.tanimotos(page, pagesize)
+        structures = await self._entity.structures(ids)
+        return [Hit(*x) for x in zip(ids, tanimotos, structures)]
+
+    async def __aiter__(self):
+        """
+        iterate over all found records without structures. results blocks are read sequentially.
+        """
+        schema = self._entity._schema.schema
+        column = self._entity._column
+        table = self._entity._table
+        start = -1
+        while True:
+            block = await self._entity._schema.fetchrow(
+                f'''SELECT x.start, x.{column} i, x.tanimotos t FROM "{schema}"."{table}" x
+                WHERE x.cache = $1 AND x.start > $2 ORDER BY x.start LIMIT 1''', self.id, start)
+            if not block:
+                return
+            start = block['start']
+            for i, t in zip(block['i'], block['t']):
+                yield Hit(i, t, None)
+
+    async def _slice(self, column, page, pagesize):
+        if page < 1:
+            raise ValueError('page should be greater or equal than 1')
+        elif pagesize < 1:
+            raise ValueError('pagesize should be greater or equal than 1')
+
+        start = (page - 1) * pagesize
+        end = start + pagesize
+        schema = self._entity._schema.schema
+        table = self._entity._table
+        blocks = await self._entity._schema.fetch(
+            f'''SELECT x.start, x.{column} d FROM "{schema}"."{table}" x
+            WHERE x.cache = $1 AND x.start < $3 AND x.start >= (
+                SELECT max(y.start) FROM "{schema}"."{table}" y
+                WHERE y.cache = $1 AND y.start <= $2)
+            ORDER BY x.start''', self.id, start, end)
+        if not blocks:
+            return []
+        offset = blocks[0]['start']
+        return [x for b in blocks for x in b['d']][start - offset:end - offset]
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._entity._table}, {self.id}, {self._size})'
+
+
+class _Entity:
+    _table: str  # search cache blocks table
+    _column: str  # ids column of blocks
+
+    def __init__(self, schema: 'Schema'):
+        self._schema = schema
+
+    def _precomputed(self, kind, structure):
+        fingerprinter = self._schema.fingerprinter
+        return fingerprinter and getattr(fingerprinter, kind)(structure)
+
+    async def _search(self, function, args, stats, timeout):
+        # cancellation of awaiting task or timeout expiration cancels backend query. connection is returned to pool
+        query = f'SELECT * FROM "{self._schema.schema}".cgrdb_search_{function}'
+        async with self._schema.acquire() as connection:
+            row = await connection.fetchrow(query, *args, timeout=timeout)
+            if stats:  # statistics of last search in same backend
+                data = await connection.fetchval(f'SELECT "{self._schema.schema}".cgrdb_search_stats()')
+        if len(row) == 1:  # exact search
+            return row['id'] or None
+        result = SearchResult(self, row['id'], row['count']) if row['count'] else None
+        if stats:
+            return result, data and SearchStats._from_dict(json_loads(data))
+        return result
+
+
+class Molecules(_Entity):
+    _table = 'MoleculeSearchCacheBlock'
+    _column = 'molecules'
+
+    async def find_structure(self, structure: 'MoleculeContainer', *, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        exact search
+
+        :return: Molecule id or None
+        """
+        from CGRtools.containers import MoleculeContainer
+
+        if not isinstance(structure, MoleculeContainer):
+            raise TypeError('Molecule expected')
+        elif not len(structure):
+            raise ValueError('empty query')
+
+        si = await self._search('structure_molecule($1)', [pickle(structure)], False, timeout)
+        if si:
+            return await self._schema.fetchval(
+                f'SELECT x.molecule FROM "{self._schema.schema}"."MoleculeStructure" x WHERE x.id = $1', si)
+
+    async def find_substructures(self, structure: Union['MoleculeContainer', 'QueryContainer'], *, stats: bool = False,
+                                 timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        substructure search
+
+        :param structure: CGRtools MoleculeContainer or QueryContainer
+        :param stats: return tuple of results and SearchStats
+        :param timeout: seconds. query is cancelled in backend on expiration
+        """
+        from CGRtools.containers import MoleculeContainer, QueryContainer
+
+        if not isinstance(structure, (MoleculeContainer, QueryContainer)):
+            raise TypeError('Molecule or Query expected')
+        elif not len(structure):
+            raise ValueError('empty query')
+        return await self._search('substructure_molecules($1, $2)',
+                                  [pickle(structure), self._precomputed('molecule', structure)], stats, timeout)
+
+    async def find_similar(self, structure: 'MoleculeContainer', *, stats: bool = False,
+                           timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        similarity search
+
+        :param structure: CGRtools MoleculeContainer
+        :param stats: return tuple of results and SearchStats
+        :param timeout: seconds. query is cancelled in backend on expiration
+        """
+        from CGRtools.containers import MoleculeContainer
+
+        if not isinstance(structure, MoleculeContainer):
+            raise TypeError('Molecule expected')
+        elif not len(structure):
+            raise ValueError('empty query')
+        return await self._search('similar_molecules($1, $2)',
+                                  [pickle(structure), self._precomputed('molecule', structure)], stats, timeout)
+
+    async def structures(self, ids: List[int]) -> List[Optional['MoleculeContainer']]:
+        """
+        canonical structures of molecules in single query. None for not existing molecules
+        """
+        rows = await self._schema.fetch(
+            f'''SELECT x.molecule, x.structure FROM "{self._schema.schema}"."MoleculeStructure" x
+            WHERE x.molecule = ANY($1::integer[]) AND x.is_canonic''', list(ids))
+        structures = {x['molecule']: loads(x['structure']) for x in rows}
+        return [structures.get(x) for x in ids]
+
+
+class Reactions(_Entity):
+    _table = 'ReactionSearchCacheBlock'
+    _column = 'reactions'
+
+    async def find_structure(self, structure: 'ReactionContainer', *, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        exact search
+
+        :return: Reaction id or None
+        """
+        self._check(structure)
+        return await self._search('structure_reaction($1)', [pickle(structure)], False, timeout)
+
+    async def find_substructures(self, structure: 'ReactionContainer', *, stats: bool = False,
+                                 timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        substructure search
+
+        :param structure: CGRtools ReactionContainer
+        :param stats: return tuple of results and SearchStats
+        :param timeout: seconds. query is cancelled in backend on expiration
+        """
+        self._check(structure)
+        return await self._search('substructure_reactions($1, $2)',
+                                  [pickle(structure), self._precomputed('reaction', structure)], stats, timeout)
+
+    async def find_similar(self, structure: 'ReactionContainer', *, stats: bool = False,
+                           timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        similarity search
+
+        :param structure: CGRtools ReactionContainer
+        :param stats: return tuple of results and SearchStats
+        :param timeout: seconds. query is cancelled in backend on expiration
+        """
+        self._check(structure)
+        return await self._search('similar_reactions($1, $2)',
+                                  [pickle(structure), self._precomputed('reaction', structure)], stats, timeout)
+
+    async def find_mappingless_substructures(self, structure: 'ReactionContainer', *, stats: bool = False,
+                                             timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        substructure search of reactions without atom-to-atom mapping
+        """
+        self._check(structure)
+        return await self._search('mappingless_substructure_reactions($1)', [pickle(structure)], stats, timeout)
+
+    async def find_substructure_reactions(self, structure: Union['MoleculeContainer', 'QueryContainer'],
+                                          is_product: Optional[bool] = None, *, stats: bool = False,
+                                          timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        reactions including molecules found by substructure search
+
+        :param is_product: role of molecule. None - any
+        """
+        from CGRtools.containers import MoleculeContainer, QueryContainer
+
+        if not isinstance(structure, (MoleculeContainer, QueryContainer)):
+            raise TypeError('Molecule or Query expected')
+        elif not len(structure):
+            raise ValueError('empty query')
+        return await self._search('reactions_by_molecule($1, $2, 1, $3)',
+                                  [pickle(structure), self._role(is_product), self._precomputed('molecule', structure)],
+                                  stats, timeout)
+
+    async def find_similar_reactions(self, structure: 'MoleculeContainer', is_product: Optional[bool] = None, *,
+                                     stats: bool = False, timeout: Optional[float] = None) -> Optional[SearchResult]:
+        """
+        reactions including molecules found by similarity search
+
+        :param is_product: role of molecule. None - any
+        """
+        from CGRtools.containers import MoleculeContainer
+
+        if not isinstance(structure, MoleculeContainer):
+            raise TypeError('Molecule expected')
+        elif not len(structure):
+            raise ValueError('empty query')
+        return await self._search('reactions_by_molecule($1, $2, 2, $3)',
+                                  [pickle(structure), self._role(is_product), self._precomputed('molecule', structure)],
+                                  stats, timeout)
+
+    async def structures(self, ids: List[int]) -> List[Optional['ReactionContainer']]:
+        """
+        canonical structures of reactions in single query. None for not existing reactions
+        """
+        schema = self._schema.schema
+        rows = await self._schema.fetch(
+            f'''SELECT r.reaction, r.is_product, r.mapping, x.structure
+            FROM "{schema}"."MoleculeReaction" r
+                 JOIN "{schema}"."MoleculeStructure" x ON x.molecule = r.molecule AND x.is_canonic
+            WHERE r.reaction = ANY($1::integer[])
+            ORDER BY r.reaction, r.id''', list(ids))
+        from CGRtools.containers import ReactionContainer
+
+        structures = {}
+        for ri, group in groupby(rows, key=lambda x: x['reaction']):
+            rp = ([], [])
+            for x in group:
+                s = loads(x['structure'])  # unpickled structure is private. remap in place
+                if x['mapping']:
+                    s.remap(unpack_mapping(x['mapping']))
+                rp[x['is_product']].append(s)
+            structures[ri] = ReactionContainer(*rp)
+        return [structures.get(x) for x in ids]
+
+    @staticmethod
+    def _check(structure):
+        from CGRtools.containers import ReactionContainer
+
+        if not isinstance(structure, ReactionContainer):
+            raise TypeError('Reaction expected')
+        elif not structure.reactants or not structure.products:
+            raise ValueError('empty query')
+
+    @staticmethod
+    def _role(is_product):
+        return 0 if is_product is None else 2 if is_product else 1
+
+
+class Schema:
+    """
+    asyncio handle of CGRdb schema. pool connections are initialized by schema config
+    """
+    def __init__(self, pool, schema: str, config: dict, client_fingerprints: bool = False):
+        self._pool = pool
+        self.schema = schema
+        self.config = config
+        self.fingerprinter = Fingerprinter(config) if client_fingerprints else None
+        self.molecules = Molecules(self)
+        self.reactions = Reactions(self)
+
+    @classmethod
+    async def connect(cls, schema: str, *, min_size: int = 1, max_size: int = 10, client_fingerprints: bool = False,
+                      **kwargs) -> 'Schema':
+        """
+        Load schema from db with compatible version
+
+        :param schema: schema name for loading
+        :param min_size: number of connections opened on start
+        :param max_size: maximal number of connections. limits number of concurrent searches
+        :param client_fingerprints: calculate queries signatures and fingerprints in client instead of backend.
+            backend checks them by structure before search results storing
+        :param kwargs: asyncpg connection params
+        """
+        major_version = get_major_version()
+        connection = await connect(**kwargs)
+        try:
+            config = await connection.fetchval('SELECT x.config FROM cgr_db_config x WHERE x.name = $1 AND '
+                                               'x.version = $2', schema, major_version)
+        finally:
+            await connection.close()
+        if not config:
+            raise KeyError('schema not exists')
+        config = json_loads(config)
+
+        check_packages(config['packages'])  # required for unpickling of structures
+
+        init = f'SELECT "{schema}".cgrdb_init_session($1)'
+        cfg = dumps(config)
+
+        async def setup(c):
+            await c.execute(init, cfg)
+
+        pool = await create_pool(min_size=min_size, max_size=max_size, init=setup, **kwargs)
+        return cls(pool, schema, config, client_fingerprints)
+
+    def acquire(self):
+        return self._pool.acquire()
+
+    async def fetch(self, query: str, *args) -> list:
+        async with self._pool.acquire() as connection:
+            return await connection.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args):
+        async with self._pool.acquire() as connection:
+            return await connection.fetchrow(query, *args)
+
+    async def fetchval(self, query: str, *args):
+        async with self._pool.acquire() as connection:
+            return await connection.fetchval(query, *args)
+
+    async def close(self):
+        await self._pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+__all__ = ['Schema', 'SearchResult', 'Hit']
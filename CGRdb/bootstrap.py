@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from json import dumps
+from .metadata import check_packages, get_major_version
+
+
+def bootstrap(schema: str, *args, init_session: bool = False, check_tables: bool = True, **kwargs):
+    """
+    Bind schema and load its config through the same connection.
+    Config isn't cached: it can be changed by update and refingerprint commands from other hosts.
+    Entities are attached after import of packages required by schema.
+
+    :param schema: schema name
+    :param init_session: initialize each connection of schema by config
+    :param check_tables: check tables of schema on mapping generation. disable for outdated schemas
+    :return: pony Database of schema and config
+    """
+    from LazyPony import LazyEntityMeta
+    from pony.orm import db_session, Database
+    from . import database  # entities registration
+
+    db = Database()
+
+    if init_session:
+        init = f'SELECT "{schema}".cgrdb_init_session(%s)'
+        session = []  # filled after config loading. connection opened by bind initialized explicitly
+
+        @db.on_connect(provider='postgres')
+        def init_connection(_, connection):
+            # each new connection of handle is initialized. backend skips repeated initialization
+            if session:
+                with connection.cursor() as cursor:
+                    cursor.execute(init, session)
+                connection.commit()
+
+    db.bind('postgres', *args, **kwargs)
+    major_version = get_major_version()
+    with db_session:
+        config = db.select('SELECT x.config FROM cgr_db_config x WHERE x.name = $name AND x.version = $version',
+                           {}, {'name': schema, 'version': major_version})
+    if not config:
+        db.disconnect()
+        raise KeyError('schema not exists or version incompatible')
+    config = config[0]
+
+    check_packages(config['packages'])
+    LazyEntityMeta.attach(db, schema, 'CGRdb')
+
+    if init_session:
+        session.append(dumps(config))
+        with db_session:
+            db.execute(f'SELECT "{schema}".cgrdb_init_session($cfg)', {}, {'cfg': session[0]})
+
+    db.generate_mapping(check_tables=check_tables)
+    return db, config
+
+
+__all__ = ['bootstrap']
@@ -19,6 +19,7 @@
 from .config import *
 from .molecule import *
 from .reaction import *
+from .stats import *
 
 
-__all__ = ['Molecule', 'Reaction', 'Config']
+__all__ = ['Molecule', 'Reaction', 'Config', 'SearchStats']
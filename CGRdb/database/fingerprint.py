@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from json import dumps
+from typing import Optional
+
+
+def fingerprint_config(params: dict) -> str:
+    """
+    fingerprint config token. precomputed fingerprints are used by backend only if tokens are equal.
+    same as in cgrdb_init_session
+    """
+    from importlib.metadata import version, PackageNotFoundError
+
+    try:
+        v = version('StructureFingerprint')
+    except PackageNotFoundError:
+        v = None
+    return dumps([v, params], sort_keys=True)
+
+
+class Fingerprinter:
+    """
+    client side calculation of queries signatures and fingerprints by schema config.
+    backend skips structure unpickling and fingerprint calculation on cached results. new searches are screened by
+    client fingerprint. structure is unpickled and checked against signature and fingerprint before results storing.
+    """
+    def __init__(self, config: dict):
+        from StructureFingerprint import LinearFingerprint
+
+        molecule = config.get('molecule', {})
+        reaction = config.get('reaction', {})
+        self._mfp = LinearFingerprint(**molecule)
+        self._rfp = LinearFingerprint(**reaction)
+        self._molecule = fingerprint_config(molecule)
+        self._reaction = fingerprint_config(reaction)
+
+    def molecule(self, structure) -> Optional[str]:
+        """
+        precomputed argument of molecules searches. queries are fingerprinted by backend only
+        """
+        from CGRtools.containers import MoleculeContainer
+
+        if not isinstance(structure, MoleculeContainer):
+            return
+        return dumps({'signature': bytes(structure).hex(), 'fingerprint': self._mfp.transform_bitset([structure])[0],
+                      'config': self._molecule})
+
+    def reaction(self, structure) -> str:
+        """
+        precomputed argument of reactions searches
+        """
+        cgr = ~structure
+        return dumps({'signature': bytes(cgr).hex(), 'fingerprint': self._rfp.transform_bitset([cgr])[0],
+                      'config': self._reaction})
+
+
+def precomputed(database, kind: str, structure) -> str:
+    """
+    SQL literal of precomputed argument of search functions. NULL if client fingerprints disabled
+
+    :param kind: molecule or reaction
+    """
+    fingerprinter = getattr(database, 'cgrdb_fingerprinter', None)
+    if fingerprinter is None:
+        return 'NULL'
+    data = getattr(fingerprinter, kind)(structure)
+    if data is None:
+        return 'NULL'
+    return f"'{data}'::json"
+
+
+__all__ = ['Fingerprinter']
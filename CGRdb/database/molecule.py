@@ -18,12 +18,13 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from CachedMethods import cached_property
-from CGRtools.containers import MoleculeContainer, QueryContainer
 from datetime import datetime
 from LazyPony import LazyEntityMeta
 from pickle import dumps, loads
-from pony.orm import PrimaryKey, Required, Set, IntArray, FloatArray, composite_key, left_join, select, raw_sql
+from pony.orm import PrimaryKey, Required, Set, IntArray, composite_key, left_join
 from typing import Dict
+from .fingerprint import precomputed
+from .stats import SearchStats
 
 
 class Molecule(metaclass=LazyEntityMeta, database='CGRdb'):
@@ -74,8 +75,36 @@ class Molecule(metaclass=LazyEntityMeta, database='CGRdb'):
         """
         return [x.structure for x in self.reactions_entities(page, pagesize, product)]
 
+    @classmethod
+    def prefetch_structures(cls, molecules, all_forms=False):
+        """
+        preload structures of molecules in single query
+
+        :param molecules: Molecule entities collection
+        :param all_forms: load all structures of molecules. otherwise only canonical
+        """
+        key = 'structures_entities' if all_forms else 'structure_entity'
+        molecules = [x for x in molecules if key not in x.__dict__]
+        if not molecules:
+            return
+
+        if all_forms:
+            ss = {x: [] for x in molecules}
+            q = cls._database_.MoleculeStructure.select(lambda x: x.molecule in molecules).order_by(lambda x: x.id)
+            for x in q:
+                if x.is_canonic:
+                    x.molecule.__dict__['structure_entity'] = x
+                ss[x.molecule].append(x)
+            for m, s in ss.items():
+                m.__dict__['structures_entities'] = tuple(s)
+        else:
+            for x in cls._database_.MoleculeStructure.select(lambda x: x.molecule in molecules and x.is_canonic):
+                x.molecule.__dict__['structure_entity'] = x
+
     @classmethod
     def structure_exists(cls, structure):
+        from CGRtools.containers import MoleculeContainer
+
         if not isinstance(structure, MoleculeContainer):
             raise TypeError('Molecule expected')
         elif not len(structure):
@@ -89,6 +118,8 @@ class Molecule(metaclass=LazyEntityMeta, database='CGRdb'):
 
     @classmethod
     def find_structure(cls, structure):
+        from CGRtools.containers import MoleculeContainer
+
         if not isinstance(structure, MoleculeContainer):
             raise TypeError('Molecule expected')
         elif not len(structure):
@@ -106,50 +137,58 @@ class Molecule(metaclass=LazyEntityMeta, database='CGRdb'):
             return molecule
 
     @classmethod
-    def find_substructures(cls, structure):
+    def find_substructures(cls, structure, *, stats: bool = False):
         """
         substructure search
 
         substructure search is 2-step process. first step is screening procedure. next step is isomorphism testing.
 
         :param structure: CGRtools MoleculeContainer or QueryContainer
+        :param stats: return tuple of results and SearchStats
         :return: MoleculeSearchCache object with all found molecules or None
         """
+        from CGRtools.containers import MoleculeContainer, QueryContainer
+
         if not isinstance(structure, (MoleculeContainer, QueryContainer)):
             raise TypeError('Molecule or Query expected')
         elif not len(structure):
             raise ValueError('empty query')
 
+        fp = precomputed(cls._database_, 'molecule', structure)
         structure = dumps(structure).hex()
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(
-            f'''SELECT * FROM "{schema}".cgrdb_search_substructure_molecules('\\x{structure}'::bytea)''')[0]
-        if fnd:
-            c = cls._database_.MoleculeSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+            f'''SELECT * FROM "{schema}".cgrdb_search_substructure_molecules('\\x{structure}'::bytea, {fp})''')[0]
+        result = cls._database_.MoleculeSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @classmethod
-    def find_similar(cls, structure):
+    def find_similar(cls, structure, *, stats: bool = False):
         """
         Similarity search. When index not configured threshold = 0.5 is used.
 
         :param structure: CGRtools MoleculeContainer
+        :param stats: return tuple of results and SearchStats
         :return: MoleculeSearchCache object with all found molecules or None
         """
+        from CGRtools.containers import MoleculeContainer
+
         if not isinstance(structure, MoleculeContainer):
             raise TypeError('Molecule expected')
         elif not len(structure):
             raise ValueError('empty query')
 
+        fp = precomputed(cls._database_, 'molecule', structure)
         structure = dumps(structure).hex()
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(
-            f'''SELECT * FROM "{schema}".cgrdb_search_similar_molecules('\\x{structure}'::bytea)''')[0]
-        if fnd:
-            c = cls._database_.MoleculeSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+            f'''SELECT * FROM "{schema}".cgrdb_search_similar_molecules('\\x{structure}'::bytea, {fp})''')[0]
+        result = cls._database_.MoleculeSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @cached_property
     def structure_entity(self):
@@ -183,11 +222,9 @@ class Molecule(metaclass=LazyEntityMeta, database='CGRdb'):
         if product is not None:
             q = q.where(lambda x: x.is_product == product)
 
-        reactions = q.page(page, pagesize)
-        if not reactions:
-            return []
-        self._database_.Reaction.prefetch_structure(reactions)
-        return list(reactions)
+        reactions = list(q.page(page, pagesize))
+        self._database_.Reaction.prefetch_structures(reactions, all_forms=False)
+        return reactions
 
     def unite_molecule(self, molecule, mapping: Dict[int, int]):
         """
@@ -212,6 +249,8 @@ class MoleculeStructure(metaclass=LazyEntityMeta, database='CGRdb'):
     _structure = Required(bytes, optimistic=False, column='structure')
 
     def __init__(self, **kwargs):
+        from CGRtools.containers import MoleculeContainer
+
         structure = kwargs.pop('structure')
         if not isinstance(structure, MoleculeContainer):
             raise TypeError('molecule expected')
@@ -221,6 +260,22 @@ class MoleculeStructure(metaclass=LazyEntityMeta, database='CGRdb'):
     def structure(self):
         return loads(self._structure)
 
+    def remapped(self, mapping):
+        """
+        structure with remapped atoms. remapped structures are cached in entity for db_session lifetime
+        and shared read-only between callers as structure itself - copy before editing
+
+        :param mapping: atom-to-atom mapping. empty mapping returns structure itself
+        """
+        if not mapping:
+            return self.structure
+        key = frozenset(mapping.items())
+        try:
+            return self.__dict__['remapped_structures'][key]
+        except KeyError:
+            s = self.__dict__.setdefault('remapped_structures', {})[key] = self.structure.remap(mapping, copy=True)
+            return s
+
     def __str__(self):
         """
         signature of structure
@@ -239,8 +294,10 @@ class MoleculeSearchCache(metaclass=LazyEntityMeta, database='CGRdb'):
     signature = Required(bytes)
     operator = Required(str)
     date = Required(datetime, default=datetime.utcnow)
-    _molecules = Required(IntArray, optimistic=False, index=False, column='molecules', lazy=True)
-    _tanimotos = Required(FloatArray, optimistic=False, index=False, column='tanimotos', lazy=True, sql_type='real[]')
+    used = Required(datetime, default=datetime.utcnow, optimistic=False, volatile=True)
+    _generation = Required(int, size=64, optimistic=False, volatile=True, column='generation')
+    _watermark = Required(int, optimistic=False, volatile=True, column='watermark')
+    _size = Required(int, optimistic=False, volatile=True, column='size')
     composite_key(signature, operator)
 
     def molecules(self, page=1, pagesize=100):
@@ -251,18 +308,10 @@ class MoleculeSearchCache(metaclass=LazyEntityMeta, database='CGRdb'):
 
         start = (page - 1) * pagesize
         end = start + pagesize
-        mis = select(x._molecules[start:end] for x in self.__class__ if x.id == self.id).first()
+        mis = self._slice('molecules', start, end)
         if not mis:
             return []
-
-        # preload molecules
-        ms = {x.id: x for x in self._database_.Molecule.select(lambda x: x.id in mis)}
-
-        # preload molecules canonical structures
-        for x in self._database_.MoleculeStructure.select(lambda x: x.molecule.id in mis and x.is_canonic):
-            x.molecule.__dict__['structure_entity'] = x
-
-        return [ms[x] for x in mis]
+        return self._load(mis)
 
     def tanimotos(self, page=1, pagesize=100):
         if page < 1:
@@ -272,15 +321,63 @@ class MoleculeSearchCache(metaclass=LazyEntityMeta, database='CGRdb'):
 
         start = (page - 1) * pagesize
         end = start + pagesize
-        sts = select(x._tanimotos[start:end] for x in self.__class__ if x.id == self.id).first()
-        return list(sts)
+        return self._slice('tanimotos', start, end)
+
+    def iter_molecules(self, batch=100):
+        """
+        iterate over all found molecules. results blocks are read sequentially.
+
+        :param batch: number of molecules loaded at once
+        """
+        if batch < 1:
+            raise ValueError('batch should be greater or equal than 1')
+
+        schema = self._table_[0]  # define DB schema
+        start = -1
+        while True:
+            block = self._database_.select(
+                f'''SELECT x.start, x.molecules FROM "{schema}"."MoleculeSearchCacheBlock" x
+                WHERE x.cache = {self.id} AND x.start > {start} ORDER BY x.start LIMIT 1''')
+            if not block:
+                return
+            start, mis = block[0]
+            for n in range(0, len(mis), batch):
+                yield from self._load(mis[n: n + batch])
+
+    def _slice(self, column, start, end):
+        # read only blocks overlapped with requested range
+        schema = self._table_[0]  # define DB schema
+        blocks = self._database_.select(
+            f'''SELECT x.start, x.{column} FROM "{schema}"."MoleculeSearchCacheBlock" x
+            WHERE x.cache = {self.id} AND x.start < {end} AND x.start >= (
+                SELECT max(y.start) FROM "{schema}"."MoleculeSearchCacheBlock" y
+                WHERE y.cache = {self.id} AND y.start <= {start})
+            ORDER BY x.start''')
+        if not blocks:
+            return []
+        offset = blocks[0][0]
+        return [x for _, block in blocks for x in block][start - offset:end - offset]
+
+    def _load(self, mis):
+        # preload molecules
+        ms = {x.id: x for x in self._database_.Molecule.select(lambda x: x.id in mis)}
+        ms = [ms[x] for x in mis]
+        self._database_.Molecule.prefetch_structures(ms)
+        return ms
 
     def __len__(self):
         return self._size
 
-    @cached_property
-    def _size(self):
-        return select(raw_sql('array_length(x.molecules, 1)') for x in self.__class__ if x.id == self.id).first()
+    @classmethod
+    def statistics(cls):
+        """
+        cache hits and misses counters
+        """
+        schema = cls._table_[0]  # define DB schema
+        hits, misses = cls._database_.select(
+            f'''SELECT h.last_value * h.is_called::integer, m.last_value * m.is_called::integer
+            FROM "{schema}".cgrdb_molecule_cache_hits h, "{schema}".cgrdb_molecule_cache_misses m''')[0]
+        return {'hits': hits, 'misses': misses}
 
 
 __all__ = ['Molecule', 'MoleculeStructure', 'MoleculeSearchCache']
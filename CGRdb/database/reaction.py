@@ -17,14 +17,15 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from CachedMethods import cached_property
-from CGRtools.containers import ReactionContainer, MoleculeContainer, QueryContainer
-from collections import defaultdict
 from datetime import datetime
 from itertools import product
 from LazyPony import LazyEntityMeta
 from pickle import dumps
-from pony.orm import PrimaryKey, Required, Optional, Set, Json, select, IntArray, FloatArray, composite_key, raw_sql
+from pony.orm import PrimaryKey, Required, Optional, Set, IntArray, composite_key
 from typing import Optional as tOptional
+from ..mapping import unpack_mapping
+from .fingerprint import precomputed
+from .stats import SearchStats
 
 
 class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
@@ -55,70 +56,18 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
     @cached_property
     def structure(self):
         """
-        canonical structure of reaction
+        canonical structure of reaction. molecules are shared with other reactions in db_session - copy before editing
         """
-        # mapping and molecules preload
-        mrs = self._molecules.order_by(lambda x: x.id).prefetch(self._database_.Molecule)[:]
-        # canonic molecule structures preload
-        ms = {x.molecule for x in mrs}
-        for x in self._database_.MoleculeStructure.select(lambda x: x.is_canonic and x.molecule in ms):
-            x.molecule.__dict__['structure_entity'] = x
-
-        r, p = [], []
-        for m in mrs:
-            s = m.molecule.structure
-            if m.mapping:
-                s = s.remap(m.mapping, copy=True)
-            if m.is_product:
-                p.append(s)
-            else:
-                r.append(s)
-        return ReactionContainer(r, p)
+        self.prefetch_structures((self,), all_forms=False)
+        return self.__dict__['structure']
 
     @cached_property
     def structures(self):
-        # mapping and molecules preload
-        mrs = self._molecules.order_by(lambda x: x.id).prefetch(self._database_.Molecule)[:]
-
-        # structures preload
-        ms = {x.molecule: [] for x in mrs}
-        for x in self._database_.MoleculeStructure.select(lambda x: x.molecule in ms.keys()):
-            if x.is_canonic:
-                x.molecule.__dict__['structure_entity'] = x
-            ms[x.molecule].append(x)
-        for m, s in ms.items():
-            m.__dict__['structures_entities'] = tuple(s)
-
-        # all possible reaction structure combinations
-        combinations = tuple(product(*(x.molecule.structures for x in mrs)))
-
-        structures = []
-        for x in combinations:
-            r, p = [], []
-            for s, m in zip(x, mrs):
-                if m.mapping:
-                    s = s.remap(m.mapping, copy=True)
-                if m.is_product:
-                    p.append(s)
-                else:
-                    r.append(s)
-            structures.append(ReactionContainer(r, p))
-
-        if 'structure' not in self.__dict__:
-            if len(structures) == 1:  # optimize
-                self.__dict__['structure'] = structures[0]
-            else:
-                r, p = [], []
-                for m in mrs:
-                    s = m.molecule.structure
-                    if m.mapping:
-                        s = s.remap(m.mapping, copy=True)
-                    if m.is_product:
-                        p.append(s)
-                    else:
-                        r.append(s)
-                self.__dict__['structure'] = ReactionContainer(r, p)
-        return tuple(structures)
+        """
+        all possible structures of reaction. molecules are shared as in structure - copy before editing
+        """
+        self.prefetch_structures((self,))
+        return self.__dict__['structures']
 
     @cached_property
     def cgr(self):
@@ -134,8 +83,78 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
         """
         return tuple(~x for x in self.structures)
 
+    def iter_structures(self, limit=None):
+        """
+        iterate over all possible structures of reaction with unique CGRs. structures are created lazily
+        in order of indexed combinations. duplicated by CGR combinations are not indexed and skipped.
+        molecules are shared as in structure - copy before editing
+
+        :param limit: maximal number of structures
+        """
+        if 'structures' in self.__dict__:  # same dedup as in index
+            if limit is not None and limit <= 0:
+                return
+            cgrs = self.__dict__.get('cgrs') or (~x for x in self.__dict__['structures'])
+            seen = set()
+            for r, cgr in zip(self.__dict__['structures'], cgrs):
+                sg = bytes(cgr)
+                if sg in seen:
+                    continue
+                seen.add(sg)
+                yield r
+                if len(seen) == limit:
+                    return
+            return
+
+        # mapping and molecules preload
+        mrs = self._molecules.order_by(lambda x: x.id).prefetch(self._database_.Molecule)[:]
+        self._database_.Molecule.prefetch_structures({x.molecule for x in mrs}, all_forms=True)
+        ms = {x.molecule: {s.id: s for s in x.molecule.structures_entities} for x in mrs}
+
+        schema = self._table_[0]  # define DB schema
+        q = f'''SELECT x.structures, x.signature FROM "{schema}"."ReactionIndex" x
+        WHERE x.reaction = {self.id} ORDER BY x.id'''
+        if limit is not None:
+            q += f' LIMIT {limit}'
+        for sis, sg in self._database_.select(q):
+            sis = set(sis)
+            candidates = [[s for i, s in ms[x.molecule].items() if i in sis] for x in mrs]
+            if all(len(x) == 1 for x in candidates):
+                yield self._combine(mrs, [x[0] for x in candidates])
+            else:  # same molecule presented in different forms. find combination by CGR signature
+                sg = bytes(sg)
+                for x in product(*candidates):
+                    r = self._combine(mrs, x)
+                    if bytes(~r) == sg:
+                        yield r
+                        break
+
+    def iter_cgrs(self, limit=None):
+        """
+        iterate over unique CGRs of all possible structures of reaction. CGRs are created lazily
+
+        :param limit: maximal number of CGRs
+        """
+        if 'cgrs' in self.__dict__:  # same dedup as in iter_structures
+            if limit is not None and limit <= 0:
+                return
+            seen = set()
+            for x in self.__dict__['cgrs']:
+                sg = bytes(x)
+                if sg in seen:
+                    continue
+                seen.add(sg)
+                yield x
+                if len(seen) == limit:
+                    return
+        else:
+            for x in self.iter_structures(limit):
+                yield ~x
+
     @classmethod
     def structure_exists(cls, structure):
+        from CGRtools.containers import ReactionContainer
+
         if not isinstance(structure, ReactionContainer):
             raise TypeError('Reaction expected')
         elif not structure.reactants or not structure.products:
@@ -149,6 +168,8 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
 
     @classmethod
     def find_structure(cls, structure):
+        from CGRtools.containers import ReactionContainer
+
         if not isinstance(structure, ReactionContainer):
             raise TypeError('Reaction expected')
         elif not structure.reactants or not structure.products:
@@ -164,59 +185,70 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
             return reaction
 
     @classmethod
-    def find_substructures(cls, structure):
+    def find_substructures(cls, structure, *, stats: bool = False):
         """
         substructure search
 
         substructure search is 2-step process. first step is screening procedure. next step is isomorphism testing.
 
         :param structure: CGRtools ReactionContainer
+        :param stats: return tuple of results and SearchStats
         :return: ReactionSearchCache object with all found reactions or None
         """
+        from CGRtools.containers import ReactionContainer
+
         if not isinstance(structure, ReactionContainer):
             raise TypeError('Reaction expected')
         elif not structure.reactants or not structure.products:
             raise ValueError('empty query')
 
+        fp = precomputed(cls._database_, 'reaction', structure)
         structure = dumps(structure).hex()
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(
-            f'''SELECT * FROM "{schema}".cgrdb_search_substructure_reactions('\\x{structure}'::bytea)''')[0]
-        if fnd:
-            c = cls._database_.ReactionSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+            f'''SELECT * FROM "{schema}".cgrdb_search_substructure_reactions('\\x{structure}'::bytea, {fp})''')[0]
+        result = cls._database_.ReactionSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @classmethod
-    def find_similar(cls, structure):
+    def find_similar(cls, structure, *, stats: bool = False):
         """
         Similarity search. When index not configured threshold = 0.5 is used.
 
         :param structure: CGRtools ReactionContainer
+        :param stats: return tuple of results and SearchStats
         :return: ReactionSearchCache object with all found reactions or None
         """
+        from CGRtools.containers import ReactionContainer
+
         if not isinstance(structure, ReactionContainer):
             raise TypeError('Reaction expected')
         elif not structure.reactants or not structure.products:
             raise ValueError('empty query')
 
+        fp = precomputed(cls._database_, 'reaction', structure)
         structure = dumps(structure).hex()
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(
-            f'''SELECT * FROM "{schema}".cgrdb_search_similar_reactions('\\x{structure}'::bytea)''')[0]
-        if fnd:
-            c = cls._database_.ReactionSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+            f'''SELECT * FROM "{schema}".cgrdb_search_similar_reactions('\\x{structure}'::bytea, {fp})''')[0]
+        result = cls._database_.ReactionSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @classmethod
-    def find_mappingless_substructures(cls, structure):
+    def find_mappingless_substructures(cls, structure, *, stats: bool = False):
         """
         search reactions by substructures of molecules
 
         :param structure: CGRtools ReactionContainer
+        :param stats: return tuple of results and SearchStats
         :return: ReactionSearchCache object with all found reactions or None
         """
+        from CGRtools.containers import ReactionContainer
+
         if not isinstance(structure, ReactionContainer):
             raise TypeError('Reaction expected')
         elif not structure.reactants and not structure.products:
@@ -226,20 +258,23 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(
             f'''SELECT * FROM "{schema}".cgrdb_search_mappingless_substructure_reactions('\\x{structure}'::bytea)''')[0]
-        if fnd:
-            c = cls._database_.ReactionSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+        result = cls._database_.ReactionSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @classmethod
-    def find_substructure_reactions(cls, structure, is_product: tOptional[bool] = None):
+    def find_substructure_reactions(cls, structure, is_product: tOptional[bool] = None, *, stats: bool = False):
         """
         search reactions including substructure molecules
 
         :param structure: CGRtools MoleculeContainer or QueryContainer
         :param is_product: role of molecule: Reactant = False, Product = True, Any = None
+        :param stats: return tuple of results and SearchStats
         :return:ReactionSearchCache object with all found reactions or None
         """
+        from CGRtools.containers import MoleculeContainer, QueryContainer
+
         if not isinstance(structure, (MoleculeContainer, QueryContainer)):
             raise TypeError('Molecule or Query expected')
         elif not len(structure):
@@ -252,24 +287,28 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
         else:
             raise ValueError('invalid role')
 
+        fp = precomputed(cls._database_, 'molecule', structure)
         structure = dumps(structure).hex()
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(f'''SELECT * FROM 
-            "{schema}".cgrdb_search_reactions_by_molecule('\\x{structure}'::bytea, {role}, 1)''')[0]
-        if fnd:
-            c = cls._database_.ReactionSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+            "{schema}".cgrdb_search_reactions_by_molecule('\\x{structure}'::bytea, {role}, 1, {fp})''')[0]
+        result = cls._database_.ReactionSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @classmethod
-    def find_similar_reactions(cls, structure, is_product: tOptional[bool] = None):
+    def find_similar_reactions(cls, structure, is_product: tOptional[bool] = None, *, stats: bool = False):
         """
         Search reactions including similar molecules. When index not configured threshold = 0.5 is used.
 
         :param structure: CGRtools MoleculeContainer
         :param is_product: role of molecule: Reactant = False, Product = True, Any = None
+        :param stats: return tuple of results and SearchStats
         :return:ReactionSearchCache object with all found reactions or None
         """
+        from CGRtools.containers import MoleculeContainer
+
         if not isinstance(structure, MoleculeContainer):
             raise TypeError('Molecule expected')
         elif not len(structure):
@@ -282,14 +321,15 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
         else:
             raise ValueError('invalid role')
 
+        fp = precomputed(cls._database_, 'molecule', structure)
         structure = dumps(structure).hex()
         schema = cls._table_[0]  # define DB schema
         ci, fnd = cls._database_.select(f'''SELECT * FROM
-            "{schema}".cgrdb_search_reactions_by_molecule('\\x{structure}'::bytea, {role}, 2)''')[0]
-        if fnd:
-            c = cls._database_.ReactionSearchCache[ci]
-            c.__dict__['_size'] = fnd
-            return c
+            "{schema}".cgrdb_search_reactions_by_molecule('\\x{structure}'::bytea, {role}, 2, {fp})''')[0]
+        result = cls._database_.ReactionSearchCache[ci] if fnd else None
+        if stats:
+            return result, SearchStats.last(cls)
+        return result
 
     @classmethod
     def prefetch_structure(cls, reactions):
@@ -297,21 +337,52 @@ class Reaction(metaclass=LazyEntityMeta, database='CGRdb'):
         preload reaction canonical structures
         :param reactions: Reaction entities list
         """
-        # preload all molecules and canonic structures
-        for x in select(ms for ms in cls._database_.MoleculeStructure for mr in cls._database_.MoleculeReaction
-                        if ms.molecule == mr.molecule and ms.is_canonic and
-                           mr.reaction in reactions).prefetch(cls._database_.Molecule):
-            x.molecule.__dict__['structure_entity'] = x
+        cls.prefetch_structures(reactions, all_forms=False)
 
-        # load mapping and fill reaction
-        rxn = defaultdict(lambda: ([], []))
-        for x in cls._database_.MoleculeReaction.select(lambda x: x.reaction in reactions).order_by(lambda x: x.id):
-            s = x.molecule.structure
-            if x.mapping:
-                s = s.remap(x.mapping, copy=True)
-            rxn[x.reaction][x.is_product].append(s)
-        for r, rp in rxn.items():
-            r.__dict__['structure'] = ReactionContainer(*rp)
+    @classmethod
+    def prefetch_structures(cls, reactions, all_forms=True):
+        """
+        preload structures of reactions in constant number of queries
+
+        :param reactions: Reaction entities collection
+        :param all_forms: load all possible structures of reactions. otherwise only canonical
+        """
+        key = 'structures' if all_forms else 'structure'
+        reactions = [x for x in reactions if key not in x.__dict__]
+        if not reactions:
+            return
+
+        # mapping and molecules preload
+        mrs = {x: [] for x in reactions}
+        for x in cls._database_.MoleculeReaction.select(lambda x: x.reaction in reactions).order_by(
+                lambda x: x.id).prefetch(cls._database_.Molecule):
+            mrs[x.reaction].append(x)
+        # molecules structures preload
+        cls._database_.Molecule.prefetch_structures({x.molecule for ms in mrs.values() for x in ms}, all_forms)
+
+        for r, ms in mrs.items():
+            if 'structure' not in r.__dict__:
+                r.__dict__['structure'] = cls._combine(ms, [x.molecule.structure_entity for x in ms])
+            if all_forms:
+                if all(len(x.molecule.structures_entities) == 1 for x in ms):  # optimize
+                    r.__dict__['structures'] = (r.__dict__['structure'],)
+                else:  # all possible reaction structure combinations
+                    r.__dict__['structures'] = tuple(cls._combine(ms, x)
+                                                     for x in product(*(x.molecule.structures_entities for x in ms)))
+
+    @staticmethod
+    def _combine(mrs, structures):
+        from CGRtools.containers import ReactionContainer
+
+        # molecules are shared read-only between reactions of session
+        r, p = [], []
+        for s, m in zip(structures, mrs):
+            s = s.remapped(m.mapping)
+            if m.is_product:
+                p.append(s)
+            else:
+                r.append(s)
+        return ReactionContainer(r, p)
 
 
 class MoleculeReaction(metaclass=LazyEntityMeta, database='CGRdb'):
@@ -321,11 +392,11 @@ class MoleculeReaction(metaclass=LazyEntityMeta, database='CGRdb'):
     reaction = Required('Reaction')
     molecule = Required('Molecule')
     is_product = Required(bool)
-    _mapping = Optional(Json, column='mapping', nullable=True)
+    _mapping = Optional(bytes, column='mapping', nullable=True)
 
     @cached_property
     def mapping(self):
-        return dict(self._mapping) if self._mapping else {}
+        return unpack_mapping(self._mapping) if self._mapping else {}
 
 
 class ReactionIndex(metaclass=LazyEntityMeta, database='CGRdb'):
@@ -341,8 +412,10 @@ class ReactionSearchCache(metaclass=LazyEntityMeta, database='CGRdb'):
     signature = Required(bytes)
     operator = Required(str)
     date = Required(datetime, default=datetime.utcnow)
-    _reactions = Required(IntArray, optimistic=False, index=False, column='reactions', lazy=True)
-    _tanimotos = Required(FloatArray, optimistic=False, index=False, column='tanimotos', lazy=True, sql_type='real[]')
+    used = Required(datetime, default=datetime.utcnow, optimistic=False, volatile=True)
+    _generation = Required(int, size=64, optimistic=False, volatile=True, column='generation')
+    _watermark = Required(int, optimistic=False, volatile=True, column='watermark')
+    _size = Required(int, optimistic=False, volatile=True, column='size')
     composite_key(signature, operator)
 
     def reactions(self, page=1, pagesize=100):
@@ -353,15 +426,10 @@ class ReactionSearchCache(metaclass=LazyEntityMeta, database='CGRdb'):
 
         start = (page - 1) * pagesize
         end = start + pagesize
-        ris = select(x._reactions[start:end] for x in self.__class__ if x.id == self.id).first()
+        ris = self._slice('reactions', start, end)
         if not ris:
             return []
-
-        # preload molecules
-        rs = {x.id: x for x in self._database_.Reaction.select(lambda x: x.id in ris)}
-        rs = [rs[x] for x in ris]
-        self._database_.Reaction.prefetch_structure(rs)
-        return rs
+        return self._load(ris)
 
     def tanimotos(self, page=1, pagesize=100):
         if page < 1:
@@ -371,15 +439,63 @@ class ReactionSearchCache(metaclass=LazyEntityMeta, database='CGRdb'):
 
         start = (page - 1) * pagesize
         end = start + pagesize
-        sts = select(x._tanimotos[start:end] for x in self.__class__ if x.id == self.id).first()
-        return list(sts)
+        return self._slice('tanimotos', start, end)
+
+    def iter_reactions(self, batch=100):
+        """
+        iterate over all found reactions. results blocks are read sequentially.
+
+        :param batch: number of reactions loaded at once
+        """
+        if batch < 1:
+            raise ValueError('batch should be greater or equal than 1')
+
+        schema = self._table_[0]  # define DB schema
+        start = -1
+        while True:
+            block = self._database_.select(
+                f'''SELECT x.start, x.reactions FROM "{schema}"."ReactionSearchCacheBlock" x
+                WHERE x.cache = {self.id} AND x.start > {start} ORDER BY x.start LIMIT 1''')
+            if not block:
+                return
+            start, ris = block[0]
+            for n in range(0, len(ris), batch):
+                yield from self._load(ris[n: n + batch])
+
+    def _slice(self, column, start, end):
+        # read only blocks overlapped with requested range
+        schema = self._table_[0]  # define DB schema
+        blocks = self._database_.select(
+            f'''SELECT x.start, x.{column} FROM "{schema}"."ReactionSearchCacheBlock" x
+            WHERE x.cache = {self.id} AND x.start < {end} AND x.start >= (
+                SELECT max(y.start) FROM "{schema}"."ReactionSearchCacheBlock" y
+                WHERE y.cache = {self.id} AND y.start <= {start})
+            ORDER BY x.start''')
+        if not blocks:
+            return []
+        offset = blocks[0][0]
+        return [x for _, block in blocks for x in block][start - offset:end - offset]
+
+    def _load(self, ris):
+        # preload reactions
+        rs = {x.id: x for x in self._database_.Reaction.select(lambda x: x.id in ris)}
+        rs = [rs[x] for x in ris]
+        self._database_.Reaction.prefetch_structures(rs, all_forms=False)
+        return rs
 
     def __len__(self):
         return self._size
 
-    @cached_property
-    def _size(self):
-        return select(raw_sql('array_length(x.reactions, 1)') for x in self.__class__ if x.id == self.id).first()
+    @classmethod
+    def statistics(cls):
+        """
+        cache hits and misses counters
+        """
+        schema = cls._table_[0]  # define DB schema
+        hits, misses = cls._database_.select(
+            f'''SELECT h.last_value * h.is_called::integer, m.last_value * m.is_called::integer
+            FROM "{schema}".cgrdb_reaction_cache_hits h, "{schema}".cgrdb_reaction_cache_misses m''')[0]
+        return {'hits': hits, 'misses': misses}
 
 
 __all__ = ['Reaction', 'MoleculeReaction', 'ReactionIndex', 'ReactionSearchCache']
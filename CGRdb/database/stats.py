@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class SearchStats(NamedTuple):
+    """
+    timings and counters of search function
+    """
+    function: str
+    cache: Optional[str]  # hit, miss, refresh or None for not cached searches
+    stages: Dict[str, float]  # seconds spent in each stage
+    candidates: Optional[int]  # number of structures passed screening. None for lazy sequential screening
+    hits: Optional[int]  # number of found structures
+    nested: Tuple['SearchStats', ...]  # statistics of molecules searches used in reactions searches
+    checked: Optional[int] = None  # number of candidates verified by substructure isomorphism
+
+    @property
+    def total(self) -> float:
+        """
+        total time of search in seconds
+        """
+        return sum(self.stages.values())
+
+    @classmethod
+    def last(cls, entity) -> Optional['SearchStats']:
+        """
+        statistics of last search in current connection
+
+        :param entity: Molecule or Reaction class of schema
+        """
+        schema = entity._table_[0]  # define DB schema
+        data = entity._database_.select(f'SELECT "{schema}".cgrdb_search_stats()')[0]
+        if data:
+            return cls._from_dict(data)
+
+    @classmethod
+    def _from_dict(cls, data):
+        return cls(data['function'], data['cache'], data['stages'], data['candidates'], data['hits'],
+                   tuple(cls._from_dict(x) for x in data['nested']), data.get('checked'))
+
+
+__all__ = ['SearchStats']
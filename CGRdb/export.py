@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from collections import deque
+from io import StringIO
+from itertools import groupby, islice
+from multiprocessing import Pool
+from os import cpu_count
+from pickle import loads
+from psycopg2 import connect
+from time import monotonic, strftime
+
+
+formats = ('rdf', 'sdf', 'smiles')
+
+
+def _write(fmt, structures):
+    if fmt == 'smiles':
+        return ''.join(f'{s} {s.meta["cgrdb_id"]}\n' for s in structures)
+
+    from CGRtools.files import RDFWrite, SDFWrite
+    buffer = StringIO()
+    writer = (RDFWrite if fmt == 'rdf' else SDFWrite)(buffer, append=True)  # header written by exporter
+    for s in structures:
+        writer.write(s)
+    return buffer.getvalue()
+
+
+def _decode_molecules(task):
+    fmt, chunk = task
+    structures = []
+    for i, t, structure in chunk:
+        s = loads(structure)
+        s.meta['cgrdb_id'] = i
+        if t is not None:
+            s.meta['tanimoto'] = f'{t:.2f}'
+        structures.append(s)
+    return len(structures), _write(fmt, structures)
+
+
+def _decode_reactions(task):
+    from CGRtools.containers import ReactionContainer
+    from .mapping import unpack_mapping
+
+    fmt, chunk = task
+    structures = []
+    for i, t, molecules in chunk:
+        rp = ([], [])
+        for is_product, mapping, structure in molecules:
+            s = loads(structure)  # unpickled structure is private. remap in place
+            if mapping:
+                s.remap(unpack_mapping(mapping))
+            rp[is_product].append(s)
+        s = ReactionContainer(*rp)
+        s.meta['cgrdb_id'] = i
+        if t is not None:
+            s.meta['tanimoto'] = f'{t:.2f}'
+        structures.append(s)
+    return len(structures), _write(fmt, structures)
+
+
+def _export(query, params, records, decoder, file, fmt, connection, batch, chunk, workers, report):
+    if fmt not in formats:
+        raise ValueError(f'format should be one of {formats}')
+    elif batch < 1 or chunk < 1:
+        raise ValueError('batch and chunk should be greater or equal than 1')
+
+    if fmt == 'rdf':
+        file.write(strftime('$RDFILE 1\n$DATM    %m/%d/%y %H:%M\n'))
+
+    count = 0
+    start = monotonic()
+
+    def dump(n, data):
+        nonlocal count
+        file.write(data)
+        count += n
+        if report:
+            report(count, monotonic() - start)
+
+    db = connect(**connection)
+    try:
+        with db, db.cursor('cgrdb_export') as cursor:  # transaction required for server-side cursor
+            cursor.itersize = batch
+            cursor.execute(query, params)
+            records = records(cursor)
+            tasks = iter(lambda: list(islice(records, chunk)), [])
+
+            if workers == 0:  # decode in current process
+                for task in tasks:
+                    dump(*decoder((fmt, task)))
+            else:
+                workers = workers or cpu_count()
+                with Pool(workers) as pool:
+                    queue = deque()
+                    for task in tasks:
+                        queue.append(pool.apply_async(decoder, ((fmt, task),)))
+                        if len(queue) >= 2 * workers:  # keep memory bounded
+                            dump(*queue.popleft().get())
+                    while queue:
+                        dump(*queue.popleft().get())
+    finally:
+        db.close()
+    return count
+
+
+def export_molecules(file, schema, connection, *, cache=None, fmt='sdf', batch=10000, chunk=1000, workers=None,
+                     report=None):
+    """
+    stream canonical structures of molecules into file
+
+    :param file: opened text file
+    :param schema: schema name
+    :param connection: db connection params. see pony db.bind
+    :param cache: MoleculeSearchCache id. if None all molecules exported
+    :param fmt: rdf, sdf or smiles
+    :param batch: number of rows fetched from server-side cursor at once
+    :param chunk: number of molecules decoded by worker at once
+    :param workers: number of decoding processes. 0 - decode in current process. None - number of CPUs
+    :param report: callable receiving number of exported molecules and elapsed time in seconds
+    :return: number of exported molecules
+    """
+    if cache is None:
+        query = f'''SELECT x.molecule, NULL::real, x.structure FROM "{schema}"."MoleculeStructure" x
+WHERE x.is_canonic ORDER BY x.molecule'''
+        params = None
+    else:
+        query = f'''SELECT h.m, h.t, x.structure
+FROM "{schema}"."MoleculeSearchCacheBlock" b
+     CROSS JOIN LATERAL unnest(b.molecules, b.tanimotos) WITH ORDINALITY h(m, t, n)
+     JOIN "{schema}"."MoleculeStructure" x ON x.molecule = h.m AND x.is_canonic
+WHERE b.cache = %s
+ORDER BY b.start, h.n'''
+        params = (cache,)
+
+    def records(rows):
+        for i, t, s in rows:
+            yield i, t, bytes(s)  # memoryview is not picklable
+
+    return _export(query, params, records, _decode_molecules, file, fmt, connection, batch, chunk, workers, report)
+
+
+def export_reactions(file, schema, connection, *, cache=None, fmt='rdf', batch=10000, chunk=1000, workers=None,
+                     report=None):
+    """
+    stream canonical structures of reactions into file
+
+    :param file: opened text file
+    :param schema: schema name
+    :param connection: db connection params. see pony db.bind
+    :param cache: ReactionSearchCache id. if None all reactions exported
+    :param fmt: rdf or smiles
+    :param batch: number of rows fetched from server-side cursor at once
+    :param chunk: number of reactions decoded by worker at once
+    :param workers: number of decoding processes. 0 - decode in current process. None - number of CPUs
+    :param report: callable receiving number of exported reactions and elapsed time in seconds
+    :return: number of exported reactions
+    """
+    if fmt == 'sdf':
+        raise ValueError('reactions can not be stored in SDF')
+
+    if cache is None:
+        query = f'''SELECT r.reaction, r.reaction, NULL::real, r.is_product, r.mapping, x.structure
+FROM "{schema}"."MoleculeReaction" r
+     JOIN "{schema}"."MoleculeStructure" x ON x.molecule = r.molecule AND x.is_canonic
+ORDER BY r.reaction, r.id'''
+        params = None
+    else:
+        query = f'''SELECT b.start + h.n, h.r, h.t, r.is_product, r.mapping, x.structure
+FROM "{schema}"."ReactionSearchCacheBlock" b
+     CROSS JOIN LATERAL unnest(b.reactions, b.tanimotos) WITH ORDINALITY h(r, t, n)
+     JOIN "{schema}"."MoleculeReaction" r ON r.reaction = h.r
+     JOIN "{schema}"."MoleculeStructure" x ON x.molecule = r.molecule AND x.is_canonic
+WHERE b.cache = %s
+ORDER BY b.start, h.n, r.id'''
+        params = (cache,)
+
+    def records(rows):
+        # rows of same hit grouped into reaction
+        for _, group in groupby(rows, key=lambda x: x[0]):
+            group = list(group)
+            yield group[0][1], group[0][2], [(p, m and bytes(m), bytes(s)) for *_, p, m, s in group]
+
+    return _export(query, params, records, _decode_reactions, file, fmt, connection, batch, chunk, workers, report)
+
+
+__all__ = ['export_molecules', 'export_reactions']
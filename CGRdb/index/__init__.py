@@ -16,5 +16,6 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
+from .reaction import *
 from .similarity import *
 from .substructure import *
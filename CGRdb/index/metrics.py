@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+
+class Histogram:
+    """
+    Prometheus-like histogram with labels. observation is a single bisect and increment
+    """
+    def __init__(self, name: str, description: str, buckets: Iterable[float]):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._data: Dict[str, List[float]] = {}  # labels: per bucket counts with +Inf, sum
+
+    def observe(self, labels: str, value: float):
+        try:
+            data = self._data[labels]
+        except KeyError:
+            data = self._data[labels] = [0] * (len(self.buckets) + 2)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, data in self._data.items():
+            cumulative = 0
+            for b, c in zip((*self.buckets, '+Inf'), data):
+                cumulative += c
+                lines.append(f'{self.name}_bucket{{{labels},le="{b}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {data[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._data: Dict[str, int] = defaultdict(int)
+
+    def inc(self, labels: str):
+        self._data[labels] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{{{labels}}} {value}' for labels, value in self._data.items())
+        return lines
+
+
+def gauge(name: str, description: str, values: Iterable[Tuple[str, float]]) -> List[str]:
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+    lines.extend(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}' for labels, value in values)
+    return lines
+
+
+def rss() -> int:
+    """
+    resident set size of current process in bytes
+    """
+    try:
+        from os import sysconf
+
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+    except (ImportError, OSError):  # not linux. peak RSS in kilobytes
+        try:
+            from resource import getrusage, RUSAGE_SELF
+        except ImportError:
+            return 0
+        return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """
+    index daemon metrics in Prometheus text format
+    """
+    def __init__(self, indexes: Dict[str, object]):
+        self.requests = Counter('cgrdb_index_requests_total', 'Number of search requests')
+        self.errors = Counter('cgrdb_index_errors_total', 'Number of failed search requests')
+        self.latency = Histogram('cgrdb_index_latency_seconds', 'Search latency',
+                                 (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.))
+        self.found = Histogram('cgrdb_index_found', 'Number of returned records',
+                               (0, 1, 10, 100, 1000, 10000, 100000, 1000000))
+        self.candidates = Histogram('cgrdb_index_candidates', 'Number of candidates before final filtering',
+                                    (0, 1, 10, 100, 1000, 10000, 100000, 1000000))
+        self.steps = Histogram('cgrdb_index_intersection_steps', 'Number of posting lists intersections',
+                               (0, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+        self._static = self._index_stats(indexes)
+
+    def observe(self, route: str, seconds: float, found: int, stats: dict):
+        labels = f'route="{route}"'
+        self.requests.inc(labels)
+        self.latency.observe(labels, seconds)
+        self.found.observe(labels, found)
+        if 'candidates' in stats:
+            self.candidates.observe(labels, stats['candidates'])
+        if 'steps' in stats:
+            self.steps.observe(labels, stats['steps'])
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.requests, self.errors, self.latency, self.found, self.candidates, self.steps):
+            lines.extend(metric.render())
+        lines.extend(self._static)
+        lines.extend(gauge('cgrdb_index_process_rss_bytes', 'Resident set size of daemon', [('', rss())]))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _index_stats(indexes):
+        # indexes are immutable. collect once on start
+        records, postings, buckets, largest = [], [], [], []
+        for route, index in indexes.items():
+            labels = f'route="{route}"'
+            for name, value in index.stats().items():
+                if name == 'records':
+                    records.append((labels, value))
+                elif name == 'postings':
+                    postings.append((labels, value))
+                elif name == 'buckets':
+                    buckets.append((labels, value))
+                elif name == 'largest_bucket':
+                    largest.append((labels, value))
+        return [*gauge('cgrdb_index_records', 'Number of indexed records', records),
+                *gauge('cgrdb_index_postings', 'Number of posting lists of substructure index', postings),
+                *gauge('cgrdb_index_lsh_buckets', 'Number of LSH buckets of similarity index', buckets),
+                *gauge('cgrdb_index_lsh_largest_bucket', 'Size of largest LSH bucket', largest)]
+
+
+__all__ = ['Metrics']
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from pyroaring import BitMap
+from tqdm import tqdm
+from typing import Collection, Dict, Optional, Tuple
+
+
+class MoleculeReactionIndex:
+    def __init__(self, pairs: Collection[Tuple[int, int, bool]]):
+        """
+        Molecule to reactions postings split by role.
+
+        :param pairs: molecule id, reaction id and is_product triples
+        """
+        self._positions = positions = {}  # molecule id to postings index
+        self._reactants = reactants = []
+        self._products = products = []
+        watermark = 0
+        for m, r, is_product in tqdm(pairs):
+            try:
+                n = positions[m]
+            except KeyError:
+                n = positions[m] = len(reactants)
+                reactants.append(None)
+                products.append(None)
+            postings = products if is_product else reactants
+            if postings[n] is None:
+                postings[n] = BitMap()
+            postings[n].add(r)
+            if r > watermark:
+                watermark = r
+        for p in (*reactants, *products):
+            if p is not None:
+                p.run_optimize()
+        self._watermark = watermark
+
+    def search(self, query: dict, stats: Optional[dict] = None) -> dict:
+        """
+        Reactions of molecules. Each reaction scored by first molecule containing it.
+
+        :param query: dict with molecules ids ordered by tanimoto descending (`molecules`), their tanimotos
+            (`tanimotos`) and role (`role`): 0 - any, 1 - reactant, 2 - product
+        :param stats: dict for filling number of matched molecules
+        :return: dict of found reactions, their tanimotos and maximal indexed reaction id (`watermark`).
+            reactions added after index building should be found in db
+        """
+        role = query.get('role', 0)
+        if role == 1:
+            postings = (self._reactants,)
+        elif role == 2:
+            postings = (self._products,)
+        else:
+            postings = (self._reactants, self._products)
+        positions = self._positions
+
+        seen = BitMap()
+        reactions, tanimotos = [], []
+        matched = 0
+        for m, t in zip(query['molecules'], query['tanimotos']):
+            try:
+                n = positions[m]
+            except KeyError:  # molecule without indexed reactions
+                continue
+            for p in postings:
+                p = p[n]
+                if p is None:
+                    continue
+                new = p - seen
+                if new:
+                    seen |= new
+                    reactions.extend(new)
+                    tanimotos.extend([t] * len(new))
+            matched += 1
+        if stats is not None:
+            stats['candidates'] = matched
+        return {'reactions': reactions, 'tanimotos': tanimotos, 'watermark': self._watermark}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        size of index
+        """
+        return {'records': len(self._positions),
+                'postings': sum(1 for x in (*self._reactants, *self._products) if x is not None)}
+
+
+__all__ = ['MoleculeReactionIndex']
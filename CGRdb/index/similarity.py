@@ -16,13 +16,13 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
+from array import array
 from datasketch import MinHash, MinHashLSH
-from itertools import tee
 from multiprocessing import Pool
 from operator import itemgetter
 from pyroaring import BitMap
 from tqdm import tqdm
-from typing import Collection, Tuple, List, Optional, Union
+from typing import Collection, Dict, Tuple, List, Optional, Union
 
 
 def get_minhash(args):
@@ -38,6 +38,8 @@ class SimilarityIndex:
                  n_workers: int = 1, chunk_size: int = 10000):
         """
         MinHashLSH based similarity search index.
+        Records ids are remapped to dense range in order of fingerprints.
+        Same ordered data produce compatible with SubstructureIndex fingerprints storage.
 
         :param fingerprints: pairs of id and fingerprints of data
         :param check_threshold: do additional Tanimoto filtering and descending sorting on original data.
@@ -49,38 +51,57 @@ class SimilarityIndex:
         """
 
         self._lsh = lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
-        self._fingerprints = fps = {} if check_threshold is not None else None
+        self._ids = ids = array('q')  # dense id to record id
+        self._fingerprints = fps = [] if check_threshold is not None else None
         self._threshold = check_threshold
 
+        def remap():
+            for n, (i, fp) in enumerate(fingerprints):
+                ids.append(i)
+                if check_threshold is not None:
+                    fps.append(BitMap(fp))
+                yield n, fp
+
         if n_workers != 1:
-            if check_threshold is not None:
-                pipe1, pipe2 = tee(fingerprints, 2)
-            else:
-                pipe1 = fingerprints
             with Pool(processes=n_workers) as pool:
-                for n, h in pool.imap_unordered(get_minhash, ((x, num_perm) for x in tqdm(pipe1)), chunk_size):
+                for n, h in pool.imap_unordered(get_minhash, ((x, num_perm) for x in tqdm(remap())), chunk_size):
                     lsh.insert(n, h, check_duplication=False)
-                    if check_threshold is not None:
-                        m, fp = next(pipe2)
-                        fps[m] = BitMap(fp)
         else:
-            for fp in tqdm(fingerprints):
+            for fp in tqdm(remap()):
                 n, h = get_minhash((fp, num_perm))
                 lsh.insert(n, h, check_duplication=False)
-                if check_threshold is not None:
-                    fps[n] = BitMap(fp[1])
 
-    def search(self, query: List[int]) -> Union[List[int], List[Tuple[int, float]]]:
+    def __setstate__(self, state):
+        if '_ids' not in state:
+            raise ValueError('index dump has old format. regenerate it by `cgrdb index`')
+        self.__dict__.update(state)
+
+    def search(self, query: List[int], stats: Optional[dict] = None) -> Union[List[int], List[Tuple[int, float]]]:
+        """
+        :param query: fingerprint of query
+        :param stats: dict for filling number of LSH candidates
+        """
         h = MinHash(num_perm=self._lsh.h, hashfunc=hash)
         h.update_batch(query)
         found = self._lsh.query(h)
+        if stats is not None:
+            stats['candidates'] = len(found)
+        ids = self._ids
         if self._threshold is not None:
             threshold = self._threshold
             fps = self._fingerprints
             bm = BitMap(query)
-            return sorted(((x, j) for x in found if (j := bm.jaccard_index(fps[x])) >= threshold),
+            return sorted(((ids[x], j) for x in found if (j := bm.jaccard_index(fps[x])) >= threshold),
                           key=itemgetter(1), reverse=True)
-        return found
+        return [ids[x] for x in found]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        size of index and LSH buckets
+        """
+        lsh = self._lsh
+        return {'records': lsh.keys.size(), 'buckets': sum(x.size() for x in lsh.hashtables),
+                'largest_bucket': max((max(x.itemcounts().values(), default=0) for x in lsh.hashtables), default=0)}
 
 
 __all__ = ['SimilarityIndex']
@@ -16,53 +16,108 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from collections import defaultdict
+from array import array
 from operator import itemgetter
 from pyroaring import BitMap
 from tqdm import tqdm
-from typing import Collection, Tuple, List, Union
+from typing import Collection, Dict, Tuple, List, Optional, Union
 
 
 class SubstructureIndex:
-    def __init__(self, fingerprints: Collection[Tuple[int, Collection[int]]], sort_by_tanimoto: bool = True):
+    verify_limit = 100  # candidates count then subset check is cheaper than posting lists intersection
+
+    def __init__(self, fingerprints: Collection[Tuple[int, Collection[int]]], sort_by_tanimoto: bool = True,
+                 length: Optional[int] = None):
         """
         Inverted search index.
+        Records ids are remapped to dense range in order of fingerprints for better bitmaps compression.
 
-        :param fingerprints: pairs of id and fingerprints of data
+        :param fingerprints: pairs of id and fingerprints of data. id ordered data preferred
         :param sort_by_tanimoto: descending sort of found results. Required more memory for data storing.
+        :param length: fingerprint length. posting lists array is extended on bigger bits
         """
-        self._index = index = defaultdict(BitMap)
-        self._fingerprints = fps = {} if sort_by_tanimoto else None
-        for n, fp in tqdm(fingerprints):
+        self._ids = ids = array('q')  # dense id to record id
+        self._index = index = [None] * (length or 0)  # bit to posting list
+        self._fingerprints = fps = [] if sort_by_tanimoto else None
+        for n, (i, fp) in enumerate(tqdm(fingerprints)):
+            ids.append(i)
             for x in fp:
-                index[x].add(n)
+                try:
+                    p = index[x]
+                except IndexError:
+                    index.extend([None] * (x + 1 - len(index)))
+                    p = None
+                if p is None:
+                    p = index[x] = BitMap()
+                p.add(n)
             if sort_by_tanimoto:
-                fps[n] = BitMap(fp)
-        self._sizes = {k: len(v) for k, v in index.items()}
+                fps.append(BitMap(fp))
+        for p in index:
+            if p is not None:
+                p.run_optimize()
+        self._sizes = array('L', (len(p) if p is not None else 0 for p in index))
 
     def __getstate__(self):
-        return {'index': self._index, 'fingerprints': self._fingerprints}
+        return {'ids': self._ids, 'index': self._index, 'fingerprints': self._fingerprints}
 
     def __setstate__(self, state):
-        self._index = state['index']
+        if 'ids' not in state:
+            raise ValueError('index dump has old format. regenerate it by `cgrdb index`')
+        self._ids = state['ids']
+        self._index = index = state['index']
         self._fingerprints = state['fingerprints']
-        self._sizes = {k: len(v) for k, v in state['index'].items()}
+        self._sizes = array('L', (len(p) if p is not None else 0 for p in index))
+
+    def search(self, query: List[int], stats: Optional[dict] = None) -> Union[List[int], List[Tuple[int, float]]]:
+        """
+        Posting lists intersected from most selective. Intersection stopped on small enough candidates set,
+        which is checked by fingerprints subset test if fingerprints stored.
 
-    def search(self, query: List[int]) -> Union[List[int], List[Tuple[int, float]]]:
+        :param query: fingerprint of query
+        :param stats: dict for filling number of intersections and candidates
+        """
         index = self._index
         sizes = self._sizes
-        fb, *sq = sorted(query, key=lambda x: sizes.get(x, 0))
+        fps = self._fingerprints
+        bm = BitMap(query)
 
-        records = index[fb].copy()
-        for k in sq:
-            records &= index[k]
-            if not records:
-                return []
-        if self._fingerprints:
-            bm = BitMap(query)
-            fps = self._fingerprints
-            return sorted(((x, bm.jaccard_index(fps[x])) for x in records), key=itemgetter(1), reverse=True)
-        return list(records)
+        steps = 0
+        if not bm or bm.max() >= len(sizes) or not all(sizes[x] for x in bm):  # bit not found in any record
+            records = BitMap()
+        else:
+            order = sorted(bm, key=sizes.__getitem__)
+            if fps is None:  # nothing to verify on. multi-way intersection
+                records = BitMap.intersection(*(index[x] for x in order))
+                steps = len(order) - 1
+            else:
+                records = index[order[0]]
+                limit = self.verify_limit
+                for k in order[1:]:
+                    if len(records) <= limit:
+                        break
+                    if steps:
+                        records &= index[k]
+                    else:  # posting list shouldn't be changed
+                        records = records & index[k]
+                    steps += 1
+        if stats is not None:
+            stats['steps'] = steps
+            stats['candidates'] = len(records)
+        if not records:
+            return []
+
+        ids = self._ids
+        if fps is not None:
+            if steps < len(bm) - 1:  # early stopped
+                records = [x for x in records if bm.issubset(fps[x])]
+            return sorted(((ids[x], bm.jaccard_index(fps[x])) for x in records), key=itemgetter(1), reverse=True)
+        return [ids[x] for x in records]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        size of index
+        """
+        return {'records': len(self._ids), 'postings': sum(1 for x in self._sizes if x)}
 
 
 __all__ = ['SubstructureIndex']
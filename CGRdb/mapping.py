@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+# atom-to-atom mapping codec. source of module is inlined into cgrdb_init_session db function.
+# only standard library is allowed
+from array import array
+from sys import byteorder
+
+
+def pack_mapping(mapping):
+    """
+    pack atom-to-atom mapping into bytes of big-endian int32 pairs
+    """
+    data = array('i', [x for kv in mapping.items() for x in kv])
+    if byteorder == 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_mapping(data):
+    """
+    unpack atom-to-atom mapping from bytes of big-endian int32 pairs
+    """
+    data = array('i', data)
+    if byteorder == 'little':
+        data.byteswap()
+    return dict(zip(data[::2], data[1::2]))
+
+
+__all__ = ['pack_mapping', 'unpack_mapping']
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from functools import lru_cache
+from importlib import import_module
+from json import dump, load
+from os import environ, getpid, makedirs, replace, stat
+from os.path import dirname, expanduser, isdir, join
+from sys import executable, path
+from typing import Iterable
+
+
+def get_major_version() -> str:
+    """
+    version of CGRdb without patch number. schemas are compatible within major version
+    """
+    cache = _load_cache()
+    try:
+        return cache['version']
+    except KeyError:
+        pass
+
+    from importlib.metadata import version
+
+    cache['version'] = v = '.'.join(version('CGRdb').split('.')[:-1])
+    _save_cache(cache)
+    return v
+
+
+def check_packages(packages: Iterable[str]):
+    """
+    check versions and import packages required by schema.
+    successfully checked requirements are cached on disk until installed packages changed.
+    packages are always imported: they can register entities of schema.
+
+    :param packages: requirements strings. e.g. `CGRtools>=4.1,<4.2`
+    """
+    from packaging.requirements import Requirement
+
+    packages = sorted(packages)
+    requirements = [Requirement(p) for p in packages]
+    cache = _load_cache()
+    if packages not in cache['packages']:
+        from importlib.metadata import version, PackageNotFoundError
+
+        for p, r in zip(packages, requirements):
+            try:
+                v = version(r.name)
+            except PackageNotFoundError:
+                raise ImportError(f'packages not installed or has invalid versions: {p}')
+            if not r.specifier.contains(v, prereleases=True):
+                raise ImportError(f'packages not installed or has invalid versions: {p}')
+
+        cache['packages'].append(packages)
+        _save_cache(cache)
+
+    for r in requirements:
+        import_module(r.name)
+
+
+def cache_file() -> str:
+    """
+    path of bootstrap cache. CGRDB_CACHE environment variable overrides default location
+    """
+    return environ.get('CGRDB_CACHE') or \
+        join(environ.get('XDG_CACHE_HOME') or expanduser(join('~', '.cache')), 'cgrdb', 'bootstrap.json')
+
+
+@lru_cache()
+def _environment():
+    # installation or upgrade of any package changes mtime of its site directory
+    return [executable, [[p, stat(p).st_mtime_ns] for p in path if p and isdir(p)]]
+
+
+def _load_cache():
+    try:
+        with open(cache_file()) as f:
+            cache = load(f)
+    except (OSError, ValueError):
+        pass
+    else:
+        if isinstance(cache, dict) and cache.get('environment') == _environment():
+            return cache
+    return {'environment': _environment(), 'packages': []}
+
+
+def _save_cache(cache):
+    file = cache_file()
+    tmp = f'{file}.{getpid()}'  # concurrent processes replace cache atomically
+    try:  # cache is optional. e.g. home is read-only for cron user
+        makedirs(dirname(file), exist_ok=True)
+        with open(tmp, 'w') as f:
+            dump(cache, f)
+        replace(tmp, file)
+    except OSError:
+        pass
+
+
+__all__ = ['get_major_version', 'check_packages', 'cache_file']
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from collections import deque
+from functools import lru_cache
+from io import StringIO
+from itertools import groupby, islice, product
+from json import dumps, loads as json_loads
+from multiprocessing import Pool
+from os import cpu_count
+from pickle import loads
+from psycopg2 import connect
+from time import monotonic
+from .metadata import get_major_version
+from .sql import *
+
+
+# functions recreated on switch. new plans version forces sessions to reload config
+functions = (init_session, insert_molecule, after_insert_molecule, insert_reaction, merge_molecules,
+             search_structure_molecule, search_structure_reaction, search_similar_molecules,
+             search_substructure_molecule, search_similar_reactions, search_substructure_reaction,
+             search_reactions_by_molecule, search_mappingless_reaction)
+
+
+@lru_cache()
+def _fingerprinter(params):
+    from StructureFingerprint import LinearFingerprint
+    return LinearFingerprint(**json_loads(params))
+
+
+def _molecules(task):
+    params, chunk = task
+    ids = [i for i, _ in chunk]
+    fps = _fingerprinter(params).transform_bitset([loads(s) for _, s in chunk])
+    return len(chunk), [(str(i), fp) for i, fp in zip(ids, fps)]
+
+
+def _reactions(task):
+    from CGRtools.containers import ReactionContainer
+    from .mapping import unpack_mapping
+
+    params, chunk = task
+    sgs, cgrs = [], []
+    for components in chunk:
+        # same combinations of structures forms as in cgrdb_insert_reaction
+        forms = []
+        for is_product, mapping, structures in components:
+            mapping = mapping and unpack_mapping(mapping)
+            ms = []
+            for s in structures:
+                s = loads(s)  # unpickled structure is private. remap in place
+                if mapping:
+                    s.remap(mapping)
+                ms.append((is_product, s))
+            forms.append(ms)
+        for r in product(*forms):
+            c = ~ReactionContainer([s for p, s in r if not p], [s for p, s in r if p])
+            cgrs.append(c)
+            sgs.append(bytes(c))
+    fps = _fingerprinter(params).transform_bitset(cgrs)
+    return len(chunk), [(f'\\\\x{sg.hex()}', fp) for sg, fp in zip(sgs, fps)]
+
+
+def _molecule_records(rows):
+    for i, s in rows:
+        yield i, bytes(s)  # memoryview is not picklable
+
+
+def _reaction_records(rows):
+    # rows of same reaction grouped into components with all structures forms
+    for _, group in groupby(rows, key=lambda x: x[0]):
+        components = []
+        for _, c in groupby(group, key=lambda x: x[1]):
+            c = list(c)
+            components.append((c[0][2], c[0][3] and bytes(c[0][3]), [bytes(x[4]) for x in c]))
+        yield components
+
+
+def refingerprint(schema, connection, params, *, batch=10000, chunk=1000, workers=None, report=None):
+    """
+    recalculate fingerprints of structures by new params without service interruption.
+
+    fingerprints are calculated into shadow columns by workers pool and loaded by COPY in batches.
+    structures added during calculation are caught up. finally, under short exclusive lock,
+    shadow columns replace fingerprints, config of schema updated, search cache invalidated and
+    functions recreated. sessions reload config on first call of recreated functions.
+    index daemon should be restarted with index rebuilt after switch.
+
+    :param schema: schema name
+    :param connection: db connection params. see pony db.bind
+    :param params: new fingerprints params. dict with molecule and/or reaction keys. other keys of config kept
+    :param batch: number of rows fetched from server-side cursor and updated at once
+    :param chunk: number of structures fingerprinted by worker at once
+    :param workers: number of fingerprinting processes. 0 - calculate in current process. None - number of CPUs
+    :param report: callable receiving stage name, number of processed structures and elapsed time in seconds
+    :return: new config of schema
+    """
+    if not params or not set(params).issubset(('molecule', 'reaction')):
+        raise ValueError('molecule and/or reaction fingerprints params expected')
+    elif batch < 1 or chunk < 1:
+        raise ValueError('batch and chunk should be greater or equal than 1')
+
+    major_version = get_major_version()
+    writer = connect(**connection)
+    reader = connect(**connection)
+    try:
+        with writer, writer.cursor() as cursor:
+            cursor.execute('SELECT x.config FROM cgr_db_config x WHERE x.name = %s AND x.version = %s',
+                           (schema, major_version))
+            config = cursor.fetchone()
+        if config is None:
+            raise KeyError('schema not exists or version incompatible')
+        config = {**config[0], **params}
+        molecule = dumps(config.get('molecule', {}), sort_keys=True)
+        reaction = dumps(config.get('reaction', {}), sort_keys=True)
+
+        # shadow columns. previous interrupted run discarded
+        writer.autocommit = True
+        with writer.cursor() as cursor:
+            for table in ('MoleculeStructure', 'ReactionIndex'):
+                cursor.execute(f'ALTER TABLE "{schema}"."{table}" DROP COLUMN IF EXISTS fingerprint_next, '
+                               f'ADD COLUMN fingerprint_next integer[]')
+            cursor.execute('CREATE TEMP TABLE cgrdb_molecule_fingerprint (id integer, fingerprint integer[])')
+            cursor.execute('CREATE TEMP TABLE cgrdb_reaction_fingerprint (signature bytea, fingerprint integer[])')
+        writer.autocommit = False
+
+        molecules = f'SELECT x.id, x.structure FROM "{schema}"."MoleculeStructure" x ORDER BY x.id'
+        molecules_rest = f'''SELECT x.id, x.structure FROM "{schema}"."MoleculeStructure" x
+WHERE x.fingerprint_next IS NULL ORDER BY x.id'''
+        reactions = f'''SELECT r.reaction, r.id, r.is_product, r.mapping, x.structure
+FROM "{schema}"."MoleculeReaction" r
+     JOIN "{schema}"."MoleculeStructure" x ON x.molecule = r.molecule
+ORDER BY r.reaction, r.id, x.id'''
+        reactions_rest = f'''SELECT r.reaction, r.id, r.is_product, r.mapping, x.structure
+FROM "{schema}"."MoleculeReaction" r
+     JOIN "{schema}"."MoleculeStructure" x ON x.molecule = r.molecule
+WHERE r.reaction IN (SELECT i.reaction FROM "{schema}"."ReactionIndex" i WHERE i.fingerprint_next IS NULL)
+ORDER BY r.reaction, r.id, x.id'''
+
+        update_molecules = f'''UPDATE "{schema}"."MoleculeStructure" x SET fingerprint_next = s.fingerprint
+FROM cgrdb_molecule_fingerprint s WHERE x.id = s.id'''
+        update_reactions = f'''UPDATE "{schema}"."ReactionIndex" x SET fingerprint_next = s.fingerprint
+FROM cgrdb_reaction_fingerprint s WHERE x.signature = s.signature'''
+
+        stages = {'molecules': (molecules, molecules_rest, _molecule_records, _molecules, molecule,
+                                'cgrdb_molecule_fingerprint', update_molecules),
+                  'reactions': (reactions, reactions_rest, _reaction_records, _reactions, reaction,
+                                'cgrdb_reaction_fingerprint', update_reactions)}
+
+        def write(staging, update, rows):
+            buffer = StringIO()
+            for k, fp in rows:
+                buffer.write(f'{k}\t{{{",".join(map(str, fp))}}}\n')
+            buffer.seek(0)
+            with writer.cursor() as cursor:
+                cursor.copy_expert(f'COPY {staging} FROM STDIN', buffer)
+                cursor.execute(f'ANALYZE {staging}')
+                cursor.execute(update)
+                cursor.execute(f'TRUNCATE {staging}')
+
+        def run(pool, stage, rest=False, commit=True):
+            query, query_rest, records, worker, fingerprint, staging, update = stages[stage]
+            if rest:
+                query = query_rest
+                stage += ' catch-up'
+            count = 0
+            start = monotonic()
+            pending = []
+
+            def done(n, rows):
+                nonlocal count
+                pending.extend(rows)
+                count += n
+                if len(pending) >= batch:
+                    write(staging, update, pending)
+                    if commit:
+                        writer.commit()
+                    pending.clear()
+                if report:
+                    report(stage, count, monotonic() - start)
+
+            with reader, reader.cursor('cgrdb_refingerprint') as cursor:  # transaction required for server-side cursor
+                cursor.itersize = batch
+                cursor.execute(query)
+                rows = records(cursor)
+                tasks = iter(lambda: list(islice(rows, chunk)), [])
+
+                if pool is None:
+                    for task in tasks:
+                        done(*worker((fingerprint, task)))
+                else:
+                    queue = deque()
+                    for task in tasks:
+                        queue.append(pool.apply_async(worker, ((fingerprint, task),)))
+                        if len(queue) >= 2 * workers:  # keep memory bounded
+                            done(*queue.popleft().get())
+                    while queue:
+                        done(*queue.popleft().get())
+            if pending:
+                write(staging, update, pending)
+                if commit:
+                    writer.commit()
+            return count
+
+        def calculate(pool):
+            for stage in stages:
+                run(pool, stage)
+            # structures added during calculation. new molecules structures add reactions index rows
+            for stage in stages:
+                while run(pool, stage, True) >= batch:
+                    pass
+            build_indexes()
+            switch(pool)
+
+        def build_indexes():
+            # built after filling for HOT updates of shadow columns
+            writer.autocommit = True
+            with writer.cursor() as cursor:
+                for table, kind in (('MoleculeStructure', 'molecule'), ('ReactionIndex', 'reaction')):
+                    cursor.execute(f'CREATE INDEX CONCURRENTLY cgrdb_{kind}_bits_next '
+                                   f'ON "{schema}"."{table}" (icount(fingerprint_next))')
+                    cursor.execute('SELECT x.indexdef FROM pg_indexes x WHERE x.schemaname = %s AND x.indexname = %s',
+                                   (schema, f'cgrdb_{kind}_fingerprint'))
+                    found = cursor.fetchone()
+                    if found:
+                        method = fingerprint_index_methods['gin' if 'gin__int_ops' in found[0] else 'gist']
+                        method = method.replace('(fingerprint ', '(fingerprint_next ')
+                        cursor.execute(f'CREATE INDEX CONCURRENTLY cgrdb_{kind}_fingerprint_next '
+                                       f'ON "{schema}"."{table}" USING {method}')
+            writer.autocommit = False
+
+        def switch(pool):
+            with writer.cursor() as cursor:
+                # writes blocked. searches allowed until columns replacement
+                cursor.execute(f'LOCK TABLE "{schema}"."MoleculeStructure", "{schema}"."ReactionIndex" '
+                               f'IN SHARE ROW EXCLUSIVE MODE')
+                for stage in stages:
+                    run(pool, stage, True, False)
+                for table in ('MoleculeStructure', 'ReactionIndex'):
+                    cursor.execute(f'SELECT count(*) FROM "{schema}"."{table}" x WHERE x.fingerprint_next IS NULL')
+                    missed = cursor.fetchone()[0]
+                    if missed:
+                        raise ValueError(f'{missed} rows of {table} not fingerprinted. structures are inconsistent')
+
+                for table, kind in (('MoleculeStructure', 'molecule'), ('ReactionIndex', 'reaction')):
+                    # old indexes dropped with column
+                    cursor.execute(f'ALTER TABLE "{schema}"."{table}" DROP COLUMN fingerprint')
+                    cursor.execute(f'ALTER TABLE "{schema}"."{table}" RENAME COLUMN fingerprint_next TO fingerprint')
+                    cursor.execute(f'ALTER TABLE "{schema}"."{table}" ALTER COLUMN fingerprint SET NOT NULL')
+                    cursor.execute(f'ALTER INDEX "{schema}".cgrdb_{kind}_bits_next RENAME TO cgrdb_{kind}_bits')
+                    cursor.execute(f'ALTER INDEX IF EXISTS "{schema}".cgrdb_{kind}_fingerprint_next '
+                                   f'RENAME TO cgrdb_{kind}_fingerprint')
+
+                cursor.execute('UPDATE cgr_db_config SET config = %s WHERE name = %s AND version = %s',
+                               (dumps(config), schema, major_version))
+                # cached results of searches are stale
+                cursor.execute(f'''SELECT nextval('"{schema}".cgrdb_molecule_generation'),
+       nextval('"{schema}".cgrdb_reaction_generation')''')
+                for f in functions:  # templates prepared for pony
+                    cursor.execute(f.replace('{schema}', schema).replace('$$', '$'))
+            writer.commit()
+
+        if workers == 0:  # calculate in current process
+            calculate(None)
+        else:
+            workers = workers or cpu_count()
+            with Pool(workers) as pool:
+                calculate(pool)
+    finally:  # interrupted switch rolled back. shadow columns are discarded by next run
+        reader.close()
+        writer.close()
+    return config
+
+
+__all__ = ['refingerprint']
@@ -16,8 +16,13 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from io import TextIOWrapper
-from pkg_resources import resource_stream
+from importlib.resources import read_text
+from time import time_ns
+
+
+def _mapping_codec():
+    # codec shared with client side. comments stripped
+    return ''.join(x for x in read_text('CGRdb', 'mapping.py').splitlines(keepends=True) if not x.startswith('#'))
 
 
 insert_molecule_trigger = '''CREATE TRIGGER cgrdb_insert_molecule_structure
@@ -35,25 +40,329 @@ insert_reaction_trigger = '''CREATE TRIGGER cgrdb_insert_reaction
 init_session = '''CREATE OR REPLACE FUNCTION "{schema}".cgrdb_init_session(cfg json)
 RETURNS VOID
 AS $$
-from json import loads
+# session initialized once per backend. repeated calls with same config are skipped
+if GD.get('cgrdb_config') == cfg:
+    return
+
+from json import dumps, loads
 
 config = loads(cfg)
 venv = config.get('environment')
-if venv:
+if venv and GD.get('cgrdb_environment') != venv:
     from os.path import join
     activate_this = join(venv, 'bin', 'activate_this.py')
     exec(open(activate_this).read(), {'__file__': activate_this})
+    GD['cgrdb_environment'] = venv
 
 from StructureFingerprint import LinearFingerprint
+from collections import OrderedDict
+
+GD['cgrdb_prescreened'] = {}  # index daemon results of fingerprints requested in advance by reaction searches
+
+
+def fingerprint_config(params):
+    # same as in CGRdb.database.fingerprint
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        v = version('StructureFingerprint')
+    except PackageNotFoundError:
+        v = None
+    return dumps([v, params], sort_keys=True)
+
+
+class Fingerprints:
+    # query fingerprints memoized by signatures. shared by searches of session including nested
+    def __init__(self, size, molecule, reaction):
+        self.size = max(size, 1)
+        self.cache = OrderedDict()
+        # query kind: molecule, query converted to molecule for screening, reaction CGR
+        self.fingerprints = {'molecule': GD['cgrdb_mfp'], 'query': GD['cgrdb_mfp'], 'reaction': GD['cgrdb_rfp']}
+        self.configs = {'molecule': fingerprint_config(molecule), 'reaction': fingerprint_config(reaction)}
+
+    def __call__(self, kind, sg, structure):
+        key = (kind, sg)
+        try:
+            self.cache.move_to_end(key)
+        except KeyError:
+            self.store(key, self.fingerprints[kind].transform_bitset([structure])[0])
+        return self.cache[key]
+
+    def precomputed(self, data, kind):
+        # signature and fingerprint of query calculated by client. ignored if fingerprint config differs
+        if data is None:
+            return
+        data = loads(data)
+        if data.get('config') != self.configs[kind]:
+            plpy.debug('cgrdb precomputed fingerprint ignored: fingerprint config mismatch')
+            return
+        sg, fp = data.get('signature'), data.get('fingerprint')
+        try:
+            bytes.fromhex(sg)
+        except (TypeError, ValueError):
+            raise plpy.spiexceptions.DataException('invalid signature')
+        length = self.fingerprints[kind].length
+        if not isinstance(fp, list) or not all(isinstance(x, int) and 0 <= x < length for x in fp):
+            raise plpy.spiexceptions.DataException('invalid fingerprint')
+        key = (kind, sg)
+        self.cache.pop(key, None)
+        self.store(key, fp)
+        return sg
+
+    def verify(self, kind, sg, structure):
+        # client fingerprint used for screening is checked before results sharing in cache
+        key = (kind, sg)
+        fp = self.fingerprints[kind].transform_bitset([structure])[0]
+        if set(fp) != set(self.cache.get(key, ())):
+            self.cache.pop(key, None)
+            self.store(key, fp)
+            raise plpy.spiexceptions.DataException('precomputed fingerprint mismatch')
+
+    def store(self, key, fp):
+        self.cache[key] = fp
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+
+def configure(config):
+    # schema config of session. fingerprints and memoized queries fingerprints are replaced on params change
+    molecule = config.get('molecule', {})
+    reaction = config.get('reaction', {})
+    params = [molecule, reaction, config.get('fingerprint_cache') or 1024]
+    if GD.get('cgrdb_fingerprint_params') != params:
+        GD['cgrdb_mfp'] = LinearFingerprint(**molecule)
+        GD['cgrdb_rfp'] = LinearFingerprint(**reaction)
+        GD['cgrdb_fingerprints'] = Fingerprints(params[2], molecule, reaction)
+        GD['cgrdb_fingerprint_params'] = params
+    GD['cache_size'] = config.get('cache_size', 256)
+    GD['index'] = config.get('index')
+    GD['substructure_limit'] = config.get('substructure_limit') or 10 ** 12
+    GD['cache_ttl'] = config.get('cache_ttl') or 0
+    GD['cache_limit'] = config.get('cache_limit') or 0
+    GD['cache_block'] = config.get('cache_block') or 1000
+
+
+configure(config)
+
+# atom-to-atom mapping codec. CGRdb.mapping module source
+{mapping}
+
+GD['cgrdb_pack_mapping'] = pack_mapping
+GD['cgrdb_unpack_mapping'] = unpack_mapping
+
+# statistics of last search in session
+from time import perf_counter
+
+
+class SearchStats(dict):
+    def __init__(self, function):
+        super().__init__(function=function, cache='miss', stages={}, candidates=None, checked=None,
+                         hits=None, nested=[])
+        self.clock = perf_counter()
+        GD['cgrdb_stats'] = self
+
+    def stage(self, name):
+        # close stage started after previous
+        now = perf_counter()
+        self['stages'][name] = self['stages'].get(name, 0.) + now - self.clock
+        self.clock = now
+
+    def nested(self):
+        # attach statistics of nested search
+        self['nested'].append(GD['cgrdb_stats'])
+        GD['cgrdb_stats'] = self
+
+    def done(self, name):
+        self.stage(name)
+        from json import dumps
+        plpy.debug(f'cgrdb search stats: {dumps(self)}')
+
+
+GD['cgrdb_search_stats'] = SearchStats
+
+# prepared plans of functions. names are `schema:version:statement`.
+# version changed on functions recreation by `cgrdb update`. plans of previous version are dropped
+plans = GD.setdefault('cgrdb_plans', {})
+
+
+def plan(name, query, types=()):
+    try:
+        return plans[name]
+    except KeyError:
+        schema, version, _ = name.split(':', 2)
+        stale = [k for k in plans if k.startswith(f'{schema}:') and not k.startswith(f'{schema}:{version}:')]
+        for k in stale:
+            del plans[k]
+        p = plans[name] = plpy.prepare(query, list(types))
+        return p
+
+
+GD['cgrdb_plan'] = plan
+
+
+class SearchCache:
+    # results of search function by query signature and operator. stale after structures changes or TTL expiration.
+    # added structures are detected by id watermark. plans are named by version of calling function
+    tables = {'molecule': ('MoleculeSearchCache', 'MoleculeStructure', 'molecules'),
+              'reaction': ('ReactionSearchCache', 'ReactionIndex', 'reactions')}
+
+    def __init__(self, version, kind, operator, signature, stats):
+        self.version = version
+        self.kind = kind
+        self.table, self.structures, self.column = self.tables[kind]
+        self.args = [operator, bytes.fromhex(signature)]
+        self.stats = stats
+        self.stale = self.refresh = None
+        self.verify = None  # check of client query data called before storing
+
+    def prepare(self, name, query, types=()):
+        return plan(f'{self.version}:{name}', query, types)
+
+    def get(self):
+        get = self.prepare(f'{self.kind}_cache', f"""SELECT x.id, x.size count, x.watermark w,
+       x.generation <> $3 OR $4 > 0 AND x.date < CURRENT_TIMESTAMP - $4 * interval '1 second' stale
+FROM "{schema}"."{self.table}" x
+WHERE x.operator = $1 AND x.signature = $2""", ['text', 'bytea', 'bigint', 'integer'])
+        return plpy.execute(get, [*self.args, self.generation, GD['cache_ttl']])
+
+    def lookup(self, refresh=False):
+        # id and size of fresh results or None. stale results with new structures only are refreshed if allowed
+        kind, stats = self.kind, self.stats
+        # structures committed later can have lower ids than visible ones. ids of structures added after this
+        # statement are bigger than current maximal id, ids of concurrently inserting ones are bigger than their
+        # lock keys. stored watermark is the least of them. snapshot of repeatable read transaction can be older
+        limit = self.prepare(f'{kind}_cache_watermark', f"""SELECT CASE WHEN
+    current_setting('transaction_isolation') = 'read committed' THEN
+    least((SELECT coalesce(max(x.id), 0) FROM "{schema}"."{self.structures}" x),
+          (SELECT min(l.objid::bigint) FROM pg_locks l
+           WHERE l.locktype = 'advisory' AND l.objsubid = 2 AND l.pid <> pg_backend_pid() AND
+                 l.classid::bigint = hashtext('{schema}.cgrdb_{kind}_watermark') & 2147483647))
+    ELSE 0 END w""")
+        limit = plpy.execute(limit)[0]['w']
+        # new sequence has last_value 1 before and after first nextval. is_called distinguishes them
+        state = self.prepare(f'{kind}_cache_state', f"""SELECT g.last_value * g.is_called::integer g,
+       (SELECT coalesce(max(x.id), 0) FROM "{schema}"."{self.structures}" x) w
+FROM "{schema}".cgrdb_{kind}_generation g""")
+        state = plpy.execute(state)[0]
+        self.generation = state['g']
+        self.watermark = min(state['w'], limit)  # structures with bigger ids are screened by refresh
+
+        found = self.get()
+        if found and not found[0]['stale']:
+            if found[0]['w'] == state['w']:  # all structures with lower ids were visible on storing
+                touch = f"""UPDATE "{schema}"."{self.table}" SET used = CURRENT_TIMESTAMP
+WHERE id = $1 AND used < CURRENT_TIMESTAMP - interval '1 minute' """
+                plpy.execute(self.prepare(f'touch_{kind}_cache', touch, ['integer']), [found[0]['id']])
+                hit = f"""SELECT nextval('"{schema}".cgrdb_{kind}_cache_hits')"""
+                plpy.execute(self.prepare(f'{kind}_cache_hit', hit))
+                stats['cache'] = 'hit'
+                stats['hits'] = found[0]['count']
+                stats.done('cache')
+                return found[0]['id'], found[0]['count']
+            elif refresh:  # only new structures added. search in them only
+                self.refresh = found[0]['w']
+                stats['cache'] = 'refresh'
+        if found:
+            self.stale = found[0]['id']
+        miss = f"""SELECT nextval('"{schema}".cgrdb_{kind}_cache_misses')"""
+        plpy.execute(self.prepare(f'{kind}_cache_miss', miss))
+        stats.stage('cache')
+
+    def results(self):
+        # ordered ids and tanimotos of refreshed results. None if concurrent process evicted them
+        load = self.prepare(f'{self.kind}_cache_results', f"""SELECT x.{self.column} h, x.tanimotos t
+FROM "{schema}"."{self.table}Block" x WHERE x.cache = $1 ORDER BY x.start""", ['integer'])
+        found = plpy.execute(load, [self.stale])
+        if found:
+            return [h for x in found for h in x['h']], [t for x in found for t in x['t']]
+
+    def store(self, hits, tanimotos):
+        # ordered ids and tanimotos lists
+        if self.verify is not None:
+            self.verify()
+        kind, stats = self.kind, self.stats
+        params = [hits or None, tanimotos or None, self.generation, self.watermark, GD['cache_block']]
+        types = ['integer[]', 'real[]', 'bigint', 'integer', 'integer']
+        result = 'o AS (SELECT $1::integer[] h, $2::real[] t)'
+        blocks = f"""b AS (
+    INSERT INTO "{schema}"."{self.table}Block" (cache, start, {self.column}, tanimotos)
+    SELECT c.id, n, o.h[n + 1:n + $5], o.t[n + 1:n + $5]
+    FROM c, o, generate_series(0, c.size - 1, $5) n
+)"""
+
+        # refresh in place for keeping id valid for paginating clients. otherwise concurrent process evicted it
+        lock = f'SELECT x.id FROM "{schema}"."{self.table}" x WHERE x.id = $1 FOR UPDATE'
+        if self.stale and plpy.execute(self.prepare(f'lock_{kind}_cache', lock, ['integer']), [self.stale]):
+            clean = f'DELETE FROM "{schema}"."{self.table}Block" x WHERE x.cache = $1'
+            plpy.execute(self.prepare(f'clean_{kind}_cache', clean, ['integer']), [self.stale])
+            update = f"""WITH {result}, c AS (
+    UPDATE "{schema}"."{self.table}" x
+    SET date = CURRENT_TIMESTAMP, used = CURRENT_TIMESTAMP, generation = $3, watermark = $4,
+        size = coalesce(array_length(o.h, 1), 0)
+    FROM o
+    WHERE x.id = $6
+    RETURNING x.id, x.size
+), {blocks}
+SELECT c.id, c.size count FROM c"""
+            found = plpy.execute(self.prepare(f'update_{kind}_cache', update, [*types, 'integer']),
+                                 [*params, self.stale])
+            stats['hits'] = found[0]['count']
+            stats.done('store')
+            return found[0]['id'], found[0]['count']
+
+        insert = f"""WITH {result}, c AS (
+    INSERT INTO "{schema}"."{self.table}"(signature, operator, date, used, generation, watermark, size)
+    SELECT $7, $6, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, $3, $4, coalesce(array_length(o.h, 1), 0)
+    FROM o
+    ON CONFLICT DO NOTHING
+    RETURNING id, size
+), {blocks}
+SELECT c.id, c.size count FROM c"""
+        found = plpy.execute(self.prepare(f'insert_{kind}_cache', insert, [*types, 'text', 'bytea']),
+                             [*params, *self.args])
+
+        if found:
+            # eviction scans whole cache tables. throttled to run after tenth of limit stored by backend
+            stored = GD['cgrdb_cache_stored'] = GD.get('cgrdb_cache_stored', 0) + max(len(hits), 1)
+            if GD['cache_limit'] and stored * 10 >= GD['cache_limit']:
+                GD['cgrdb_cache_stored'] = 0
+                # just stored results are kept. returned id should be valid
+                evict = f'SELECT "{schema}".cgrdb_evict_search_cache(0, $1, $2, $3)'
+                keep = [found[0]['id'], None] if kind == 'molecule' else [None, found[0]['id']]
+                plpy.execute(self.prepare('evict_search_cache', evict, ['integer'] * 3), [GD['cache_limit'], *keep])
+        else:  # concurrent process stored same query. just reuse it
+            found = self.get()
+        stats['hits'] = found[0]['count']
+        stats.done('store')
+        return found[0]['id'], found[0]['count']
+
+
+GD['cgrdb_search_cache'] = SearchCache
+
+# config of schema is reloaded from db on first call of functions of new version in session.
+# functions are recreated by `cgrdb update` and `cgrdb refingerprint`. latter changes fingerprints config
+versions = GD['cgrdb_versions'] = {}
+
+
+def check_version(version):
+    name, v = version.split(':')
+    if versions.get(name) != v:
+        load = plan(f'{version}:config', 'SELECT x.config FROM cgr_db_config x WHERE x.name = $1', ['text'])
+        found = plpy.execute(load, [name])
+        if found:
+            configure(loads(found[0]['config']))
+        versions[name] = v
+
 
-molecule = config.get('molecule', {})
-reaction = config.get('reaction', {})
-GD['cgrdb_mfp'] = LinearFingerprint(**molecule)
-GD['cgrdb_rfp'] = LinearFingerprint(**reaction)
-GD['cache_size'] = config.get('cache_size', 256)
-GD['index'] = config.get('index')
-GD['substructure_limit'] = config.get('substructure_limit') or 10 ** 12
+GD['cgrdb_check_version'] = check_version
+GD['cgrdb_config'] = cfg
 
+$$ LANGUAGE plpython3u'''.replace('$', '$$').replace('{mapping}', _mapping_codec())
+
+search_stats = '''CREATE OR REPLACE FUNCTION "{schema}".cgrdb_search_stats()
+RETURNS json
+AS $$
+from json import dumps
+return dumps(GD.get('cgrdb_stats'))
 $$ LANGUAGE plpython3u'''.replace('$', '$$')
 
 delete_molecule = '''CREATE OR REPLACE FUNCTION "{schema}".cgrdb_delete_molecule_structure()
@@ -69,10 +378,200 @@ delete_molecule_trigger = '''CREATE TRIGGER cgrdb_delete_molecule_structure
     AFTER DELETE ON "{schema}"."MoleculeStructure" FOR EACH ROW
     EXECUTE PROCEDURE "{schema}".cgrdb_delete_molecule_structure()'''
 
+# search cache invalidation counters. incremented on changes of structures.
+# added structures are tracked by max id watermark of cached results for incremental refreshing
+search_cache_sequences = '''CREATE SEQUENCE IF NOT EXISTS "{schema}".cgrdb_molecule_generation;
+CREATE SEQUENCE IF NOT EXISTS "{schema}".cgrdb_reaction_generation;
+CREATE SEQUENCE IF NOT EXISTS "{schema}".cgrdb_molecule_cache_hits;
+CREATE SEQUENCE IF NOT EXISTS "{schema}".cgrdb_molecule_cache_misses;
+CREATE SEQUENCE IF NOT EXISTS "{schema}".cgrdb_reaction_cache_hits;
+CREATE SEQUENCE IF NOT EXISTS "{schema}".cgrdb_reaction_cache_misses'''
+
+# schemas created before cache lifecycle support. cache is dropped
+search_cache_migration = '''DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = '{schema}' AND table_name = 'MoleculeSearchCache' AND column_name = 'watermark')
+    THEN
+        TRUNCATE TABLE "{schema}"."MoleculeSearchCache", "{schema}"."ReactionSearchCache" RESTART IDENTITY CASCADE;
+        ALTER TABLE "{schema}"."MoleculeSearchCache" ADD COLUMN IF NOT EXISTS used timestamp NOT NULL,
+            ADD COLUMN IF NOT EXISTS generation bigint NOT NULL, ADD COLUMN IF NOT EXISTS size integer NOT NULL,
+            ADD COLUMN watermark integer NOT NULL;
+        ALTER TABLE "{schema}"."ReactionSearchCache" ADD COLUMN IF NOT EXISTS used timestamp NOT NULL,
+            ADD COLUMN IF NOT EXISTS generation bigint NOT NULL, ADD COLUMN IF NOT EXISTS size integer NOT NULL,
+            ADD COLUMN watermark integer NOT NULL;
+    END IF;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = '{schema}' AND table_name = 'MoleculeSearchCache' AND column_name = 'molecules')
+    THEN
+        TRUNCATE TABLE "{schema}"."MoleculeSearchCache", "{schema}"."ReactionSearchCache" RESTART IDENTITY CASCADE;
+        ALTER TABLE "{schema}"."MoleculeSearchCache" DROP COLUMN molecules, DROP COLUMN tanimotos;
+        ALTER TABLE "{schema}"."ReactionSearchCache" DROP COLUMN reactions, DROP COLUMN tanimotos;
+    END IF;
+END;
+$$'''.replace('$', '$$')
+
+# JSON pairs of atom-to-atom mapping packed into bytea of big-endian int32 pairs
+mapping_migration = '''DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = '{schema}' AND table_name = 'MoleculeReaction' AND column_name = 'mapping'
+               AND data_type IN ('json', 'jsonb'))
+    THEN
+        ALTER TABLE "{schema}"."MoleculeReaction" ADD COLUMN packed bytea;
+        UPDATE "{schema}"."MoleculeReaction" x SET packed = (
+            SELECT string_agg(int4send(e.v::integer), ''::bytea ORDER BY p.o, e.o)
+            FROM jsonb_array_elements(x.mapping::jsonb) WITH ORDINALITY p(pair, o),
+                 jsonb_array_elements_text(p.pair) WITH ORDINALITY e(v, o))
+        WHERE x.mapping IS NOT NULL;
+        ALTER TABLE "{schema}"."MoleculeReaction" DROP COLUMN mapping;
+        ALTER TABLE "{schema}"."MoleculeReaction" RENAME COLUMN packed TO mapping;
+    END IF;
+END;
+$$'''.replace('$', '$$')
+
+# search functions with precomputed fingerprint argument. previous signatures make calls ambiguous
+search_functions_migration = '''DROP FUNCTION IF EXISTS "{schema}".cgrdb_search_similar_molecules(bytea);
+DROP FUNCTION IF EXISTS "{schema}".cgrdb_search_substructure_molecules(bytea);
+DROP FUNCTION IF EXISTS "{schema}".cgrdb_search_similar_reactions(bytea);
+DROP FUNCTION IF EXISTS "{schema}".cgrdb_search_substructure_reactions(bytea);
+DROP FUNCTION IF EXISTS "{schema}".cgrdb_search_reactions_by_molecule(bytea, integer, integer)'''
+
+search_cache_blocks = '''CREATE TABLE IF NOT EXISTS "{schema}"."MoleculeSearchCacheBlock" (
+    cache integer NOT NULL REFERENCES "{schema}"."MoleculeSearchCache" (id) ON DELETE CASCADE,
+    start integer NOT NULL,
+    molecules integer[] NOT NULL,
+    tanimotos real[] NOT NULL,
+    PRIMARY KEY (cache, start)
+);
+CREATE TABLE IF NOT EXISTS "{schema}"."ReactionSearchCacheBlock" (
+    cache integer NOT NULL REFERENCES "{schema}"."ReactionSearchCache" (id) ON DELETE CASCADE,
+    start integer NOT NULL,
+    reactions integer[] NOT NULL,
+    tanimotos real[] NOT NULL,
+    PRIMARY KEY (cache, start)
+)'''
+
+molecule_generation = '''CREATE OR REPLACE FUNCTION "{schema}".cgrdb_next_molecule_generation()
+RETURNS TRIGGER
+AS $$
+BEGIN
+    PERFORM nextval('"{schema}".cgrdb_molecule_generation');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql'''.replace('$', '$$')
+
+reaction_generation = '''CREATE OR REPLACE FUNCTION "{schema}".cgrdb_next_reaction_generation()
+RETURNS TRIGGER
+AS $$
+BEGIN
+    PERFORM nextval('"{schema}".cgrdb_reaction_generation');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql'''.replace('$', '$$')
+
+# fingerprint columns are excluded: refingerprint updates shadow columns online, drops and renames them,
+# and increments generations explicitly on columns switch
+generation_triggers = '''DROP TRIGGER IF EXISTS cgrdb_molecule_generation ON "{schema}"."MoleculeStructure";
+DROP TRIGGER IF EXISTS cgrdb_reaction_generation ON "{schema}"."ReactionIndex";
+DROP TRIGGER IF EXISTS cgrdb_mapping_generation ON "{schema}"."MoleculeReaction";
+CREATE TRIGGER cgrdb_molecule_generation
+    AFTER UPDATE OF molecule, is_canonic, signature, structure OR DELETE ON "{schema}"."MoleculeStructure"
+    FOR EACH STATEMENT EXECUTE PROCEDURE "{schema}".cgrdb_next_molecule_generation();
+CREATE TRIGGER cgrdb_reaction_generation
+    AFTER UPDATE OF reaction, signature, structures OR DELETE ON "{schema}"."ReactionIndex"
+    FOR EACH STATEMENT EXECUTE PROCEDURE "{schema}".cgrdb_next_reaction_generation();
+CREATE TRIGGER cgrdb_mapping_generation
+    AFTER UPDATE OF reaction, molecule, is_product, mapping OR DELETE ON "{schema}"."MoleculeReaction"
+    FOR EACH STATEMENT EXECUTE PROCEDURE "{schema}".cgrdb_next_reaction_generation()'''
+
+# inserting statements hold shared lock keyed by maximal id of structures until commit. ids of uncommitted structures
+# are bigger than lock key, thus search cache watermark is limited by keys of concurrent inserts
+watermark_lock = '''CREATE OR REPLACE FUNCTION "{schema}".cgrdb_watermark_lock()
+RETURNS TRIGGER
+AS $$
+DECLARE
+    watermark integer;
+BEGIN
+    EXECUTE format('SELECT coalesce(max(x.id), 0) FROM %I.%I x', TG_TABLE_SCHEMA, TG_TABLE_NAME) INTO watermark;
+    PERFORM pg_advisory_xact_lock_shared(hashtext('{schema}.' || TG_ARGV[0]) & 2147483647, watermark);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql'''.replace('$', '$$')
+
+watermark_triggers = '''DROP TRIGGER IF EXISTS cgrdb_molecule_watermark ON "{schema}"."MoleculeStructure";
+DROP TRIGGER IF EXISTS cgrdb_reaction_watermark ON "{schema}"."ReactionIndex";
+CREATE TRIGGER cgrdb_molecule_watermark
+    BEFORE INSERT ON "{schema}"."MoleculeStructure"
+    FOR EACH STATEMENT EXECUTE PROCEDURE "{schema}".cgrdb_watermark_lock('cgrdb_molecule_watermark');
+CREATE TRIGGER cgrdb_reaction_watermark
+    BEFORE INSERT ON "{schema}"."ReactionIndex"
+    FOR EACH STATEMENT EXECUTE PROCEDURE "{schema}".cgrdb_watermark_lock('cgrdb_reaction_watermark')'''
+
+# just stored by search function results are kept. previous signature makes calls ambiguous
+evict_search_cache = '''DROP FUNCTION IF EXISTS "{schema}".cgrdb_evict_search_cache(integer, integer);
+CREATE OR REPLACE FUNCTION "{schema}".cgrdb_evict_search_cache(ttl integer, size_limit integer,
+                                                               keep_molecule integer DEFAULT NULL,
+                                                               keep_reaction integer DEFAULT NULL)
+RETURNS VOID
+AS $$
+BEGIN
+    -- only one process do eviction. others just skip it
+    IF NOT pg_try_advisory_xact_lock(hashtext('{schema}.cgrdb_evict_search_cache')) THEN
+        RETURN;
+    END IF;
+    IF ttl > 0 THEN
+        DELETE FROM "{schema}"."MoleculeSearchCache" x WHERE x.date < CURRENT_TIMESTAMP - ttl * interval '1 second'
+            AND x.id IS DISTINCT FROM keep_molecule;
+        DELETE FROM "{schema}"."ReactionSearchCache" x WHERE x.date < CURRENT_TIMESTAMP - ttl * interval '1 second'
+            AND x.id IS DISTINCT FROM keep_reaction;
+    END IF;
+    IF size_limit > 0 THEN  -- remove least recently used records exceeding limit
+        DELETE FROM "{schema}"."MoleculeSearchCache" x WHERE x.id IN (
+            SELECT y.id FROM (
+                SELECT z.id, sum(z.size) OVER (ORDER BY z.used DESC, z.id DESC) s
+                FROM "{schema}"."MoleculeSearchCache" z
+            ) y
+            WHERE y.s > size_limit
+        ) AND x.id IS DISTINCT FROM keep_molecule;
+        DELETE FROM "{schema}"."ReactionSearchCache" x WHERE x.id IN (
+            SELECT y.id FROM (
+                SELECT z.id, sum(z.size) OVER (ORDER BY z.used DESC, z.id DESC) s
+                FROM "{schema}"."ReactionSearchCache" z
+            ) y
+            WHERE y.s > size_limit
+        ) AND x.id IS DISTINCT FROM keep_reaction;
+    END IF;
+END;
+$$ LANGUAGE plpgsql'''.replace('$', '$$')
+
+# popcount of fingerprints. used for Tanimoto bounds pruning in sequential search
+molecule_bits_index = '''CREATE INDEX IF NOT EXISTS cgrdb_molecule_bits
+    ON "{schema}"."MoleculeStructure" (icount(fingerprint))'''
+
+reaction_bits_index = '''CREATE INDEX IF NOT EXISTS cgrdb_reaction_bits
+    ON "{schema}"."ReactionIndex" (icount(fingerprint))'''
+
+# optional intarray indexes for screening without index daemon
+fingerprint_index_methods = {'gin': 'gin (fingerprint gin__int_ops)', 'gist': 'gist (fingerprint gist__intbig_ops)'}
+
+molecule_fingerprint_index = '''CREATE INDEX cgrdb_molecule_fingerprint
+    ON "{schema}"."MoleculeStructure" USING {method}'''
+
+reaction_fingerprint_index = '''CREATE INDEX cgrdb_reaction_fingerprint
+    ON "{schema}"."ReactionIndex" USING {method}'''
+
+drop_fingerprint_index = '''DROP INDEX IF EXISTS "{schema}".cgrdb_molecule_fingerprint,
+    "{schema}".cgrdb_reaction_fingerprint'''
+
+
+# prepared plans version. unique for each functions creation
+plans_version = format(time_ns(), 'x')
+
 
 def load_sql(file):
-    return ''.join(x for x in TextIOWrapper(resource_stream('CGRdb.sql', file))
-                   if not x.startswith(('#', '/*', '*/', '\n'))).replace('$', '$$')
+    return ''.join(x for x in read_text('CGRdb.sql', file).splitlines(keepends=True)
+                   if not x.startswith(('#', '/*', '*/', '\n'))).replace('$', '$$').replace('{plans}', plans_version)
 
 
 insert_molecule = load_sql('insert_molecule.sql')
@@ -91,10 +590,16 @@ search_mappingless_reaction = load_sql('mappingless_reaction.sql')
 merge_molecules = load_sql('merge_molecules.sql')
 
 
-__all__ = ['init_session', 'insert_molecule', 'after_insert_molecule', 'delete_molecule',
+__all__ = ['init_session', 'search_stats', 'insert_molecule', 'after_insert_molecule', 'delete_molecule',
            'insert_molecule_trigger', 'after_insert_molecule_trigger', 'delete_molecule_trigger',
            'insert_reaction', 'insert_reaction_trigger', 'merge_molecules',
            'search_structure_molecule', 'search_structure_reaction',
            'search_substructure_molecule', 'search_substructure_reaction',
            'search_reactions_by_molecule', 'search_mappingless_reaction',
-           'search_similar_molecules', 'search_similar_reactions']
+           'search_similar_molecules', 'search_similar_reactions',
+           'molecule_bits_index', 'reaction_bits_index', 'fingerprint_index_methods',
+           'molecule_fingerprint_index', 'reaction_fingerprint_index', 'drop_fingerprint_index',
+           'search_cache_sequences', 'search_cache_migration', 'search_cache_blocks', 'mapping_migration',
+           'search_functions_migration',
+           'molecule_generation', 'reaction_generation',
+           'generation_triggers', 'evict_search_cache', 'watermark_lock', 'watermark_triggers']
@@ -23,7 +23,6 @@ AS $$
 from CGRtools.containers import ReactionContainer
 from collections import defaultdict
 from functools import lru_cache
-from json import loads as json_loads
 from itertools import product
 from pickle import loads
 
@@ -31,34 +30,43 @@ data = TD['new']
 if data['is_canonic']:
     return
 
+GD['cgrdb_check_version']('{schema}:{plans}')
 rfp = GD['cgrdb_rfp']
+plan = GD['cgrdb_plan']
 cache_size = GD['cache_size']
+unpack_mapping = GD['cgrdb_unpack_mapping']
 molecule = data['molecule']
 structure = data['id']
 
-get_mp = f'''SELECT x.reaction r, array_agg(x.id) i, array_agg(x.molecule) m, array_agg(x.mapping) d, array_agg(x.is_product) p
+get_mp = '''SELECT x.reaction r, array_agg(x.id) i, array_agg(x.molecule) m, array_agg(x.mapping) d,
+       array_agg(x.is_product) p
 FROM "{schema}"."MoleculeReaction" x
 WHERE x.reaction IN (
     SELECT y.reaction
     FROM "{schema}"."MoleculeReaction" y
-    WHERE y.molecule = {molecule}
+    WHERE y.molecule = $1
 )
 GROUP BY x.reaction ORDER BY x.reaction'''
 
-get_ms = f'''SELECT array_agg(x.molecule) m, array_agg(x.id) s, array_agg(x.structure) d
+get_ms = '''SELECT array_agg(x.molecule) m, array_agg(x.id) s, array_agg(x.structure) d
 FROM "{schema}"."MoleculeStructure" x JOIN (
     SELECT DISTINCT ON (y.reaction, y.molecule) y.reaction, y.molecule
     FROM "{schema}"."MoleculeReaction" y
     WHERE y.reaction IN (
         SELECT z.reaction
         FROM "{schema}"."MoleculeReaction" z
-        WHERE z.molecule = {molecule}
+        WHERE z.molecule = $1
     )
 ) mr ON x.molecule = mr.molecule
 GROUP BY mr.reaction ORDER BY mr.reaction'''
+get_mp = plan('{schema}:{plans}:reactions_mappings', get_mp, ['integer'])
+get_ms = plan('{schema}:{plans}:reactions_structures', get_ms, ['integer'])
+insert = '''INSERT INTO "{schema}"."ReactionIndex" (reaction, signature, fingerprint, structures)
+VALUES ($1, $2, $3, $4)'''
+insert = plan('{schema}:{plans}:insert_reaction_index', insert, ['integer', 'bytea', 'integer[]', 'integer[]'])
 
 cache = lru_cache(cache_size)(lambda x: loads(s))
-for ms_row, mp_row in zip(plpy.cursor(get_ms), plpy.cursor(get_mp)):
+for ms_row, mp_row in zip(plpy.cursor(get_ms, [molecule]), plpy.cursor(get_mp, [molecule])):
     m2s = defaultdict(list)  # load structures of molecules
     for mi, si, s in zip(ms_row['m'], ms_row['s'], ms_row['d']):
         m2s[mi].append((si, cache(si)))
@@ -68,7 +76,7 @@ for ms_row, mp_row in zip(plpy.cursor(get_ms), plpy.cursor(get_mp)):
     lr = 0
     for mri, mi, mp, is_p in zip(mp_row['i'], mp_row['m'], mp_row['d'], mp_row['p']):
         if mp:
-            mp = dict(json_loads(mp))
+            mp = unpack_mapping(mp)
             ms = [(si, s.remap(mp, copy=True)) for si, s in m2s[mi]]
         else:
             ms = m2s[mi]
@@ -88,7 +96,6 @@ for ms_row, mp_row in zip(plpy.cursor(get_ms), plpy.cursor(get_mp)):
                 cgrs[~ReactionContainer([s for _, s in r[:lr]], [s for _, s in r[lr:]])] = list({si for si, _ in r})
     fps = rfp.transform_bitset(list(cgrs))
     ri = mp_row['r']
-    plpy.execute('INSERT INTO "{schema}"."ReactionIndex" (reaction, signature, fingerprint, structures) VALUES %s' %
-                 ', '.join(f"({ri}, '\\x{bytes(s).hex()}'::bytea, ARRAY{fp}::integer[], ARRAY{si}::integer[])"
-                           for (s, si), fp in zip(cgrs.items(), fps)))
+    for (s, si), fp in zip(cgrs.items(), fps):
+        plpy.execute(insert, [ri, bytes(s), fp, si])
 $$ LANGUAGE plpython3u
@@ -26,13 +26,18 @@ molecule = loads(data)
 if not isinstance(molecule, MoleculeContainer):
     raise plpy.spiexceptions.DataException('MoleculeContainer required')
 
-sg = bytes(molecule).hex()
+sg = bytes(molecule)
 
-get_data = f'''SELECT x.id
+stats = GD['cgrdb_search_stats']('structure_molecule')
+
+get_data = '''SELECT x.id
 FROM "{schema}"."MoleculeStructure" x
-WHERE x.signature = '\\x{sg}'::bytea'''
+WHERE x.signature = $1'''
 
-found = plpy.execute(get_data)
+found = plpy.execute(GD['cgrdb_plan']('{schema}:{plans}:structure_molecule', get_data, ['bytea']), [sg])
+stats['cache'] = None
+stats['hits'] = len(found)
+stats.done('lookup')
 if found:
     return found[0]['id']
 return 0
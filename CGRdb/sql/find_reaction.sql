@@ -26,13 +26,18 @@ reaction = loads(data)
 if not isinstance(reaction, ReactionContainer):
     raise plpy.spiexceptions.DataException('ReactionContainer required')
 
-sg = bytes(~reaction).hex()
+sg = bytes(~reaction)
 
-get_data = f'''SELECT x.reaction
+stats = GD['cgrdb_search_stats']('structure_reaction')
+
+get_data = '''SELECT x.reaction
 FROM "{schema}"."ReactionIndex" x
-WHERE x.signature = '\\x{sg}'::bytea'''
+WHERE x.signature = $1'''
 
-found = plpy.execute(get_data)
+found = plpy.execute(GD['cgrdb_plan']('{schema}:{plans}:structure_reaction', get_data, ['bytea']), [sg])
+stats['cache'] = None
+stats['hits'] = len(found)
+stats.done('lookup')
 if found:
     return found[0]['reaction']
 return 0
@@ -23,14 +23,16 @@ AS $$
 from CGRtools.containers import MoleculeContainer
 from pickle import loads
 
+GD['cgrdb_check_version']('{schema}:{plans}')  # reload fingerprints config changed by refingerprint
 mfp = GD['cgrdb_mfp']
 data = TD['new']
 molecule = loads(data['structure'])
 if not isinstance(molecule, MoleculeContainer):
     raise plpy.spiexceptions.DataException('MoleculeContainer required')
 
-current = plpy.execute('SELECT x.id, x.structure FROM "{schema}"."MoleculeStructure" x '
-                       f'WHERE x.molecule = {data["molecule"]} AND x.is_canonic')
+get_canonic = 'SELECT x.id, x.structure FROM "{schema}"."MoleculeStructure" x WHERE x.molecule = $1 AND x.is_canonic'
+current = plpy.execute(GD['cgrdb_plan']('{schema}:{plans}:canonic_structure', get_canonic, ['integer']),
+                       [data['molecule']])
 if current:  # check for atom mapping
     s = loads(current[0]['structure'])
     if {n: a.atomic_number for n, a in molecule.atoms()} != {n: a.atomic_number for n, a in s.atoms()}:
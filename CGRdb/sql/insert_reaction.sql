@@ -25,7 +25,9 @@ from collections import defaultdict
 from itertools import chain, product, repeat
 from pickle import dumps, loads
 
+GD['cgrdb_check_version']('{schema}:{plans}')
 rfp = GD['cgrdb_rfp']
+plan = GD['cgrdb_plan']
 data = TD['new']
 reaction = loads(data['structure'])
 if not isinstance(reaction, ReactionContainer):
@@ -43,9 +45,10 @@ while True:
     WHERE x.molecule IN (
         SELECT y.molecule
         FROM "{schema}"."MoleculeStructure" y
-        WHERE y.signature IN (%s)
-    )''' % ', '.join(f"'\\x{bytes(c).hex()}'::bytea" for c in chain(reaction.reactants, reaction.products))
-    for row in plpy.execute(load):
+        WHERE y.signature = ANY($1)
+    )'''
+    load = plan('{schema}:{plans}:reaction_molecules', load, ['bytea[]'])
+    for row in plpy.execute(load, [[bytes(c) for c in chain(reaction.reactants, reaction.products)]]):
         sg = row['signature']
         sg2m[sg] = mi = row['molecule']
         sg2c[sg] = c = loads(row['structure'])  # structure with mapping as in db
@@ -61,11 +64,13 @@ while True:
     if new:
         try:
             with plpy.subtransaction():
-                mis = [x['id'] for x in plpy.execute('INSERT INTO "{schema}"."Molecule" (id) VALUES %s RETURNING id' % \
-                       ', '.join(['(DEFAULT)'] * len(new)))]
-                insert = 'INSERT INTO "{schema}"."MoleculeStructure" (structure, molecule) VALUES %s RETURNING id' % \
-                         ', '.join(f"('\\x{dumps(s).hex()}'::bytea, {m})" for m, s in zip(mis, new.values()))
-                sis = [x['id'] for x in plpy.execute(insert)]
+                insert = 'INSERT INTO "{schema}"."Molecule" SELECT FROM generate_series(1, $1) RETURNING id'
+                insert = plan('{schema}:{plans}:insert_molecules', insert, ['integer'])
+                mis = [x['id'] for x in plpy.execute(insert, [len(new)])]
+                insert = '''INSERT INTO "{schema}"."MoleculeStructure" (structure, molecule)
+SELECT * FROM unnest($1::bytea[], $2::integer[]) RETURNING id'''
+                insert = plan('{schema}:{plans}:insert_structures', insert, ['bytea[]', 'integer[]'])
+                sis = [x['id'] for x in plpy.execute(insert, [[dumps(s) for s in new.values()], mis])]
         except plpy.SPIError:
             continue
 
@@ -85,13 +90,13 @@ for c, is_p in chain(zip(reaction.reactants, repeat(False)), zip(reaction.produc
     mi = sg2m[sg]
     if sg in new and sg not in duplicates:
         plain_reaction.append([(c, m2ms[mi][0])])
-        mapping.append((mi, is_p, 'NULL'))
+        mapping.append((mi, is_p, None))
         duplicates.append(sg)
     else:
         mp = sg2c[sg].get_fast_mapping(c)
         plain_reaction.append([(m.remap(mp, copy=True), si) for m, si in zip(m2c[mi], m2ms[mi])])
-        mp = [[k, v] for k, v in mp.items() if k != v]
-        mapping.append((mi, is_p, mp and f"'{mp}'" or 'NULL'))
+        mp = {k: v for k, v in mp.items() if k != v}
+        mapping.append((mi, is_p, mp and GD['cgrdb_pack_mapping'](mp) or None))
 
 lr = len(reaction.reactants)
 cgrs = []
@@ -102,17 +107,23 @@ for r in product(*plain_reaction):
     r = ReactionContainer([c for c, _ in r[:lr]], [c for c, _ in r[lr:]])
     c = ~r
     cgrs.append(c)
-    sgs.append(bytes(c).hex())  # preload signature
+    sgs.append(bytes(c))  # preload signature
 fps = rfp.transform_bitset(cgrs)
 
 # store in db
-ri = plpy.execute('INSERT INTO "{schema}"."ReactionRecord" DEFAULT VALUES RETURNING id')[0]['id']
-plpy.execute('INSERT INTO "{schema}"."ReactionIndex" (reaction, signature, fingerprint, structures) VALUES %s' %
-             ', '.join(f"({ri}, '\\x{sg}'::bytea, ARRAY{fp}::integer[], ARRAY{si}::integer[])"
-                       for sg, fp, si in zip(sgs, fps, sis)))
+insert = 'INSERT INTO "{schema}"."ReactionRecord" DEFAULT VALUES RETURNING id'
+ri = plpy.execute(plan('{schema}:{plans}:insert_reaction', insert))[0]['id']
 
-plpy.execute('INSERT INTO "{schema}"."MoleculeReaction" (reaction, molecule, is_product, mapping) VALUES %s' %
-             ', '.join(f"({ri}, {mi}, {is_p}, {mp})" for mi, is_p, mp in mapping))
+insert = '''INSERT INTO "{schema}"."ReactionIndex" (reaction, signature, fingerprint, structures)
+VALUES ($1, $2, $3, $4)'''
+insert = plan('{schema}:{plans}:insert_reaction_index', insert, ['integer', 'bytea', 'integer[]', 'integer[]'])
+for sg, fp, si in zip(sgs, fps, sis):
+    plpy.execute(insert, [ri, sg, fp, si])
+
+insert = '''INSERT INTO "{schema}"."MoleculeReaction" (reaction, molecule, is_product, mapping)
+SELECT $1, x.m, x.p, x.d FROM unnest($2::integer[], $3::boolean[], $4::bytea[]) x (m, p, d)'''
+insert = plan('{schema}:{plans}:insert_reaction_molecules', insert, ['integer', 'integer[]', 'boolean[]', 'bytea[]'])
+plpy.execute(insert, [ri, *map(list, zip(*mapping))])
 data['id'] = ri
 
 return 'MODIFY'
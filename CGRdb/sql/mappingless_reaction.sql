@@ -20,91 +20,103 @@ CREATE OR REPLACE FUNCTION
 "{schema}".cgrdb_search_mappingless_substructure_reactions(data bytea, OUT id integer, OUT count integer)
 AS $$
 from CGRtools.containers import ReactionContainer
-from itertools import chain, repeat
 from pickle import loads, dumps
 
+GD['cgrdb_check_version']('{schema}:{plans}')
 reaction = loads(data)
 if not isinstance(reaction, ReactionContainer):
     raise plpy.spiexceptions.DataException('ReactionContainer required')
 
 sg = bytes(reaction).hex()
 
-get_cache = f'''SELECT x.id, array_length(x.reactions, 1) count
-FROM "{schema}"."ReactionSearchCache" x
-WHERE x.operator = 'substructure' AND x.signature = '\\x{sg}'::bytea'''
+stats = GD['cgrdb_search_stats']('mappingless_substructure_reactions')
 
 # test for existing cache
-found = plpy.execute(get_cache)
+plan = GD['cgrdb_plan']
+cache = GD['cgrdb_search_cache']('{schema}:{plans}', 'reaction', 'substructure', sg, stats)
+found = cache.lookup()
 if found:
-    return found[0]
+    return found
 
-# search molecules
-molecules = []  # cached molecules
-for m in chain(reaction.reactants, reaction.products):
-    m = dumps(m).hex()
-    found = plpy.execute(f'''SELECT * FROM "{schema}".cgrdb_search_substructure_molecules('\\x{m}'::bytea)''')[0]
-    # check for empty results
-    if not found['count']:
-        # store empty cache
-        found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
+components = [(m, False) for m in reaction.reactants] + [(m, True) for m in reaction.products]
+if not components:
+    return cache.store([], [])
+
+# index daemon requests of all components are concurrent. results are consumed by molecules searches
+order = None
+if GD['index']:
+    from CGRtools.containers import MoleculeContainer
+    from concurrent.futures import ThreadPoolExecutor
+    from requests import post
 
-        # concurrent process stored same query. just reuse it
-        if not found:
-            found = plpy.execute(get_cache)
-        return found[0]
-    molecules.append(found['id'])
+    # fingerprints are memoized for molecules searches
+    fingerprints = GD['cgrdb_fingerprints']
+    fps = [tuple(fingerprints('molecule', bytes(m).hex(), m)) if isinstance(m, MoleculeContainer) else None
+           for m, _ in components]
+    with ThreadPoolExecutor(len(fps)) as pool:
+        prescreened = list(pool.map(lambda fp: fp and post(f"{GD['index']}/substructure/molecule",
+                                                           json=list(fp)).json(), fps))
+    GD['cgrdb_prescreened'].update((fp, f) for fp, f in zip(fps, prescreened) if fp)
+    # most selective components first. empty results are found faster
+    order = sorted(range(len(components)), key=lambda n: len(prescreened[n]) if fps[n] else float('inf'))
+    stats.stage('screening')
 
-# find reactions for each molecules
-for (n, m), is_p in zip(enumerate(molecules), chain(repeat(False, len(reaction.reactants)), repeat(True))):
-    plpy.execute(f'DROP TABLE IF EXISTS cgrdb_filtered{n}')
-    plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_filtered{n} ON COMMIT DROP AS
-SELECT DISTINCT ON (r.reaction) r.reaction r, s.t
+# search molecules
+molecules = [None] * len(components)  # cached molecules and counts
+search = plan('{schema}:{plans}:substructure_molecules',
+              'SELECT * FROM "{schema}".cgrdb_search_substructure_molecules($1, $2)', ['bytea', 'json'])
+try:
+    for n in order or range(len(components)):
+        found = plpy.execute(search, [dumps(components[n][0]), None])[0]
+        stats.nested()
+        if not found['count']:  # store empty cache
+            return cache.store([], [])
+        molecules[n] = (found['id'], found['count'])
+finally:
+    GD['cgrdb_prescreened'].clear()  # cached molecules searches don't request index
+stats.stage('molecules')
+
+# intersect reactions of components from most selective. only survivors are passed to next component
+component = '''SELECT array_agg(DISTINCT r.reaction) r
 FROM "{schema}"."MoleculeReaction" r
 JOIN
 (
-    SELECT unnest(x.molecules) m, unnest(x.tanimotos) t
-    FROM "{schema}"."MoleculeSearchCache" x
-    WHERE x.id = {m}
+    SELECT unnest(x.molecules) m
+    FROM "{schema}"."MoleculeSearchCacheBlock" x
+    WHERE x.cache = $1
 ) s
 ON r.molecule = s.m
-WHERE r.is_product = {is_p}''')
-
-    # check for empty results
-    if not plpy.execute(f'SELECT COUNT(*) FROM cgrdb_filtered{n}')[0]['count']:
-        # store empty cache
-        found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
+WHERE r.is_product = $2'''
+reactions = None
+for n in sorted(range(len(components)), key=lambda n: molecules[n][1]):
+    if reactions is None:
+        found = plpy.execute(plan('{schema}:{plans}:mappingless_component', component, ['integer', 'boolean']),
+                             [molecules[n][0], components[n][1]])
+    else:
+        found = plpy.execute(plan('{schema}:{plans}:mappingless_survivors', component + ' AND r.reaction = ANY($3)',
+                                  ['integer', 'boolean', 'integer[]']), [molecules[n][0], components[n][1], reactions])
+    reactions = found[0]['r']
+    if not reactions:  # store empty cache
+        return cache.store([], [])
+stats['candidates'] = len(reactions)
+stats.stage('reactions')
 
-        # concurrent process stored same query. just reuse it
-        if not found:
-            found = plpy.execute(get_cache)
-        return found[0]
-
-# save found results
-t_sum = ' + '.join(f'o{n}.t' for n in range(len(molecules)))
-joins = ' '.join(f'JOIN cgrdb_filtered{n} o{n} ON o0.r = o{n}.r' for n in range(1, len(molecules)))
-
-found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-SELECT '\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, array_agg(o.r), array_agg(o.t)
+# score survivors by mean of best tanimotos of components molecules
+scoring = '''SELECT array_agg(o.r ORDER BY o.t DESC, o.r) r, array_agg(o.t ORDER BY o.t DESC, o.r) t
 FROM (
-    SELECT o0.r, ({t_sum}) / {len(molecules)} t
-    FROM cgrdb_filtered0 o0 {joins}
-    ORDER BY t DESC
-) o
-ON CONFLICT DO NOTHING
-RETURNING id, array_length(reactions, 1) count''')
-
-# concurrent process stored same query. just reuse it
-if not found:
-    found = plpy.execute(get_cache)
-
-return found[0]
+    SELECT c.r, sum(c.t) / count(*) t
+    FROM (
+        SELECT q.n, r.reaction r, max(s.t) t
+        FROM unnest($1::integer[], $2::boolean[]) WITH ORDINALITY q (cache, is_product, n)
+        JOIN "{schema}"."MoleculeSearchCacheBlock" x ON x.cache = q.cache
+        CROSS JOIN LATERAL unnest(x.molecules, x.tanimotos) s (m, t)
+        JOIN "{schema}"."MoleculeReaction" r ON r.molecule = s.m AND r.is_product = q.is_product
+        WHERE r.reaction = ANY($3)
+        GROUP BY q.n, r.reaction
+    ) c
+    GROUP BY c.r
+) o'''
+found = plpy.execute(plan('{schema}:{plans}:mappingless_scoring', scoring, ['integer[]', 'boolean[]', 'integer[]']),
+                     [[c for c, _ in molecules], [p for _, p in components], reactions])[0]
+return cache.store(found['r'], found['t'])
 $$ LANGUAGE plpython3u
@@ -27,8 +27,12 @@ from json import loads as json_loads
 from itertools import product
 from pickle import dumps, loads
 
+GD['cgrdb_check_version']('{schema}:{plans}')
 rfp = GD['cgrdb_rfp']
+plan = GD['cgrdb_plan']
 cache_size = GD['cache_size']
+pack_mapping = GD['cgrdb_pack_mapping']
+unpack_mapping = GD['cgrdb_unpack_mapping']
 
 # load structures
 s_structures = []
@@ -61,26 +65,32 @@ if len(set(mp.values())) != len(mp) or {n: a.atomic_number for n, a in t.atoms()
     raise plpy.spiexceptions.DataException('mapping invalid or structures not compatible')
 
 # source structures remapping
+remap = 'UPDATE "{schema}"."MoleculeStructure" SET structure = $1, is_canonic = False WHERE id = $2'
+remap = plan('{schema}:{plans}:remap_structure', remap, ['bytea', 'integer'])
 for s, si in zip(s_structures, s_ids):
     s.remap(mp)
-    plpy.execute(f'''UPDATE "{schema}"."MoleculeStructure"
-SET structure = '\\x{dumps(s).hex()}'::bytea, is_canonic = False WHERE id = {si}''')
+    plpy.execute(remap, [dumps(s), si])
 
 # source reactions remapping
 rmp = {t: s for s, t in mp.items()}  # target to source mapping
-nmp = [[t, s] for t, s in rmp.items() if t != s]
-nmp = f"'{nmp}'" if nmp else 'NULL'  # minified NULL-mapping
+nmp = {t: s for t, s in rmp.items() if t != s}
+nmp = pack_mapping(nmp) if nmp else None  # minified NULL-mapping
+remap = plan('{schema}:{plans}:remap_reaction', 'UPDATE "{schema}"."MoleculeReaction" SET mapping = $1 WHERE id = $2',
+             ['bytea', 'integer'])
 for x in plpy.cursor(f'SELECT x.id, x.mapping FROM "{schema}"."MoleculeReaction" x WHERE x.molecule = {source}'):
     mp = x['mapping']
     if mp:
-        mp = dict(json_loads(mp))
-        mp = [[t, r] for t, r in ((t, mp.get(s, s)) for t, s in rmp.items()) if t != r]
-        mp = f"'{mp}'" if mp else 'NULL'
+        mp = unpack_mapping(mp)
+        mp = {t: r for t, r in ((t, mp.get(s, s)) for t, s in rmp.items()) if t != r}
+        mp = pack_mapping(mp) if mp else None
     else:
         mp = nmp
-    plpy.execute(f'UPDATE "{schema}"."MoleculeReaction" SET mapping = {mp} WHERE id = {x["id"]}')
+    plpy.execute(remap, [mp, x['id']])
 
 # index update
+insert = '''INSERT INTO "{schema}"."ReactionIndex" (reaction, signature, fingerprint, structures)
+VALUES ($1, $2, $3, $4)'''
+insert = plan('{schema}:{plans}:insert_reaction_index', insert, ['integer', 'bytea', 'integer[]', 'integer[]'])
 cache = lru_cache(cache_size)(lambda x: loads(s))
 for molecule, update_s, update_si in ((source, t_structures, t_ids), (target, s_structures, s_ids)):
     get_mp = f'''SELECT x.reaction r, array_agg(x.id) i, array_agg(x.molecule) m, array_agg(x.mapping) d, array_agg(x.is_product) p
@@ -115,7 +125,7 @@ for molecule, update_s, update_si in ((source, t_structures, t_ids), (target, s_
         lr = 0
         for mri, mi, mp, is_p in zip(mp_row['i'], mp_row['m'], mp_row['d'], mp_row['p']):
             if mp:
-                mp = dict(json_loads(mp))
+                mp = unpack_mapping(mp)
                 ms = [(si, s.remap(mp, copy=True)) for si, s in m2s[mi]]
                 if mi == molecule:
                     tmp = [(si, s.remap(mp, copy=True)) for si, s in update]
@@ -140,9 +150,8 @@ for molecule, update_s, update_si in ((source, t_structures, t_ids), (target, s_
                     cgrs[~ReactionContainer([s for _, s in r[:lr]], [s for _, s in r[lr:]])] = list({si for si, _ in r})
         fps = rfp.transform_bitset(list(cgrs))
         ri = mp_row['r']
-        plpy.execute('INSERT INTO "{schema}"."ReactionIndex" (reaction, signature, fingerprint, structures) VALUES %s' %
-                     ', '.join(f"({ri}, '\\x{bytes(s).hex()}'::bytea, ARRAY{fp}::integer[], ARRAY{si}::integer[])"
-                               for (s, si), fp in zip(cgrs.items(), fps)))
+        for (s, si), fp in zip(cgrs.items(), fps):
+            plpy.execute(insert, [ri, bytes(s), fp, si])
 
 # move structures
 for si in s_ids:
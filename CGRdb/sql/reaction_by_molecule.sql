@@ -17,7 +17,8 @@
 */
 
 CREATE OR REPLACE FUNCTION
-"{schema}".cgrdb_search_reactions_by_molecule(data bytea, role integer, search integer, OUT id integer, OUT count integer)
+"{schema}".cgrdb_search_reactions_by_molecule(data bytea, role integer, search integer, precomputed json DEFAULT NULL,
+                                               OUT id integer, OUT count integer)
 AS $$
 from CGRtools.containers import MoleculeContainer, QueryContainer
 from pickle import loads
@@ -33,87 +34,89 @@ if role == 0:  # role: 0 - any, 1 - reactant, 2 - product
     role_filter = ''
     search_type = search_function + '_any'
 elif role == 1:
-    role_filter = 'WHERE r.is_product = False'
+    role_filter = 'AND r.is_product = False'
     search_type = search_function + '_reactant'
 elif role == 2:
-    role_filter = 'WHERE r.is_product = True'
+    role_filter = 'AND r.is_product = True'
     search_type = search_function + '_product'
 else:
     raise plpy.spiexceptions.DataException('role invalid')
 
-molecule = loads(data)
-if not isinstance(molecule, (MoleculeContainer, QueryContainer)):
-    raise plpy.spiexceptions.DataException('MoleculeContainer or QueryContainer required')
+GD['cgrdb_check_version']('{schema}:{plans}')
+# precomputed signature and fingerprint are passed to molecules search
+sg = GD['cgrdb_fingerprints'].precomputed(precomputed, 'molecule')
+if sg is None:
+    molecule = loads(data)
+    if not isinstance(molecule, (MoleculeContainer, QueryContainer)):
+        raise plpy.spiexceptions.DataException('MoleculeContainer or QueryContainer required')
+    sg = bytes(molecule).hex()
 
-sg = bytes(molecule).hex()
-
-get_cache = f'''SELECT x.id, array_length(x.reactions, 1) count
-FROM "{schema}"."ReactionSearchCache" x
-WHERE x.operator = '{search_type}' AND x.signature = '\\x{sg}'::bytea'''
+stats = GD['cgrdb_search_stats']('reactions_by_molecule')
 
 # test for existing cache
-found = plpy.execute(get_cache)
+plan = GD['cgrdb_plan']
+cache = GD['cgrdb_search_cache']('{schema}:{plans}', 'reaction', search_type, sg, stats)
+found = cache.lookup()
 if found:
-    return found[0]
+    return found
 
 # search molecules
-found = plpy.execute(f'''SELECT * FROM "{schema}".cgrdb_search_{search_function}_molecules('\\x{data.hex()}'::bytea)''')[0]
+molecules = f'SELECT * FROM "{schema}".cgrdb_search_{search_function}_molecules($1, $2)'
+molecules = plan(f'{schema}:{plans}:{search_function}_molecules', molecules, ['bytea', 'json'])
+found = plpy.execute(molecules, [data, precomputed])[0]
+stats.nested()
+stats.stage('molecules')
 # check for empty results
-if not found['count']:
-    # store empty cache
-    found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-VALUES ('\\x{sg}'::bytea, '{search_type}', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
+if not found['count']:  # store empty cache
+    return cache.store([], [])
 
-    # concurrent process stored same query. just reuse it
-    if not found:
-        found = plpy.execute(get_cache)
-    return found[0]
 
-# find reactions
-plpy.execute('DROP TABLE IF EXISTS cgrdb_filtered')
-plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_filtered ON COMMIT DROP AS
-SELECT h.r, h.t FROM (
-    SELECT DISTINCT ON (r.reaction) r.reaction r, s.t
+def reactions(condition=''):
+    # best tanimoto of reaction molecules. $1 - molecules cache
+    return f'''SELECT DISTINCT ON (r.reaction) r.reaction r, s.t
     FROM "{schema}"."MoleculeReaction" r
     JOIN
     (
         SELECT unnest(x.molecules) m, unnest(x.tanimotos) t
-        FROM "{schema}"."MoleculeSearchCache" x
-        WHERE x.id = {found['id']}
+        FROM "{schema}"."MoleculeSearchCacheBlock" x
+        WHERE x.cache = $1
     ) s
-    ON r.molecule = s.m
-    {role_filter}
-) h
-ORDER BY h.t DESC''')
+    ON r.molecule = s.m {role_filter} {condition}
+    ORDER BY r.reaction, s.t DESC'''
 
-# check for empty results
-if not plpy.execute('SELECT COUNT(*) FROM cgrdb_filtered')[0]['count']:
-    # store empty cache
-    found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-VALUES ('\\x{sg}'::bytea, '{search_type}', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
 
-    # concurrent process stored same query. just reuse it
-    if not found:
-        found = plpy.execute(get_cache)
-    return found[0]
+# find reactions
+if GD['index']:  # molecule to reactions postings are in index. only reactions added after index building are joined
+    from requests import post
 
-# save found results
-found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-SELECT '\\x{sg}'::bytea, '{search_type}', CURRENT_TIMESTAMP, array_agg(o.r), array_agg(o.t)
-FROM cgrdb_filtered o
-ON CONFLICT DO NOTHING
-RETURNING id, array_length(reactions, 1) count''')
+    cached = plpy.execute(plan('{schema}:{plans}:molecule_cache_blocks', '''SELECT x.molecules m, x.tanimotos t
+FROM "{schema}"."MoleculeSearchCacheBlock" x WHERE x.cache = $1 ORDER BY x.start''', ['integer']), [found['id']])
+    indexed = post(f"{GD['index']}/reactions/molecule",
+                   json={'role': role, 'molecules': [m for x in cached for m in x['m']],
+                         'tanimotos': [t for x in cached for t in x['t']]}).json()
+    stats['candidates'] = len(indexed['reactions'])
 
-# concurrent process stored same query. just reuse it
-if not found:
-    found = plpy.execute(get_cache)
+    # deleted after index building reactions are filtered out
+    merged = f'''SELECT array_agg(o.r ORDER BY o.t DESC, o.n) r, array_agg(o.t ORDER BY o.t DESC, o.n) t
+FROM (
+    SELECT h.r, h.t, h.n
+    FROM unnest($3::integer[], $4::real[]) WITH ORDINALITY h (r, t, n)
+    WHERE EXISTS(SELECT 1 FROM "{schema}"."Reaction" x WHERE x.id = h.r)
+    UNION ALL
+    SELECT h.r, h.t, 0
+    FROM ({reactions('AND r.reaction > $2')}) h
+) o'''
+    found = plpy.execute(plan(f'{schema}:{plans}:reactions_by_molecule_indexed_{role}', merged,
+                              ['integer', 'integer', 'integer[]', 'real[]']),
+                         [found['id'], indexed['watermark'], indexed['reactions'] or None,
+                          indexed['tanimotos'] or None])[0]
+else:
+    found = plpy.execute(plan(f'{schema}:{plans}:reactions_by_molecule_{role}', f'''SELECT
+    array_agg(h.r ORDER BY h.t DESC, h.r) r, array_agg(h.t ORDER BY h.t DESC, h.r) t
+FROM ({reactions()}) h''', ['integer']), [found['id']])[0]
+    stats['candidates'] = len(found['r'] or ())
+stats.stage('reactions')
 
-return found[0]
+# store found reactions to cache
+return cache.store(found['r'], found['t'])
 $$ LANGUAGE plpython3u
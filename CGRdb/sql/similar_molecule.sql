@@ -17,91 +17,85 @@
 */
 
 CREATE OR REPLACE FUNCTION
-"{schema}".cgrdb_search_similar_molecules(data bytea, OUT id integer, OUT count integer)
+"{schema}".cgrdb_search_similar_molecules(data bytea, precomputed json DEFAULT NULL,
+                                           OUT id integer, OUT count integer)
 AS $$
 from CGRtools.containers import MoleculeContainer
 from pickle import loads
 
-molecule = loads(data)
-if not isinstance(molecule, MoleculeContainer):
-    raise plpy.spiexceptions.DataException('MoleculeContainer required')
 
-sg = bytes(molecule).hex()
+def load():
+    molecule = loads(data)
+    if not isinstance(molecule, MoleculeContainer):
+        raise plpy.spiexceptions.DataException('MoleculeContainer required')
+    return molecule
 
-get_cache = f'''SELECT x.id, array_length(x.molecules, 1) count
-FROM "{schema}"."MoleculeSearchCache" x
-WHERE x.operator = 'similar' AND x.signature = '\\x{sg}'::bytea'''
+
+GD['cgrdb_check_version']('{schema}:{plans}')
+fingerprints = GD['cgrdb_fingerprints']
+sg = fingerprints.precomputed(precomputed, 'molecule')
+if sg is None:
+    molecule = load()
+    sg = bytes(molecule).hex()
+else:  # signature and fingerprint calculated by client. cached results don't require structure
+    molecule = None
+
+stats = GD['cgrdb_search_stats']('similar_molecules')
 
 # test for existing cache
-found = plpy.execute(get_cache)
+plan = GD['cgrdb_plan']
+cache = GD['cgrdb_search_cache']('{schema}:{plans}', 'molecule', 'similar', sg, stats)
+found = cache.lookup()
 if found:
-    return found[0]
+    return found
 
 # cache not found. lets start searching
-fp = GD['cgrdb_mfp'].transform_bitset([molecule])[0]
+fp = fingerprints('molecule', sg, molecule)  # client fingerprint is memoized
+if molecule is None:  # client data are checked before results sharing
+    def verify():
+        molecule = load()
+        if bytes(molecule).hex() != sg:
+            raise plpy.spiexceptions.DataException('precomputed signature mismatch')
+        fingerprints.verify('molecule', sg, molecule)
+
+    cache.verify = verify
 
 if GD['index']:  # use index search
     from requests import post
     found = post(f"{GD['index']}/similarity/molecule", json=fp).json()
-    if found:  # create cgrdb_query temp table
-        plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-        if isinstance(found[0], int):  # need to calculate tanimoto
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.molecule m,
-       icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-FROM "{schema}"."MoleculeStructure" x
-WHERE x.id = ANY(ARRAY{found}::integer[])''')
-        else:  # tanimoto exists
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.molecule m, f.t
-FROM "{schema}"."MoleculeStructure" x,
-     (VALUES {', '.join(f'({s}::integer, {t:.2f}::float)' for s, t in found)}) AS f (s, t)
-WHERE x.id = f.s''')
-else:  # sequential search
-    plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-    plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT c.m, c.t
+    stats['candidates'] = len(found)
+    if found and isinstance(found[0], int):  # need to calculate tanimoto
+        found = [(s, None) for s in found]
+    # best structure of each molecule
+    indexed = '''SELECT array_agg(h.m ORDER BY h.t DESC, h.m) m, array_agg(h.t ORDER BY h.t DESC, h.m) t
 FROM (
-    SELECT x.molecule m,
-           icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-    FROM "{schema}"."MoleculeStructure" x
-) c
-WHERE c.t > 0.5''')
-    # check for empty results
-    found = plpy.execute('SELECT COUNT(*) FROM cgrdb_query')[0]['count']
-
-if not found:
-    # store empty cache
-    found = plpy.execute(f'''INSERT INTO
-"{schema}"."MoleculeSearchCache"(signature, operator, date, molecules, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'similar', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
-
-    # concurrent process stored same query. just reuse it
-    if not found:
-        found = plpy.execute(get_cache)
-    return found[0]
-
-# store found molecules to cache
-found = plpy.execute(f'''INSERT INTO
-"{schema}"."MoleculeSearchCache"(signature, operator, date, molecules, tanimotos)
-SELECT '\\x{sg}'::bytea, 'similar', CURRENT_TIMESTAMP, array_agg(o.m), array_agg(o.t)
+    SELECT DISTINCT ON (x.molecule) x.molecule m,
+           coalesce(f.t, icount(x.fingerprint & $3)::float / icount(x.fingerprint | $3)::float) t
+    FROM unnest($1::integer[], $2::real[]) f (s, t)
+    JOIN "{schema}"."MoleculeStructure" x ON x.id = f.s
+    ORDER BY x.molecule, t DESC
+) h'''
+    indexed = plan('{schema}:{plans}:similar_molecule_indexed', indexed, ['integer[]', 'real[]', 'integer[]'])
+    found = plpy.execute(indexed, [[s for s, _ in found], [t for _, t in found], fp])[0]
+else:  # sequential search
+    # Tanimoto can't be greater than min/max ratio of bits counts. prune records by indexed popcount
+    sequential = '''SELECT array_agg(h.m ORDER BY h.t DESC, h.m) m, array_agg(h.t ORDER BY h.t DESC, h.m) t
 FROM (
-    SELECT h.m, h.t
+    SELECT DISTINCT ON (c.m) c.m, c.t
     FROM (
-        SELECT DISTINCT ON (f.m) f.m, f.t
-        FROM cgrdb_query f
-        ORDER BY f.m, f.t DESC
-    ) h
-    ORDER BY h.t DESC
-) o
-ON CONFLICT DO NOTHING
-RETURNING id, array_length(molecules, 1) count''')
+        SELECT x.molecule m, icount(x.fingerprint & $1)::float / icount(x.fingerprint | $1)::float t
+        FROM "{schema}"."MoleculeStructure" x
+        WHERE icount(x.fingerprint) BETWEEN $2 AND $3 AND x.fingerprint && $1
+    ) c
+    WHERE c.t > 0.5
+    ORDER BY c.m, c.t DESC
+) h'''
+    bits = len(fp)
+    sequential = plan('{schema}:{plans}:similar_molecule_sequential', sequential, ['integer[]', 'integer', 'integer'])
+    found = plpy.execute(sequential, [fp, (bits + 1) // 2, bits * 2])[0]
+    stats['candidates'] = len(found['m'] or ())
+stats.stage('screening')
 
-# concurrent process stored same query. just reuse it
-if not found:
-    found = plpy.execute(get_cache)
-
-return found[0]
+# store found molecules to cache
+return cache.store(found['m'], found['t'])
 $$ LANGUAGE plpython3u
@@ -17,92 +17,85 @@
 */
 
 CREATE OR REPLACE FUNCTION
-"{schema}".cgrdb_search_similar_reactions(data bytea, OUT id integer, OUT count integer)
+"{schema}".cgrdb_search_similar_reactions(data bytea, precomputed json DEFAULT NULL,
+                                           OUT id integer, OUT count integer)
 AS $$
 from CGRtools.containers import ReactionContainer
 from pickle import loads
 
-reaction = loads(data)
-if not isinstance(reaction, ReactionContainer):
-    raise plpy.spiexceptions.DataException('ReactionContainer required')
 
-cgr = ~reaction
-sg = bytes(cgr).hex()
+def load():
+    reaction = loads(data)
+    if not isinstance(reaction, ReactionContainer):
+        raise plpy.spiexceptions.DataException('ReactionContainer required')
+    return ~reaction
 
-get_cache = f'''SELECT x.id, array_length(x.reactions, 1) count
-FROM "{schema}"."ReactionSearchCache" x
-WHERE x.operator = 'similar' AND x.signature = '\\x{sg}'::bytea'''
+
+GD['cgrdb_check_version']('{schema}:{plans}')
+fingerprints = GD['cgrdb_fingerprints']
+sg = fingerprints.precomputed(precomputed, 'reaction')
+if sg is None:
+    cgr = load()
+    sg = bytes(cgr).hex()
+else:  # signature and fingerprint calculated by client. cached results don't require structure
+    cgr = None
+
+stats = GD['cgrdb_search_stats']('similar_reactions')
 
 # test for existing cache
-found = plpy.execute(get_cache)
+plan = GD['cgrdb_plan']
+cache = GD['cgrdb_search_cache']('{schema}:{plans}', 'reaction', 'similar', sg, stats)
+found = cache.lookup()
 if found:
-    return found[0]
+    return found
 
 # cache not found. lets start searching
-fp = GD['cgrdb_rfp'].transform_bitset([cgr])[0]
+fp = fingerprints('reaction', sg, cgr)  # client fingerprint is memoized
+if cgr is None:  # client data are checked before results sharing
+    def verify():
+        cgr = load()
+        if bytes(cgr).hex() != sg:
+            raise plpy.spiexceptions.DataException('precomputed signature mismatch')
+        fingerprints.verify('reaction', sg, cgr)
+
+    cache.verify = verify
 
 if GD['index']:  # use index search
     from requests import post
     found = post(f"{GD['index']}/similarity/reaction", json=fp).json()
-    if found:  # create cgrdb_query temp table
-        plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-        if isinstance(found[0], int):  # need to calculate tanimoto
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.reaction r,
-       icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-FROM "{schema}"."ReactionIndex" x
-WHERE x.id = ANY(ARRAY{found}::integer[])''')
-        else:  # tanimoto exists
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.reaction r, f.t
-FROM "{schema}"."ReactionIndex" x,
-     (VALUES {', '.join(f'({s}::integer, {t:.2f}::float)' for s, t in found)}) AS f (s, t)
-WHERE x.id = f.s''')
-else:  # sequential search
-    plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-    plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT c.r, c.t
+    stats['candidates'] = len(found)
+    if found and isinstance(found[0], int):  # need to calculate tanimoto
+        found = [(s, None) for s in found]
+    # best structure of each reaction
+    indexed = '''SELECT array_agg(h.r ORDER BY h.t DESC, h.r) r, array_agg(h.t ORDER BY h.t DESC, h.r) t
 FROM (
-    SELECT x.reaction r,
-           icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-    FROM "{schema}"."ReactionIndex" x
-) c
-WHERE c.t > 0.5''')
-    # check for empty results
-    found = plpy.execute('SELECT COUNT(*) FROM cgrdb_query')[0]['count']
-
-if not found:
-    # store empty cache
-    found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'similar', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
-
-    # concurrent process stored same query. just reuse it
-    if not found:
-        found = plpy.execute(get_cache)
-    return found[0]
-
-# store found molecules to cache
-found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-SELECT '\\x{sg}'::bytea, 'similar', CURRENT_TIMESTAMP, array_agg(o.r), array_agg(o.t)
+    SELECT DISTINCT ON (x.reaction) x.reaction r,
+           coalesce(f.t, icount(x.fingerprint & $3)::float / icount(x.fingerprint | $3)::float) t
+    FROM unnest($1::integer[], $2::real[]) f (s, t)
+    JOIN "{schema}"."ReactionIndex" x ON x.id = f.s
+    ORDER BY x.reaction, t DESC
+) h'''
+    indexed = plan('{schema}:{plans}:similar_reaction_indexed', indexed, ['integer[]', 'real[]', 'integer[]'])
+    found = plpy.execute(indexed, [[s for s, _ in found], [t for _, t in found], fp])[0]
+else:  # sequential search
+    # Tanimoto can't be greater than min/max ratio of bits counts. prune records by indexed popcount
+    sequential = '''SELECT array_agg(h.r ORDER BY h.t DESC, h.r) r, array_agg(h.t ORDER BY h.t DESC, h.r) t
 FROM (
-    SELECT h.r, h.t
+    SELECT DISTINCT ON (c.r) c.r, c.t
     FROM (
-        SELECT DISTINCT ON (f.r) f.r, f.t
-        FROM cgrdb_query f
-        ORDER BY f.r, f.t DESC
-    ) h
-    ORDER BY h.t DESC
-) o
-ON CONFLICT DO NOTHING
-RETURNING id, array_length(reactions, 1) count''')
-
-# concurrent process stored same query. just reuse it
-if not found:
-    found = plpy.execute(get_cache)
+        SELECT x.reaction r, icount(x.fingerprint & $1)::float / icount(x.fingerprint | $1)::float t
+        FROM "{schema}"."ReactionIndex" x
+        WHERE icount(x.fingerprint) BETWEEN $2 AND $3 AND x.fingerprint && $1
+    ) c
+    WHERE c.t > 0.5
+    ORDER BY c.r, c.t DESC
+) h'''
+    bits = len(fp)
+    sequential = plan('{schema}:{plans}:similar_reaction_sequential', sequential, ['integer[]', 'integer', 'integer'])
+    found = plpy.execute(sequential, [fp, (bits + 1) // 2, bits * 2])[0]
+    stats['candidates'] = len(found['r'] or ())
+stats.stage('screening')
 
-return found[0]
+# store found reactions to cache
+return cache.store(found['r'], found['t'])
 $$ LANGUAGE plpython3u
@@ -17,91 +17,112 @@
 */
 
 CREATE OR REPLACE FUNCTION
-"{schema}".cgrdb_search_substructure_molecules(data bytea, OUT id integer, OUT count integer)
+"{schema}".cgrdb_search_substructure_molecules(data bytea, precomputed json DEFAULT NULL,
+                                                OUT id integer, OUT count integer)
 AS $$
 from CGRtools.containers import MoleculeContainer, QueryContainer
 from CGRtools.periodictable import Element
 from pickle import loads
 
-molecule = loads(data)
-if isinstance(molecule, QueryContainer):
-    screen = MoleculeContainer()  # convert query to molecules for screening
-    for n, a in molecule.atoms():
-        screen.add_atom(Element.from_atomic_number(a.atomic_number)(a.isotope),
-                        _map=n, charge=a.charge, is_radical=a.is_radical)
-    for n, m, b in molecule.bonds():
-        screen.add_bond(n, m, int(b))
-elif isinstance(molecule, MoleculeContainer):
-    screen = molecule
-else:
-    raise plpy.spiexceptions.DataException('MoleculeContainer or QueryContainer required')
-
-sg = bytes(molecule).hex()
-# test for existing cache
 
-get_cache = f'''SELECT x.id, array_length(x.molecules, 1) count
-FROM "{schema}"."MoleculeSearchCache" x
-WHERE x.operator = 'substructure' AND x.signature = '\\x{sg}'::bytea'''
+def load():
+    molecule = loads(data)
+    if isinstance(molecule, QueryContainer):
+        screen = MoleculeContainer()  # convert query to molecules for screening
+        for n, a in molecule.atoms():
+            screen.add_atom(Element.from_atomic_number(a.atomic_number)(a.isotope),
+                            _map=n, charge=a.charge, is_radical=a.is_radical)
+        for n, m, b in molecule.bonds():
+            screen.add_bond(n, m, int(b))
+    elif isinstance(molecule, MoleculeContainer):
+        screen = molecule
+    else:
+        raise plpy.spiexceptions.DataException('MoleculeContainer or QueryContainer required')
+    return molecule, screen
+
+
+GD['cgrdb_check_version']('{schema}:{plans}')
+fingerprints = GD['cgrdb_fingerprints']
+sg = fingerprints.precomputed(precomputed, 'molecule')
+if sg is None:
+    molecule, screen = load()
+    sg = bytes(molecule).hex()
+    kind = 'molecule' if molecule is screen else 'query'
+else:  # signature and fingerprint calculated by client. cached results don't require structure
+    molecule = None
+    kind = 'molecule'
+
+stats = GD['cgrdb_search_stats']('substructure_molecules')
 
-found = plpy.execute(get_cache)
+# test for existing cache
+plan = GD['cgrdb_plan']
+cache = GD['cgrdb_search_cache']('{schema}:{plans}', 'molecule', 'substructure', sg, stats)
+found = cache.lookup(refresh=True)
 if found:
-    return found[0]
+    return found
+refresh = cache.refresh
+
+if refresh is not None:  # load previous results. concurrent process can evict them
+    cached = cache.results()
+    if cached is None:
+        refresh = None
 
 # cache not found. lets start searching
-fp = GD['cgrdb_mfp'].transform_bitset([screen])[0]
-
-if GD['index']:  # use index search
-    from requests import post
-    found = post(f"{GD['index']}/substructure/molecule", json=fp).json()
-    if found:  # create cgrdb_query temp table
-        plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-        if isinstance(found[0], int):  # need to calculate tanimoto
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.molecule m, x.id s,
-       icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-FROM "{schema}"."MoleculeStructure" x
-WHERE x.id = ANY(ARRAY{found}::integer[])''')
-        else:  # tanimoto exists
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.molecule m, f.s, f.t
-FROM "{schema}"."MoleculeStructure" x,
-     (VALUES {', '.join(f'({s}::integer, {t:.2f}::float)' for s, t in found)}) AS f (s, t)
-WHERE x.id = f.s''')
-else:  # sequential search
-    plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-    plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.molecule m, x.id s,
-       icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-FROM "{schema}"."MoleculeStructure" x
-WHERE x.fingerprint @> ARRAY{fp}::integer[]''')
-    # check for empty results
-    found = plpy.execute('SELECT COUNT(*) FROM cgrdb_query')[0]['count']
-
-if not found:
-    # store empty cache
-    found = plpy.execute(f'''INSERT INTO
-"{schema}"."MoleculeSearchCache"(signature, operator, date, molecules, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, 0 count''')
-
-    # concurrent process stored same query. just reuse it
-    if not found:
-        found = plpy.execute(get_cache)
-    return found[0]
-
-# get most substructures for each molecule
-get_data = '''SELECT h.m, h.t, s.structure d
+if molecule is None:  # structure is required for verification
+    molecule, screen = load()
+    if molecule is not screen or bytes(molecule).hex() != sg:
+        raise plpy.spiexceptions.DataException('precomputed signature mismatch')
+    cache.verify = lambda: fingerprints.verify(kind, sg, screen)  # screened by client fingerprint
+fp = fingerprints(kind, sg, screen)
+
+# most similar structure of each molecule. verification is done in tanimoto order
+if refresh is None and GD['index']:  # use index search. index doesn't contain added structures
+    prescreened = GD['cgrdb_prescreened']
+    if (key := tuple(fp)) in prescreened:  # requested concurrently by mappingless reaction search
+        found = prescreened.pop(key)
+    else:
+        from requests import post
+        found = post(f"{GD['index']}/substructure/molecule", json=fp).json()
+    stats['candidates'] = len(found)
+    stats.stage('screening')
+
+    if not found:  # store empty cache
+        return cache.store([], [])
+    elif isinstance(found[0], int):  # need to calculate tanimoto
+        found = [(s, None) for s in found]
+
+    indexed = '''SELECT h.m, h.t, s.structure d
+FROM (
+    SELECT DISTINCT ON (x.molecule) x.molecule m, x.id s,
+           coalesce(f.t, icount(x.fingerprint & $3)::float / icount(x.fingerprint | $3)::float) t
+    FROM unnest($1::integer[], $2::real[]) f (s, t)
+    JOIN "{schema}"."MoleculeStructure" x ON x.id = f.s
+    ORDER BY x.molecule, t DESC
+) h JOIN "{schema}"."MoleculeStructure" s ON h.s = s.id
+ORDER BY h.t DESC'''
+    indexed = plan('{schema}:{plans}:substructure_molecule_indexed', indexed, ['integer[]', 'real[]', 'integer[]'])
+    rows = plpy.cursor(indexed, [[s for s, _ in found], [t for _, t in found], fp])
+else:  # sequential search. on refresh only structures added after cached search are screened
+    sequential = '''SELECT h.m, h.t, s.structure d
 FROM (
-    SELECT DISTINCT ON (f.m) f.m, f.s, f.t
-    FROM cgrdb_query f
-    ORDER BY f.m, f.t DESC
+    SELECT DISTINCT ON (x.molecule) x.molecule m, x.id s,
+           icount(x.fingerprint & $1)::float / icount(x.fingerprint | $1)::float t
+    FROM "{schema}"."MoleculeStructure" x
+    WHERE icount(x.fingerprint) >= $2 AND x.fingerprint @> $1 AND x.id > $3
+    ORDER BY x.molecule, t DESC
 ) h JOIN "{schema}"."MoleculeStructure" s ON h.s = s.id
 ORDER BY h.t DESC'''
+    sequential = plan('{schema}:{plans}:substructure_molecule_sequential', sequential,
+                      ['integer[]', 'integer', 'integer'])
+    rows = plpy.cursor(sequential, [fp, len(fp), refresh or 0])
+    # screened lazily on rows fetching. number of prescreened candidates is unknown
+
 substructure_limit = GD['substructure_limit']
 mis, sts = [], []
 found_count = 0
-for row in plpy.cursor(get_data):
+stats['checked'] = 0  # candidates verified by isomorphism in both index and sequential searches
+for row in rows:
+    stats['checked'] += 1
     if molecule <= loads(row['d']):
         mis.append(row['m'])
         sts.append(row['t'])
@@ -109,16 +130,17 @@ for row in plpy.cursor(get_data):
         if found_count == substructure_limit:
             break
 
-# store found molecules to cache
-found = plpy.execute(f'''INSERT INTO
-"{schema}"."MoleculeSearchCache"(signature, operator, date, molecules, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, ARRAY{mis}::integer[], ARRAY{sts}::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, array_length(molecules, 1) count''')
+stats.stage('verification')
 
-# concurrent process stored same query. just reuse it
-if not found:
-    found = plpy.execute(get_cache)
+if refresh is not None:  # merge with previously found molecules in tanimoto order
+    from heapq import merge
 
-return found[0]
+    seen = set(cached[0])  # molecules with new forms of structure already found
+    merged = list(merge(zip(*cached), ((m, t) for m, t in zip(mis, sts) if m not in seen),
+                        key=lambda x: x[1], reverse=True))[:substructure_limit]
+    mis = [m for m, _ in merged]
+    sts = [t for _, t in merged]
+
+# store found molecules to cache
+return cache.store(mis, sts)
 $$ LANGUAGE plpython3u
@@ -17,109 +17,131 @@
 */
 
 CREATE OR REPLACE FUNCTION
-"{schema}".cgrdb_search_substructure_reactions(data bytea, OUT id integer, OUT count integer)
+"{schema}".cgrdb_search_substructure_reactions(data bytea, precomputed json DEFAULT NULL,
+                                                OUT id integer, OUT count integer)
 AS $$
 from CGRtools.containers import ReactionContainer
 from collections import defaultdict
 from functools import lru_cache
-from json import loads as json_loads
 from itertools import product
 from pickle import loads
 
-reaction = loads(data)
-if not isinstance(reaction, ReactionContainer):
-    raise plpy.spiexceptions.DataException('ReactionContainer required')
 
-cgr = ~reaction
-sg = bytes(cgr).hex()
-# test for existing cache
+def load():
+    reaction = loads(data)
+    if not isinstance(reaction, ReactionContainer):
+        raise plpy.spiexceptions.DataException('ReactionContainer required')
+    return ~reaction
+
 
-get_cache = f'''SELECT x.id, array_length(x.reactions, 1) count
-FROM "{schema}"."ReactionSearchCache" x
-WHERE x.operator = 'substructure' AND x.signature = '\\x{sg}'::bytea'''
+GD['cgrdb_check_version']('{schema}:{plans}')
+fingerprints = GD['cgrdb_fingerprints']
+sg = fingerprints.precomputed(precomputed, 'reaction')
+if sg is None:
+    cgr = load()
+    sg = bytes(cgr).hex()
+else:  # signature and fingerprint calculated by client. cached results don't require structure
+    cgr = None
 
-found = plpy.execute(get_cache)
+stats = GD['cgrdb_search_stats']('substructure_reactions')
+
+# test for existing cache
+plan = GD['cgrdb_plan']
+cache = GD['cgrdb_search_cache']('{schema}:{plans}', 'reaction', 'substructure', sg, stats)
+found = cache.lookup(refresh=True)
 if found:
-    return found[0]
+    return found
+refresh = cache.refresh
 
-# cache not found. lets start searching
-fp = GD['cgrdb_rfp'].transform_bitset([cgr])[0]
+if refresh is not None:  # load previous results. concurrent process can evict them
+    cached = cache.results()
+    if cached is None:
+        refresh = None
+    else:
+        seen = set(cached[0])  # reactions with new forms of structures already found
 
-if GD['index']:  # use index search
+# cache not found. lets start searching
+if cgr is None:  # structure is required for verification
+    cgr = load()
+    if bytes(cgr).hex() != sg:
+        raise plpy.spiexceptions.DataException('precomputed signature mismatch')
+    cache.verify = lambda: fingerprints.verify('reaction', sg, cgr)  # screened by client fingerprint
+fp = fingerprints('reaction', sg, cgr)
+
+# most similar structure of each reaction with molecules structures and mapping.
+# rows are ordered by tanimoto in subquery. lateral joins keep this order
+query = '''SELECT h.r, h.t, ms.m, ms.s, ms.d, mr.m mm, mr.d md, mr.p
+FROM ({screening}) h
+CROSS JOIN LATERAL (
+    SELECT array_agg(x.molecule) m, array_agg(x.id) s, array_agg(x.structure) d
+    FROM "{schema}"."MoleculeStructure" x
+    WHERE x.id = ANY(h.s)
+) ms
+CROSS JOIN LATERAL (
+    SELECT array_agg(x.molecule ORDER BY x.id) m, array_agg(x.mapping ORDER BY x.id) d,
+           array_agg(x.is_product ORDER BY x.id) p
+    FROM "{schema}"."MoleculeReaction" x
+    WHERE x.reaction = h.r
+) mr'''
+
+if refresh is None and GD['index']:  # use index search. index doesn't contain added structures
     from requests import post
     found = post(f"{GD['index']}/substructure/reaction", json=fp).json()
-    if found:  # create cgrdb_query temp table
-        plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-        if isinstance(found[0], int):  # need to calculate tanimoto
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.reaction r, x.structures s,
-       icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-FROM "{schema}"."ReactionIndex" x
-WHERE x.id = ANY(ARRAY{found}::integer[])''')
-        else:  # tanimoto exists
-            plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.reaction r, x.structures s, f.t
-FROM "{schema}"."ReactionIndex" x,
-     (VALUES {', '.join(f'({s}::integer, {t:.2f}::float)' for s, t in found)}) AS f (s, t)
-WHERE x.id = f.s''')
-else:  # sequential search
-    plpy.execute('DROP TABLE IF EXISTS cgrdb_query')
-    plpy.execute(f'''CREATE TEMPORARY TABLE cgrdb_query ON COMMIT DROP AS
-SELECT x.reaction r, x.structures s,
-       icount(x.fingerprint & ARRAY{fp}::integer[])::float / icount(x.fingerprint | ARRAY{fp}::integer[])::float t
-FROM "{schema}"."ReactionIndex" x
-WHERE x.fingerprint @> ARRAY{fp}::integer[]''')
-    # check for empty results
-    found = plpy.execute('SELECT COUNT(*) FROM cgrdb_query')[0]['count']
-
-if not found:
-    # store empty cache
-    found = plpy.execute(f'''INSERT INTO
-    "{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-    VALUES ('\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, ARRAY[]::integer[], ARRAY[]::real[])
-    ON CONFLICT DO NOTHING
-    RETURNING id, 0 count''')
-
-    # concurrent process stored same query. just reuse it
-    if not found:
-        found = plpy.execute(get_cache)
-    return found[0]
-
-# filter by unique reactions
-plpy.execute('DROP TABLE IF EXISTS cgrdb_filtered')
-plpy.execute('''CREATE TEMPORARY TABLE cgrdb_filtered ON COMMIT DROP AS
-SELECT h.r, h.s, h.t
-FROM (
-    SELECT DISTINCT ON (f.r) f.r, f.s, f.t
-    FROM cgrdb_query f
-    ORDER BY f.r, f.t DESC
-) h
-ORDER BY h.t DESC''')
-
-get_ms = '''SELECT array_agg(ms.molecule) m, array_agg(ms.id) s, array_agg(ms.structure) d
-FROM cgrdb_filtered f JOIN "{schema}"."MoleculeStructure" ms ON ms.id = ANY(f.s)
-GROUP BY f.r'''
-
-get_mp = '''SELECT array_agg(mr.molecule) m, array_agg(mr.mapping) d, array_agg(mr.is_product) p
-FROM cgrdb_filtered f JOIN "{schema}"."MoleculeReaction" mr ON f.r = mr.reaction
-GROUP BY f.r'''
-
-get_rt = 'SELECT f.r, f.t FROM cgrdb_filtered f'
+    stats['candidates'] = len(found)
+    stats.stage('screening')
+
+    if not found:  # store empty cache
+        return cache.store([], [])
+    elif isinstance(found[0], int):  # need to calculate tanimoto
+        found = [(s, None) for s in found]
+
+    indexed = query.replace('{screening}', '''
+    SELECT *
+    FROM (
+        SELECT DISTINCT ON (x.reaction) x.reaction r, x.structures s,
+               coalesce(f.t, icount(x.fingerprint & $3)::float / icount(x.fingerprint | $3)::float) t
+        FROM unnest($1::integer[], $2::real[]) f (s, t)
+        JOIN "{schema}"."ReactionIndex" x ON x.id = f.s
+        ORDER BY x.reaction, t DESC
+    ) o
+    ORDER BY o.t DESC''')
+    indexed = plan('{schema}:{plans}:substructure_reaction_indexed', indexed, ['integer[]', 'real[]', 'integer[]'])
+    rows = plpy.cursor(indexed, [[s for s, _ in found], [t for _, t in found], fp])
+else:  # sequential search. on refresh only structures added after cached search are screened
+    sequential = query.replace('{screening}', '''
+    SELECT *
+    FROM (
+        SELECT DISTINCT ON (x.reaction) x.reaction r, x.structures s,
+               icount(x.fingerprint & $1)::float / icount(x.fingerprint | $1)::float t
+        FROM "{schema}"."ReactionIndex" x
+        WHERE icount(x.fingerprint) >= $2 AND x.fingerprint @> $1 AND x.id > $3
+        ORDER BY x.reaction, t DESC
+    ) o
+    ORDER BY o.t DESC''')
+    sequential = plan('{schema}:{plans}:substructure_reaction_sequential', sequential,
+                      ['integer[]', 'integer', 'integer'])
+    rows = plpy.cursor(sequential, [fp, len(fp), refresh or 0])
+    # screened lazily on rows fetching. number of prescreened candidates is unknown
 
 substructure_limit = GD['substructure_limit']
-cache = lru_cache(GD['cache_size'])(lambda x: loads(s))
+load_structure = lru_cache(GD['cache_size'])(lambda x: loads(s))
+unpack_mapping = GD['cgrdb_unpack_mapping']
 ris, rts = [], []
 found_count = 0
-for ms_row, mp_row, rt_row in zip(plpy.cursor(get_ms), plpy.cursor(get_mp), plpy.cursor(get_rt)):
+stats['checked'] = 0  # candidates verified by isomorphism in both index and sequential searches
+for row in rows:
+    if refresh is not None and row['r'] in seen:
+        continue
+    stats['checked'] += 1
     m2s = defaultdict(list)  # load structures of molecules
-    for mi, si, s in zip(ms_row['m'], ms_row['s'], ms_row['d']):
-        m2s[mi].append(cache(si))
+    for mi, si, s in zip(row['m'], row['s'], row['d']):
+        m2s[mi].append(load_structure(si))
 
     structures = []
     lr = 0
-    for mi, mp, is_p in zip(mp_row['m'], mp_row['d'], mp_row['p']):
+    for mi, mp, is_p in zip(row['mm'], row['md'], row['p']):
         if mp:
-            mp = dict(json_loads(mp))
+            mp = unpack_mapping(mp)
             ms = [x.remap(mp, copy=True) for x in m2s[mi]]
         else:
             ms = m2s[mi]
@@ -130,22 +152,22 @@ for ms_row, mp_row, rt_row in zip(plpy.cursor(get_ms), plpy.cursor(get_mp), plpy
             structures.insert(0, ms)
 
     if any(cgr <= ~ReactionContainer(ms[:lr], ms[lr:]) for ms in product(*structures)):
-        ris.append(rt_row['r'])
-        rts.append(rt_row['t'])
+        ris.append(row['r'])
+        rts.append(row['t'])
         found_count += 1
         if found_count == substructure_limit:
             break
 
-# store found molecules to cache
-found = plpy.execute(f'''INSERT INTO
-"{schema}"."ReactionSearchCache"(signature, operator, date, reactions, tanimotos)
-VALUES ('\\x{sg}'::bytea, 'substructure', CURRENT_TIMESTAMP, ARRAY{ris}::integer[], ARRAY{rts}::real[])
-ON CONFLICT DO NOTHING
-RETURNING id, array_length(reactions, 1) count''')
+stats.stage('verification')
+
+if refresh is not None:  # merge with previously found reactions in tanimoto order
+    from heapq import merge
 
-# concurrent process stored same query. just reuse it
-if not found:
-    found = plpy.execute(get_cache)
+    merged = list(merge(zip(*cached), zip(ris, rts),
+                        key=lambda x: x[1], reverse=True))[:substructure_limit]
+    ris = [r for r, _ in merged]
+    rts = [t for _, t in merged]
 
-return found[0]
+# store found reactions to cache
+return cache.store(ris, rts)
 $$ LANGUAGE plpython3u
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+compare two results of run.py. prints relative change of every numeric metric.
+
+    python benchmarks/compare.py old.json new.json
+"""
+from argparse import ArgumentParser, FileType
+from json import load
+
+
+def flatten(data, prefix=''):
+    for k, v in data.items():
+        if isinstance(v, dict):
+            yield from flatten(v, f'{prefix}{k}.')
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield f'{prefix}{k}', v
+
+
+def main():
+    parser = ArgumentParser(description='compare CGRdb benchmark results')
+    parser.add_argument('old', type=FileType())
+    parser.add_argument('new', type=FileType())
+    parser.add_argument('--threshold', '-t', type=float, default=0., help='hide changes less than given percent')
+    args = parser.parse_args()
+
+    old = dict(flatten(load(args.old)))
+    new = dict(flatten(load(args.new)))
+    for k, n in new.items():
+        if k.startswith('meta.') or k not in old:
+            continue
+        o = old[k]
+        change = (n - o) / o * 100 if o else 0.
+        if abs(change) >= args.threshold:
+            print(f'{k:<60} {o:>14.6g} {n:>14.6g} {change:>+8.1f}%')
+
+
+if __name__ == '__main__':
+    main()
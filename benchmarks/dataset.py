@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+synthetic reactions generator. same seed gives same dataset.
+
+    python benchmarks/dataset.py -n 10000 -s 42 -o reactions.rdf
+"""
+from argparse import ArgumentParser, FileType
+from CGRtools.containers import MoleculeContainer, ReactionContainer
+from random import Random
+
+
+def generate_molecule(rnd: Random, size: int, start: int = 1) -> MoleculeContainer:
+    """
+    random acyclic molecule of C, N, O atoms with single bonds. each atom bonded to one of previous atoms,
+    so any first atoms form connected fragment.
+    """
+    molecule = MoleculeContainer()
+    free = {}  # atom: free valence
+    for n in range(start, start + size):
+        element = rnd.choices(('C', 'N', 'O'), (8, 1, 1))[0]
+        molecule.add_atom(element, n)
+        if free:
+            m = rnd.choice([x for x, v in free.items() if v])
+            molecule.add_bond(n, m, 1)
+            free[m] -= 1
+            free[n] = {'C': 3, 'N': 2, 'O': 1}[element]
+        else:
+            free[n] = {'C': 4, 'N': 3, 'O': 2}[element]
+    return molecule
+
+
+def generate_reaction(rnd: Random, min_size: int = 5, max_size: int = 25) -> ReactionContainer:
+    """
+    hydroxylation-like reaction: molecule + water = molecule with additional oxygen atom
+    """
+    reactant = generate_molecule(rnd, rnd.randint(min_size, max_size))
+    water = MoleculeContainer()
+    o = len(reactant) + 1
+    water.add_atom('O', o)
+
+    product = reactant.copy()
+    product.add_atom('O', o)
+    carbons = [n for n, a in reactant.atoms() if a.atomic_symbol == 'C' and a.implicit_hydrogens]
+    product.add_bond(rnd.choice(carbons) if carbons else 1, o, 1)
+    return ReactionContainer([reactant, water], [product])
+
+
+def generate_reactions(size: int, seed: int = 42):
+    rnd = Random(seed)
+    for _ in range(size):
+        yield generate_reaction(rnd)
+
+
+def main():
+    from CGRtools.files import RDFWrite
+
+    parser = ArgumentParser(description='synthetic reactions dataset')
+    parser.add_argument('--size', '-n', type=int, default=10000, help='number of reactions')
+    parser.add_argument('--seed', '-s', type=int, default=42, help='random seed')
+    parser.add_argument('--output', '-o', type=FileType('w'), required=True, help='RDF file')
+    args = parser.parse_args()
+
+    with RDFWrite(args.output) as f:
+        for r in generate_reactions(args.size, args.seed):
+            f.write(r)
+
+
+if __name__ == '__main__':
+    main()
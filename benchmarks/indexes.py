@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+SubstructureIndex and SimilarityIndex benchmark without postgres.
+sweeps SimilarityIndex params and reports build time, memory, latency and recall against exact Tanimoto search.
+recommends params with best recall in latency budget.
+
+fingerprints are synthetic, taken from `cgrdb index` dump or JSON lines file of [id, [bits]] pairs:
+
+    python benchmarks/indexes.py -n 100000 --num-perm 32 64 128 --threshold .5 .6 .7 -b 5 -o params.json
+    python benchmarks/indexes.py --dump index.dump --target molecule
+"""
+from argparse import ArgumentParser, FileType
+from json import dump, loads
+from os import environ
+from pickle import dumps, load
+from random import Random
+from statistics import median
+from sys import stderr
+from time import perf_counter
+
+
+environ.setdefault('TQDM_DISABLE', '1')  # index builders report progress
+
+
+def synthetic(size, seed=42, length=4096, min_bits=30, max_bits=150, family=20):
+    """
+    fingerprints grouped in families of similar records, like series of analogs in real datasets
+    """
+    rnd = Random(seed)
+    space = range(length)
+    fps = []
+    while len(fps) < size:
+        base = rnd.sample(space, rnd.randint(min_bits, max_bits))
+        for _ in range(rnd.randint(1, family)):
+            fp = set(rnd.sample(base, int(len(base) * rnd.uniform(.7, 1.))))  # drop part of bits
+            fp.update(rnd.sample(space, int(len(base) * rnd.uniform(0., .2))))  # and add some noise
+            fps.append((len(fps) + 1, sorted(fp)))
+            if len(fps) == size:
+                break
+    return fps
+
+
+def from_dump(file, target):
+    indexes = load(file)
+    index = indexes[2] if target == 'molecule' else indexes[3]  # similarity indexes
+    if index._fingerprints is None:
+        raise ValueError('index dump built without check_threshold. fingerprints not stored')
+    return [(n, list(fp)) for n, fp in zip(index._ids, index._fingerprints)]
+
+
+def from_jsonl(file):
+    return [tuple(loads(x)) for x in file if x.strip()]
+
+
+def rss():
+    from CGRdb.index.metrics import rss
+    return rss()
+
+
+def latency(times):
+    times = sorted(times)
+    n = len(times) - 1
+    return {'mean': sum(times) / len(times), 'median': median(times), 'p90': times[int(n * .9)],
+            'p95': times[int(n * .95)], 'p99': times[int(n * .99)], 'max': times[-1]}
+
+
+def ground_truth(fingerprints, queries, target):
+    from pyroaring import BitMap
+
+    fps = [(n, BitMap(fp)) for n, fp in fingerprints]
+    truth = []
+    for q in queries:
+        q = BitMap(q)
+        truth.append({n for n, fp in fps if q.jaccard_index(fp) >= target})
+    return truth
+
+
+def bench_substructure(fingerprints, queries, broad, sort_by_tanimoto):
+    from pyroaring import BitMap
+    from CGRdb.index import SubstructureIndex
+
+    memory = rss()
+    start = perf_counter()
+    index = SubstructureIndex(fingerprints, sort_by_tanimoto)
+    build = perf_counter() - start
+    memory = rss() - memory
+
+    fps = {n: BitMap(fp) for n, fp in fingerprints}
+    results = {'params': {'sort_by_tanimoto': sort_by_tanimoto}, 'build_seconds': build,
+               'rss_bytes': memory, 'pickle_bytes': len(dumps(index))}
+    for name, data in (('fragments', queries), ('broad', broad)):
+        times, found, errors, steps = [], 0, 0, 0
+        for q in data:
+            stats = {}
+            start = perf_counter()
+            res = index.search(q, stats)
+            times.append(perf_counter() - start)
+            found += len(res)
+            steps += stats['steps']
+            bm = BitMap(q)
+            ids = {x[0] for x in res} if sort_by_tanimoto else set(res)
+            errors += len(ids.symmetric_difference(n for n, fp in fps.items() if bm.issubset(fp)))
+        results[name] = {'latency': latency(times), 'found': found / len(data), 'steps': steps / len(data),
+                         'errors': errors}
+    return results
+
+
+def bench_similarity(fingerprints, queries, truth, params):
+    from CGRdb.index import SimilarityIndex
+
+    memory = rss()
+    start = perf_counter()
+    index = SimilarityIndex(fingerprints, **params)
+    build = perf_counter() - start
+    memory = rss() - memory
+
+    times, recall, precision, candidates = [], [], [], 0
+    for q, t in zip(queries, truth):
+        stats = {}
+        start = perf_counter()
+        res = index.search(q, stats)
+        times.append(perf_counter() - start)
+        candidates += stats['candidates']
+        found = {x[0] for x in res} if params['check_threshold'] is not None else set(res)
+        recall.append(len(found & t) / len(t) if t else 1.)
+        precision.append(len(found & t) / len(found) if found else 1.)
+    return {'params': params, 'build_seconds': build, 'rss_bytes': memory, 'pickle_bytes': len(dumps(index)),
+            'latency': latency(times), 'candidates': candidates / len(queries),
+            'recall': sum(recall) / len(recall), 'precision': sum(precision) / len(precision)}
+
+
+def recommend(results, budget, min_recall):
+    """
+    best recall in latency budget (p95, seconds). smallest index preferred from equal recall.
+    """
+    fit = [r for r in results if budget is None or r['latency']['p95'] <= budget]
+    if not fit:  # budget unreachable
+        return min(results, key=lambda r: r['latency']['p95'])
+    good = [r for r in fit if r['recall'] >= min_recall]
+    if good:  # enough recall. prefer faster and smaller
+        return min(good, key=lambda r: (r['latency']['p95'], r['pickle_bytes']))
+    return max(fit, key=lambda r: (r['recall'], -r['pickle_bytes']))
+
+
+def main():
+    parser = ArgumentParser(description='CGRdb indexes params benchmark')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--size', '-n', type=int, default=50000, help='number of synthetic fingerprints')
+    source.add_argument('--dump', '-d', type=FileType('rb'), help='`cgrdb index` dump')
+    source.add_argument('--fingerprints', '-f', type=FileType(), help='JSON lines of [id, [bits]]')
+    parser.add_argument('--target', default='molecule', choices=('molecule', 'reaction'), help='index from dump')
+    parser.add_argument('--seed', '-s', type=int, default=42, help='random seed')
+    parser.add_argument('--queries', '-q', type=int, default=200, help='number of queries')
+    parser.add_argument('--tanimoto', '-t', type=float, default=.7, help='similarity of ground truth')
+    parser.add_argument('--num-perm', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--threshold', type=float, nargs='+', default=[.5, .6, .7])
+    parser.add_argument('--check-threshold', type=lambda x: None if x == 'none' else float(x), nargs='+',
+                        default=[.7], help='`none` for disabling Tanimoto check')
+    parser.add_argument('--chunk-size', type=int, nargs='+', default=[10000], help='used with --workers > 1')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='index building processes')
+    parser.add_argument('--budget', '-b', type=float, default=None, help='p95 query latency budget in milliseconds')
+    parser.add_argument('--recall', '-r', type=float, default=.95, help='acceptable recall')
+    parser.add_argument('--output', '-o', type=FileType('w'), default='-', help='JSON results')
+    args = parser.parse_args()
+
+    if args.dump:
+        fingerprints = from_dump(args.dump, args.target)
+    elif args.fingerprints:
+        fingerprints = from_jsonl(args.fingerprints)
+    else:
+        fingerprints = synthetic(args.size, args.seed)
+
+    rnd = Random(args.seed + 1)
+    sample = rnd.sample(fingerprints, min(args.queries, len(fingerprints)))
+    # similar queries: records with perturbed bits
+    queries = [sorted({x for x in fp if rnd.random() > .1}) for _, fp in sample]
+    # substructure queries: subsets of records
+    fragments = [sorted(rnd.sample(fp, max(1, len(fp) // 3))) for _, fp in sample]
+    # broad substructure queries: few bits with many hits
+    broad = [sorted(rnd.sample(fp, min(4, len(fp)))) for _, fp in sample]
+
+    print(f'{len(fingerprints)} fingerprints, {len(queries)} queries. calculating ground truth', file=stderr)
+    truth = ground_truth(fingerprints, queries, args.tanimoto)
+
+    results = {'meta': {'records': len(fingerprints), 'queries': len(queries), 'tanimoto': args.tanimoto,
+                        'budget': args.budget, 'recall': args.recall, 'workers': args.workers,
+                        'truth': sum(len(x) for x in truth) / len(truth)},
+               'substructure': [bench_substructure(fingerprints, fragments, broad, s) for s in (False, True)],
+               'similarity': []}
+
+    for num_perm in args.num_perm:
+        for threshold in args.threshold:
+            for check_threshold in args.check_threshold:
+                for chunk_size in (args.chunk_size if args.workers != 1 else args.chunk_size[:1]):
+                    params = {'num_perm': num_perm, 'threshold': threshold, 'check_threshold': check_threshold,
+                              'n_workers': args.workers, 'chunk_size': chunk_size}
+                    r = bench_similarity(fingerprints, queries, truth, params)
+                    results['similarity'].append(r)
+                    print(f'num_perm={num_perm} threshold={threshold} check_threshold={check_threshold} '
+                          f'chunk_size={chunk_size}: build {r["build_seconds"]:.2f}s, '
+                          f'p95 {r["latency"]["p95"] * 1000:.2f}ms, recall {r["recall"]:.3f}, '
+                          f'precision {r["precision"]:.3f}', file=stderr)
+
+    best = recommend(results['similarity'], args.budget and args.budget / 1000, args.recall)
+    results['recommended'] = best['params']
+    print(f'recommended: {best["params"]}', file=stderr)
+    dump(results, args.output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
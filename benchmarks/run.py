@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+end-to-end benchmark of CGRdb: reactions insertion, index building, index daemon and searches.
+throwaway PostgreSQL cluster is created by initdb in temporary directory if connection is not given.
+postgres binaries (initdb, pg_ctl) with plpython3u and intarray are required.
+
+    python benchmarks/run.py -n 10000 -o results.json
+"""
+from argparse import ArgumentParser, FileType
+from contextlib import contextmanager
+from json import dump, dumps, loads
+from os import environ
+from os.path import join
+from pathlib import Path
+from random import Random
+from resource import getrusage, RUSAGE_CHILDREN
+from shutil import rmtree, which
+from socket import create_connection, socket
+from statistics import mean, median
+from subprocess import DEVNULL, Popen, run
+from sys import executable, stderr
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+from urllib.request import Request, urlopen
+from dataset import generate_reactions
+
+
+launcher = [executable, '-c', 'from CGRdb.CLI import launcher; launcher()']
+
+
+def free_port():
+    with socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=60):
+    for _ in range(timeout * 10):
+        try:
+            create_connection(('127.0.0.1', port)).close()
+            return
+        except OSError:
+            sleep(.1)
+    raise TimeoutError(f'port {port} not opened')
+
+
+def summary(times):
+    times = sorted(times)
+    return {'n': len(times), 'mean': mean(times), 'median': median(times),
+            'p95': times[min(len(times) - 1, int(len(times) * .95))], 'max': times[-1]}
+
+
+@contextmanager
+def postgres(bindir=None):
+    """
+    throwaway postgres cluster
+    """
+    tmp = mkdtemp(prefix='cgrdb_bench_')
+    data = join(tmp, 'data')
+    port = free_port()
+    initdb = join(bindir, 'initdb') if bindir else which('initdb')
+    pg_ctl = join(bindir, 'pg_ctl') if bindir else which('pg_ctl')
+    if not initdb or not pg_ctl:
+        raise FileNotFoundError('initdb and pg_ctl not found. use --bindir or --connection')
+
+    run([initdb, '-D', data, '-U', 'postgres', '--auth=trust'], check=True, stdout=DEVNULL)
+    run([pg_ctl, '-D', data, '-l', join(tmp, 'log'), '-w', 'start',
+         '-o', f"-p {port} -k {tmp} -c listen_addresses='' -c fsync=off"], check=True, stdout=DEVNULL)
+    try:
+        yield {'host': tmp, 'port': port, 'user': 'postgres', 'database': 'postgres'}
+    finally:
+        run([pg_ctl, '-D', data, '-m', 'fast', 'stop'], stdout=DEVNULL)
+        rmtree(tmp, ignore_errors=True)
+
+
+def cli(*args):
+    run([*launcher, *args], check=True)
+
+
+def bench_insert(db, reactions, batch):
+    from pony.orm import db_session
+
+    start = perf_counter()
+    for n in range(0, len(reactions), batch):
+        with db_session:
+            for r in reactions[n: n + batch]:
+                db.Reaction(r)
+    seconds = perf_counter() - start
+    return {'reactions': len(reactions), 'seconds': seconds, 'reactions_per_second': len(reactions) / seconds}
+
+
+def bench_index(connection, schema, dump_file):
+    start = perf_counter()
+    cli('index', '-c', dumps(connection), '-n', schema, '-d', dump_file)
+    seconds = perf_counter() - start
+    return {'seconds': seconds, 'max_rss_bytes': getrusage(RUSAGE_CHILDREN).ru_maxrss * 1024,
+            'dump_bytes': Path(dump_file).stat().st_size}
+
+
+def bench_daemon(db, schema, port, queries):
+    from pony.orm import db_session
+
+    with db_session:
+        mfp = db.select(f'SELECT fingerprint FROM "{schema}"."MoleculeStructure" ORDER BY id LIMIT {queries}')
+        rfp = db.select(f'SELECT fingerprint FROM "{schema}"."ReactionIndex" ORDER BY id LIMIT {queries}')
+
+    results = {}
+    for route, fps in (('substructure/molecule', mfp), ('similarity/molecule', mfp),
+                       ('substructure/reaction', rfp), ('similarity/reaction', rfp)):
+        times = []
+        for fp in fps:
+            request = Request(f'http://127.0.0.1:{port}/{route}', data=dumps(list(fp)).encode(),
+                              headers={'Content-Type': 'application/json'})
+            start = perf_counter()
+            with urlopen(request) as response:
+                response.read()
+            times.append(perf_counter() - start)
+        results[route] = summary(times)
+    return results
+
+
+def bench_search(db, schema, config, queries):
+    from pony.orm import db_session
+
+    def init(cfg):
+        with db_session:
+            db.execute(f'SELECT "{schema}".cgrdb_init_session(\'{dumps(cfg)}\')')
+
+    def clean():
+        with db_session:
+            db.execute(f'TRUNCATE TABLE "{schema}"."MoleculeSearchCache", '
+                       f'"{schema}"."ReactionSearchCache" RESTART IDENTITY CASCADE')
+
+    def measure(search, query):
+        start = perf_counter()
+        with db_session:
+            search(query)
+        return perf_counter() - start
+
+    rnd = Random(1)
+    molecules = [r.reactants[0] for r in queries]
+    fragments = [m.substructure(list(m)[:rnd.randint(3, 6)]) for m in molecules]
+    tasks = {'molecule/exact': (db.Molecule.find_structure, molecules),
+             'molecule/substructure': (db.Molecule.find_substructures, fragments),
+             'molecule/similarity': (db.Molecule.find_similar, molecules),
+             'reaction/exact': (db.Reaction.find_structure, queries),
+             'reaction/substructure': (db.Reaction.find_substructures, queries),
+             'reaction/similarity': (db.Reaction.find_similar, queries)}
+
+    results = {}
+    for mode, cfg in (('sequential', {**config, 'index': None}), ('index', config)):
+        init(cfg)
+        for name, (search, data) in tasks.items():
+            cold, cached = [], []
+            for q in data:
+                clean()
+                cold.append(measure(search, q))
+                cached.append(measure(search, q))
+            results[f'{mode}/{name}'] = {'cold': summary(cold), 'cached': summary(cached)}
+    init(config)
+    return results
+
+
+def bench_calls(connection, schema, config, queries, reactions):
+    """
+    per-call latency of functions in fresh backend. first call includes prepared plans creation
+    """
+    from pickle import dumps as pickle
+    from psycopg2 import Binary, connect, IntegrityError
+
+    rnd = Random(3)
+    molecules = [pickle(r.reactants[0]) for r in queries]
+    fragments = []
+    for r in queries:
+        m = r.reactants[0]
+        fragments.append(pickle(m.substructure(list(m)[:rnd.randint(3, 6)])))
+    tasks = {'exact': ('SELECT "{schema}".cgrdb_search_structure_molecule(%s)', molecules),
+             'substructure/miss': ('SELECT * FROM "{schema}".cgrdb_search_substructure_molecules(%s)', fragments),
+             'substructure/hit': ('SELECT * FROM "{schema}".cgrdb_search_substructure_molecules(%s)', fragments),
+             'insert': ('INSERT INTO "{schema}"."Reaction" (structure) VALUES (%s)', [pickle(r) for r in reactions])}
+
+    db = connect(**connection)
+    db.autocommit = True
+    results = {}
+    with db.cursor() as cursor:
+        cursor.execute(f'SELECT "{schema}".cgrdb_init_session(%s)', (dumps(config),))
+        cursor.execute(f'TRUNCATE TABLE "{schema}"."MoleculeSearchCache" RESTART IDENTITY CASCADE')
+        for name, (query, data) in tasks.items():
+            query = query.replace('{schema}', schema)
+            times = []
+            for x in data:
+                start = perf_counter()
+                try:
+                    cursor.execute(query, (Binary(x),))
+                except IntegrityError:  # random reaction already in db
+                    continue
+                times.append(perf_counter() - start)
+            results[name] = {'first': times[0], **summary(times[1:] or times)}
+    db.close()
+    return results
+
+
+def bench_startup(connection, schema, config, repeats=10):
+    """
+    schema loading and backend session initialization. cold loading uses unique connection params
+    """
+    from CGRdb import load_schema
+    from psycopg2 import connect
+
+    cold, warm, first, repeated = [], [], [], []
+    for n in range(repeats):
+        params = {**connection, 'application_name': f'cgrdb_bench_{n}'}
+        start = perf_counter()
+        load_schema(schema, **params)
+        cold.append(perf_counter() - start)
+        start = perf_counter()
+        load_schema(schema, **params)
+        warm.append(perf_counter() - start)
+
+        db = connect(**connection)
+        db.autocommit = True
+        with db.cursor() as cursor:
+            for times in (first, repeated):
+                start = perf_counter()
+                cursor.execute(f'SELECT "{schema}".cgrdb_init_session(%s)', (dumps(config),))
+                times.append(perf_counter() - start)
+        db.close()
+    return {'load_schema': {'cold': summary(cold), 'warm': summary(warm)},
+            'init_session': {'first': summary(first), 'repeated': summary(repeated)}}
+
+
+def bench_throughput(connection, schema, config, reactions, clients, duration):
+    """
+    sustained throughput of concurrent clients. each query is unique, so searches are not cached
+    """
+    from pickle import dumps as pickle
+    from psycopg2 import Binary, connect
+    from threading import Lock, Thread
+
+    rnd = Random(2)
+    queries = []
+    for r in reactions:
+        m = r.reactants[0]
+        queries.append(('substructure_molecules', pickle(m.substructure(list(m)[:rnd.randint(3, 6)]))))
+        queries.append(('similar_molecules', pickle(m)))
+        queries.append(('substructure_reactions', pickle(r)))
+    rnd.shuffle(queries)
+    queries = iter(queries)
+    lock = Lock()
+    times = {}
+    stop = perf_counter() + duration
+
+    def client():
+        db = connect(**connection)
+        db.autocommit = True
+        with db.cursor() as cursor:
+            cursor.execute(f'SELECT "{schema}".cgrdb_init_session(%s)', (dumps(config),))
+            while perf_counter() < stop:
+                with lock:
+                    try:
+                        function, query = next(queries)
+                    except StopIteration:
+                        break
+                start = perf_counter()
+                cursor.execute(f'SELECT * FROM "{schema}".cgrdb_search_{function}(%s)', (Binary(query),))
+                cursor.fetchall()
+                t = perf_counter() - start
+                with lock:
+                    times.setdefault(function, []).append(t)
+        db.close()
+
+    start = perf_counter()
+    threads = [Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = perf_counter() - start
+    total = sum(len(x) for x in times.values())
+    return {'clients': clients, 'seconds': seconds, 'queries': total, 'queries_per_second': total / seconds,
+            'latency': {k: summary(v) for k, v in times.items()}}
+
+
+def main():
+    parser = ArgumentParser(description='CGRdb end-to-end benchmark')
+    parser.add_argument('--size', '-n', type=int, default=10000, help='number of synthetic reactions')
+    parser.add_argument('--seed', '-s', type=int, default=42, help='dataset random seed')
+    parser.add_argument('--queries', '-q', type=int, default=20, help='number of queries for each search')
+    parser.add_argument('--batch', '-b', type=int, default=100, help='reactions inserted in one transaction')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent clients for throughput test')
+    parser.add_argument('--duration', type=float, default=60., help='throughput test duration in seconds')
+    parser.add_argument('--connection', '-c', type=loads, default=None,
+                        help='existing postgres connection params. throwaway cluster used by default')
+    parser.add_argument('--bindir', default=environ.get('PG_BINDIR'), help='postgres binaries directory')
+    parser.add_argument('--output', '-o', type=FileType('w'), default='-', help='JSON results')
+    args = parser.parse_args()
+
+    from CGRdb import load_schema
+    from importlib.metadata import version
+
+    schema = 'cgrdb_benchmark'
+    index_port = free_port()
+    config = {'index': f'http://127.0.0.1:{index_port}', 'packages': []}
+    reactions = list(generate_reactions(args.size, args.seed))
+    queries = Random(args.seed + 1).sample(reactions, min(args.queries, len(reactions)))
+    results = {'meta': {'cgrdb': version('CGRdb'), 'size': args.size, 'seed': args.seed,
+                        'queries': len(queries), 'batch': args.batch, 'clients': args.clients}}
+
+    tmp = mkdtemp(prefix='cgrdb_bench_')
+    cluster = None if args.connection else postgres(args.bindir)
+    try:
+        connection = args.connection or cluster.__enter__()
+        config_file = join(tmp, 'config.json')
+        with open(config_file, 'w') as f:
+            dump(config, f)
+        cli('init', '-c', dumps(connection))
+        cli('create', '-c', dumps(connection), '-n', schema, '-f', config_file)
+        db = load_schema(schema, **connection)
+
+        print('benchmarking startup', file=stderr)
+        results['startup'] = bench_startup(connection, schema, config)
+
+        print('inserting reactions', file=stderr)
+        results['insert'] = bench_insert(db, reactions, args.batch)
+
+        print('building index', file=stderr)
+        dump_file = join(tmp, 'index.dump')
+        results['index'] = bench_index(connection, schema, dump_file)
+
+        daemon = Popen([*launcher, 'daemon', '-p', dumps({'host': '127.0.0.1', 'port': index_port}), '-d', dump_file],
+                       stdout=DEVNULL)
+        try:
+            wait_port(index_port)
+            print('benchmarking index daemon', file=stderr)
+            results['daemon'] = bench_daemon(db, schema, index_port, len(queries))
+            print('benchmarking searches', file=stderr)
+            results['search'] = bench_search(db, schema, config, queries)
+            print('benchmarking calls overhead', file=stderr)
+            results['calls'] = bench_calls(connection, schema, {**config, 'index': None}, queries,
+                                           list(generate_reactions(len(queries), args.seed + 2)))
+            if args.clients:
+                print('benchmarking concurrent throughput', file=stderr)
+                # sequential search loads database most
+                results['throughput'] = bench_throughput(connection, schema, {**config, 'index': None}, reactions,
+                                                         args.clients, args.duration)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+        db.disconnect()
+    finally:
+        if cluster:
+            cluster.__exit__(None, None, None)
+        rmtree(tmp, ignore_errors=True)
+
+    dump(results, args.output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+import time and CLI startup benchmark. every case is run in fresh interpreter.
+exits with code 1 if median time of any case exceeds budget or heavy modules are imported on startup.
+
+    python benchmarks/startup.py -r 20 -b 150 -o startup.json
+    python benchmarks/compare.py old.json startup.json
+"""
+from argparse import ArgumentParser, FileType
+from json import dump
+from statistics import median
+from subprocess import run, PIPE, DEVNULL
+from sys import executable, stderr, exit
+
+
+cases = {'import': 'import CGRdb',
+         'cli': 'from CGRdb.CLI import launcher',
+         'help': 'import sys; sys.argv = ["cgrdb", "--help"]\nfrom CGRdb.CLI import launcher\ntry:\n    launcher()\n'
+                 'except SystemExit:\n    pass'}
+# modules which should be imported on demand only
+heavy = ('pkg_resources', 'importlib.metadata', 'pony', 'LazyPony', 'CGRtools', 'CGRdb.database',
+         'CGRdb.CLI.main_create')
+
+
+def importtime(code):
+    """
+    cumulative import times of top-level modules in microseconds
+    """
+    err = run([executable, '-X', 'importtime', '-c', code], stdout=DEVNULL, stderr=PIPE,
+              universal_newlines=True, check=True).stderr
+    modules = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[12:].split('|')
+        if not name.startswith('   '):  # nested imports are indented
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def loaded(code):
+    code = f'{code}\nimport sys\nprint(" ".join(sys.modules))'
+    out = run([executable, '-c', code], stdout=PIPE, stderr=DEVNULL, universal_newlines=True, check=True).stdout
+    modules = out.splitlines()[-1].split()
+    return sorted(x for x in modules if x in heavy or x.startswith(tuple(f'{h}.' for h in heavy)))
+
+
+def main():
+    parser = ArgumentParser(description='CGRdb import time benchmark')
+    parser.add_argument('--repeat', '-r', type=int, default=10, help='number of runs of each case')
+    parser.add_argument('--top', '-t', type=int, default=10, help='number of slowest imported modules in report')
+    parser.add_argument('--budget', '-b', type=float, default=None, help='median time budget in milliseconds')
+    parser.add_argument('--output', '-o', type=FileType('w'), default='-', help='JSON results')
+    args = parser.parse_args()
+
+    results = {'meta': {'repeat': args.repeat, 'budget': args.budget}}
+    failed = False
+    for name, code in cases.items():
+        times = [importtime(code) for _ in range(args.repeat)]
+        total = [sum(x.values()) / 1000 for x in times]
+        modules = {}
+        for t in times:
+            for k, v in t.items():
+                modules.setdefault(k, []).append(v / 1000)
+        modules = sorted(((k, median(v)) for k, v in modules.items()), key=lambda x: x[1], reverse=True)
+        heavy_loaded = loaded(code)
+
+        results[name] = {'median_ms': median(total), 'min_ms': min(total), 'max_ms': max(total),
+                         'modules_ms': dict(modules[:args.top])}
+        results['meta'][name] = {'heavy': heavy_loaded}
+        print(f'{name}: median {median(total):.1f}ms, min {min(total):.1f}ms', file=stderr)
+        if heavy_loaded:
+            print(f'{name}: heavy modules imported: {", ".join(heavy_loaded)}', file=stderr)
+            failed = True
+        if args.budget is not None and median(total) > args.budget:
+            print(f'{name}: budget {args.budget}ms exceeded', file=stderr)
+            failed = True
+
+    dump(results, args.output, indent=2)
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
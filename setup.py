@@ -36,9 +36,11 @@ setup(
     python_requires='>=3.8.0',
     entry_points={'console_scripts': ['cgrdb=CGRdb.CLI:launcher']},
     install_requires=['CGRtools>=4.1.6,<4.2', 'LazyPony>=0.3.1,<0.4', 'StructureFingerprint>=1.24',
-                      'CachedMethods>=0.1.4,<0.2', 'pony>=0.7.14,<0.8', 'psycopg2-binary>=2.8.6'],
+                      'CachedMethods>=0.1.4,<0.2', 'pony>=0.7.14,<0.8', 'psycopg2-binary>=2.8.6',
+                      'packaging'],
     extras_require={'autocomplete': ['argcomplete'],
-                    'index': ['pyroaring>=0.2.9', 'aiohttp>=3.7', 'datasketch>=1.5.3', 'tqdm>=4.55']},
+                    'index': ['pyroaring>=0.2.9', 'aiohttp>=3.7', 'datasketch>=1.5.3', 'tqdm>=4.55'],
+                    'aio': ['asyncpg>=0.22']},
     package_data={'CGRdb.sql': [x for x in listdir(Path(__file__).parent / 'CGRdb' / 'sql') if x.endswith('.sql')]},
     long_description=(Path(__file__).parent / 'README.md').open().read(),
     classifiers=['Environment :: Plugins',
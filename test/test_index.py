@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from pickle import dumps, loads
+from pytest import mark, raises
+from random import Random
+from CGRdb.index import MoleculeReactionIndex, SimilarityIndex, SubstructureIndex
+
+
+length = 256
+
+
+def fingerprints(n=300, seed=1):
+    # sparse random fingerprints with some duplicates and common bits
+    random = Random(seed)
+    data = []
+    for i in range(n):
+        if data and random.random() < .1:
+            data.append((i * 2 + 1, data[-1][1]))
+        else:
+            data.append((i * 2 + 1, sorted({*random.sample(range(length), random.randint(5, 40)), 0, 1})))
+    return data
+
+
+def queries(data, seed=2):
+    random = Random(seed)
+    for _, fp in random.sample(data, 30):  # subsets of records
+        yield random.sample(fp, random.randint(1, min(len(fp), 6)))
+    yield [0]
+    yield [0, 1]
+    yield [3, 250, 251, 252, 253]
+    yield [length + 10]  # unknown bit
+
+
+def brute_force(data, query):
+    query = set(query)
+    return {i: len(query) / len(query | set(fp)) for i, fp in data if query.issubset(fp)}
+
+
+@mark.parametrize('verify_limit', [0, 5, 100, 10 ** 6])
+def test_substructure_sorted(verify_limit):
+    data = fingerprints()
+    index = SubstructureIndex(data, True, length)
+    index.verify_limit = verify_limit
+    for q in queries(data):
+        expected = brute_force(data, q)
+        found = index.search(q)
+        assert {i for i, _ in found} == set(expected)
+        assert all(abs(t - expected[i]) < 1e-6 for i, t in found)
+        assert [t for _, t in found] == sorted((t for _, t in found), reverse=True)
+
+
+def test_substructure_unsorted():
+    data = fingerprints()
+    index = SubstructureIndex(data, False)  # posting lists array is extended
+    for q in queries(data):
+        stats = {}
+        found = index.search(q, stats)
+        assert set(found) == set(brute_force(data, q))
+        assert stats['candidates'] == len(found)
+
+
+def test_substructure_pickle():
+    data = fingerprints()
+    index = loads(dumps(SubstructureIndex(data, True, length)))
+    for q in queries(data):
+        assert {i for i, _ in index.search(q)} == set(brute_force(data, q))
+    assert index.stats()['records'] == len(data)
+
+    old = SubstructureIndex.__new__(SubstructureIndex)
+    with raises(ValueError):
+        old.__setstate__({'_index': [], '_fingerprints': None})
+
+
+def test_similarity():
+    data = fingerprints()
+    index = SimilarityIndex(data, check_threshold=.5, threshold=.5)
+    fps = dict(data)
+    for i, fp in data[::10]:
+        found = index.search(fp)
+        assert (i, 1.) in found  # record itself
+        assert [t for _, t in found] == sorted((t for _, t in found), reverse=True)
+        for j, t in found:
+            assert t >= .5
+            assert abs(t - len(set(fp) & set(fps[j])) / len(set(fp) | set(fps[j]))) < 1e-6
+
+    index = loads(dumps(index))
+    assert (data[0][0], 1.) in index.search(data[0][1])
+    with raises(ValueError):
+        SimilarityIndex.__new__(SimilarityIndex).__setstate__({'_lsh': None})
+
+
+def test_paired_ids():
+    # shared fingerprints storage of indexes built from same ordered data
+    data = fingerprints()
+    substructure = SubstructureIndex(data, False, length)
+    similarity = SimilarityIndex(data)
+    assert substructure._ids == similarity._ids
+    substructure._fingerprints = similarity._fingerprints
+    for q in queries(data):
+        assert {i for i, _ in substructure.search(q)} == set(brute_force(data, q))
+
+
+def test_molecule_reaction():
+    random = Random(3)
+    pairs = sorted({(random.randint(1, 30), random.randint(1, 200), random.random() < .5) for _ in range(500)})
+    index = MoleculeReactionIndex(pairs)
+    molecules = random.sample(range(1, 40), 15)
+    tanimotos = sorted((random.random() for _ in molecules), reverse=True)
+
+    for role in (0, 1, 2):
+        expected = {}
+        for m, t in zip(molecules, tanimotos):
+            for pm, r, is_product in pairs:
+                if pm == m and (not role or is_product == (role == 2)):
+                    expected.setdefault(r, t)  # scored by first molecule
+        stats = {}
+        found = index.search({'molecules': molecules, 'tanimotos': tanimotos, 'role': role}, stats)
+        assert dict(zip(found['reactions'], found['tanimotos'])) == expected
+        assert len(found['reactions']) == len(expected)
+        assert found['tanimotos'] == sorted(found['tanimotos'], reverse=True)
+        assert found['watermark'] == max(r for _, r, _ in pairs)
+        assert stats['candidates'] == len({m for m, _, _ in pairs} & set(molecules))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from CGRdb.mapping import pack_mapping, unpack_mapping
+from CGRdb.sql import init_session
+
+
+def test_round_trip():
+    for mapping in ({}, {1: 2}, {1: 3, 2: 1, 3: 2}, {7: 100000, 2 ** 31 - 1: -2 ** 31}):
+        assert unpack_mapping(pack_mapping(mapping)) == mapping
+
+
+def test_big_endian_int32_pairs():
+    assert pack_mapping({1: 2, 258: 3}) == b'\x00\x00\x00\x01\x00\x00\x00\x02\x00\x00\x01\x02\x00\x00\x00\x03'
+    assert unpack_mapping(b'\x00\x00\x00\x05\xff\xff\xff\xff') == {5: -1}
+
+
+def test_db_functions_codec():
+    # session of db functions uses same codec
+    code = init_session.split('# atom-to-atom mapping codec')[1].partition('\n')[2]
+    ns = {}
+    exec(code.split("GD['cgrdb_pack_mapping']")[0].replace('$$', '$'), ns)
+    mapping = {1: 3, 2: 1, 3: 2}
+    assert ns['pack_mapping'](mapping) == pack_mapping(mapping)
+    assert ns['unpack_mapping'](pack_mapping(mapping)) == mapping
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CGRdb.
+#
+#  CGRdb is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from CGRdb.index.metrics import Counter, Histogram, Metrics, gauge
+
+
+def test_histogram():
+    h = Histogram('latency', 'Search latency', (.1, 1.))
+    h.observe('route="a"', .05)
+    h.observe('route="a"', .1)
+    h.observe('route="a"', 5.)
+    h.observe('route="b"', .5)
+    assert h.render() == ['# HELP latency Search latency',
+                          '# TYPE latency histogram',
+                          'latency_bucket{route="a",le="0.1"} 2',
+                          'latency_bucket{route="a",le="1.0"} 2',
+                          'latency_bucket{route="a",le="+Inf"} 3',
+                          'latency_sum{route="a"} 5.15',
+                          'latency_count{route="a"} 3',
+                          'latency_bucket{route="b",le="0.1"} 0',
+                          'latency_bucket{route="b",le="1.0"} 1',
+                          'latency_bucket{route="b",le="+Inf"} 1',
+                          'latency_sum{route="b"} 0.5',
+                          'latency_count{route="b"} 1']
+
+
+def test_counter_and_gauge():
+    c = Counter('requests_total', 'Number of requests')
+    c.inc('route="a"')
+    c.inc('route="a"')
+    c.inc('route="b"')
+    assert c.render() == ['# HELP requests_total Number of requests', '# TYPE requests_total counter',
+                          'requests_total{route="a"} 2', 'requests_total{route="b"} 1']
+    assert gauge('rss', 'Memory', [('', 10), ('route="a"', 1.5)]) == \
+        ['# HELP rss Memory', '# TYPE rss gauge', 'rss 10', 'rss{route="a"} 1.5']
+
+
+class Index:
+    def __init__(self, stats):
+        self._stats = stats
+
+    def stats(self):
+        return self._stats
+
+
+def test_metrics():
+    m = Metrics({'substructure/molecule': Index({'records': 10, 'postings': 3}),
+                 'similarity/molecule': Index({'records': 10, 'buckets': 7, 'largest_bucket': 2})})
+    m.observe('substructure/molecule', .002, 5, {'candidates': 8, 'steps': 3})
+    m.observe('similarity/molecule', .02, 0, {})
+    m.errors.inc('route="similarity/molecule"')
+    text = m.render()
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    assert lines[-2] == '# TYPE cgrdb_index_process_rss_bytes gauge'
+    assert lines[-1].startswith('cgrdb_index_process_rss_bytes ')
+    body = '\n'.join(lines[:-3])
+    assert body.startswith('''# HELP cgrdb_index_requests_total Number of search requests
+# TYPE cgrdb_index_requests_total counter
+cgrdb_index_requests_total{route="substructure/molecule"} 1
+cgrdb_index_requests_total{route="similarity/molecule"} 1
+# HELP cgrdb_index_errors_total Number of failed search requests
+# TYPE cgrdb_index_errors_total counter
+cgrdb_index_errors_total{route="similarity/molecule"} 1
+# HELP cgrdb_index_latency_seconds Search latency
+# TYPE cgrdb_index_latency_seconds histogram
+cgrdb_index_latency_seconds_bucket{route="substructure/molecule",le="0.0005"} 0
+''')
+    assert 'cgrdb_index_candidates_count{route="substructure/molecule"} 1' in lines
+    assert not any(x.startswith('cgrdb_index_candidates_bucket{route="similarity/molecule"') for x in lines)
+    assert 'cgrdb_index_intersection_steps_bucket{route="substructure/molecule",le="4"} 1' in lines
+    assert 'cgrdb_index_intersection_steps_bucket{route="substructure/molecule",le="2"} 0' in lines
+    assert body.endswith('''# HELP cgrdb_index_records Number of indexed records
+# TYPE cgrdb_index_records gauge
+cgrdb_index_records{route="substructure/molecule"} 10
+cgrdb_index_records{route="similarity/molecule"} 10
+# HELP cgrdb_index_postings Number of posting lists of substructure index
+# TYPE cgrdb_index_postings gauge
+cgrdb_index_postings{route="substructure/molecule"} 3
+# HELP cgrdb_index_lsh_buckets Number of LSH buckets of similarity index
+# TYPE cgrdb_index_lsh_buckets gauge
+cgrdb_index_lsh_buckets{route="similarity/molecule"} 7
+# HELP cgrdb_index_lsh_largest_bucket Size of largest LSH bucket
+# TYPE cgrdb_index_lsh_largest_bucket gauge
+cgrdb_index_lsh_largest_bucket{route="similarity/molecule"} 2''')